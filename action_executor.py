@@ -0,0 +1,619 @@
+import json
+import re
+from collections import namedtuple
+from datetime import date, datetime, timedelta
+
+import pandas as pd
+
+import metrics
+from backend import (agenda_page, apply_batch, find_conflicts, find_free_slots, id_lock, intent_cache,
+                     load_events, load_pantry, load_projects, next_event_id)
+from layout import MIN_DURATION
+from llm_gateway import get_gateway
+from storage import WriteBatch
+
+# Schema degli strumenti offerti al modello. Ogni parametro ha un tipo: string,
+# integer, number, date (AAAA-MM-GG) o time (HH:MM); i valori vengono validati e
+# normalizzati prima di toccare i dati
+Param = namedtuple('Param', ['type', 'description', 'required', 'enum'], defaults=(False, None))
+Tool = namedtuple('Tool', ['description', 'params'])
+# Un'azione chiesta dal modello (o dalla cache): nome dello strumento e argomenti
+Action = namedtuple('Action', ['name', 'args'])
+
+EVENT_TYPES = ["general", "meeting", "deadline", "reminder", "recipe", "task", "wellness", "shopping"]
+TASK_STATES = ["da iniziare", "in corso", "completato", "conclusa"]
+
+TOOLS = {
+    'add_event': Tool("Aggiunge al calendario un evento, un appuntamento o un promemoria con data", {
+        'title': Param('string', "Titolo dell'evento", True),
+        'date': Param('date', "Giorno dell'evento", True),
+        'time': Param('time', "Ora di inizio, 09:00 se non indicata"),
+        'end_time': Param('time', "Ora di fine, un'ora dopo l'inizio se non indicata"),
+        'description': Param('string', "Descrizione"),
+        'event_type': Param('string', "Tipo di evento", enum=EVENT_TYPES),
+        'location': Param('string', "Luogo"),
+    }),
+    'modify_event': Tool("Modifica un evento esistente, cercato per titolo (e giorno, se serve)", {
+        'title': Param('string', "Titolo attuale dell'evento", True),
+        'date': Param('date', "Giorno attuale dell'evento"),
+        'new_title': Param('string', "Nuovo titolo"),
+        'new_date': Param('date', "Nuovo giorno"),
+        'new_time': Param('time', "Nuova ora di inizio"),
+        'new_end_time': Param('time', "Nuova ora di fine"),
+        'description': Param('string', "Nuova descrizione"),
+        'location': Param('string', "Nuovo luogo"),
+    }),
+    'delete_event': Tool("Elimina un evento, cercato per titolo (e giorno, se serve)", {
+        'title': Param('string', "Titolo dell'evento", True),
+        'date': Param('date', "Giorno dell'evento"),
+    }),
+    'list_events': Tool("Elenca gli eventi di un giorno o di un periodo", {
+        'date': Param('date', "Primo giorno", True),
+        'end_date': Param('date', "Ultimo giorno, compreso (se diverso dal primo)"),
+    }),
+    'find_free_slot': Tool("Cerca i primi momenti liberi nell'orario di lavoro", {
+        'date': Param('date', "Primo giorno in cui cercare", True),
+        'end_date': Param('date', "Ultimo giorno in cui cercare, compreso"),
+        'duration_minutes': Param('integer', "Durata richiesta in minuti, 60 se non indicata"),
+    }),
+    'add_task': Tool("Aggiunge una task alla lista dei progetti", {
+        'name': Param('string', "Nome della task", True),
+        'description': Param('string', "Descrizione"),
+        'status': Param('string', "Stato iniziale", enum=TASK_STATES),
+        'start_date': Param('date', "Data di inizio"),
+        'end_date': Param('date', "Data di fine"),
+    }),
+    'modify_task': Tool("Modifica nome, descrizione o date di una task esistente", {
+        'name': Param('string', "Nome attuale della task", True),
+        'new_name': Param('string', "Nuovo nome"),
+        'description': Param('string', "Nuova descrizione"),
+        'start_date': Param('date', "Nuova data di inizio"),
+        'end_date': Param('date', "Nuova data di fine"),
+    }),
+    'set_task_status': Tool("Cambia lo stato di una task", {
+        'name': Param('string', "Nome della task", True),
+        'status': Param('string', "Nuovo stato", True, enum=TASK_STATES),
+    }),
+    'delete_task': Tool("Elimina una task", {
+        'name': Param('string', "Nome della task", True),
+    }),
+    'list_tasks': Tool("Elenca le task, eventualmente solo quelle in uno stato", {
+        'status': Param('string', "Stato delle task da mostrare", enum=TASK_STATES),
+    }),
+    'add_pantry_item': Tool("Aggiunge un prodotto alla dispensa", {
+        'name': Param('string', "Nome del prodotto", True),
+        'quantity': Param('number', "Quantità"),
+        'unit': Param('string', "Unità di misura (g, kg, l, pz, ...)"),
+        'category': Param('string', "Categoria"),
+        'expiration_date': Param('date', "Data di scadenza"),
+        'min_quantity': Param('number', "Scorta minima"),
+    }),
+    'modify_pantry_item': Tool("Modifica un prodotto della dispensa (per esempio la quantità)", {
+        'name': Param('string', "Nome del prodotto", True),
+        'quantity': Param('number', "Nuova quantità"),
+        'unit': Param('string', "Nuova unità di misura"),
+        'category': Param('string', "Nuova categoria"),
+        'expiration_date': Param('date', "Nuova data di scadenza"),
+        'min_quantity': Param('number', "Nuova scorta minima"),
+    }),
+    'delete_pantry_item': Tool("Toglie un prodotto dalla dispensa", {
+        'name': Param('string', "Nome del prodotto", True),
+    }),
+    'list_pantry': Tool("Elenca i prodotti della dispensa, eventualmente di una categoria", {
+        'category': Param('string', "Categoria"),
+    }),
+}
+
+# Colonne di progetti.csv e della dispensa corrispondenti ai parametri degli strumenti
+TASK_FIELDS = {'name': 'Nome', 'new_name': 'Nome', 'description': 'Descrizione', 'status': 'Stato',
+               'start_date': 'Data Inizio', 'end_date': 'Data Fine'}
+PANTRY_FIELDS = ['quantity', 'unit', 'category', 'expiration_date', 'min_quantity']
+
+TIME_PATTERN = re.compile(r'^([01]?\d|2[0-3])[:.]([0-5]\d)$')
+JSON_TYPES = {'string': 'string', 'integer': 'integer', 'number': 'number', 'date': 'string', 'time': 'string'}
+
+
+class ActionError(ValueError):
+    """Azioni rifiutate prima di scrivere: errors elenca tutti i problemi trovati"""
+
+    def __init__(self, errors):
+        self.errors = list(errors)
+        super().__init__('; '.join(self.errors))
+
+
+def tool_definitions(names=None):
+    """Strumenti nel formato delle chat completions, con lo schema JSON dei parametri"""
+    tools = []
+    for name in names or TOOLS:
+        tool = TOOLS[name]
+        properties = {}
+        for key, param in tool.params.items():
+            schema = {'type': JSON_TYPES[param.type], 'description': param.description}
+            if param.type == 'date':
+                schema['format'] = 'date'
+            elif param.type == 'time':
+                schema['pattern'] = '^[0-2][0-9]:[0-5][0-9]$'
+            if param.enum:
+                schema['enum'] = param.enum
+            properties[key] = schema
+        tools.append({'type': 'function', 'function': {
+            'name': name,
+            'description': tool.description,
+            'parameters': {
+                'type': 'object',
+                'properties': properties,
+                'required': [key for key, param in tool.params.items() if param.required],
+            },
+        }})
+    return tools
+
+
+def parse_tool_calls(calls):
+    """Azioni dalle chiamate a strumenti del modello (dict con name e arguments in JSON)"""
+    actions, errors = [], []
+    for i, call in enumerate(calls, 1):
+        try:
+            args = json.loads(call['arguments'] or '{}')
+        except ValueError:
+            errors.append(f"azione {i} ({call['name']}): argomenti non validi")
+            continue
+        actions.append(Action(call['name'], args))
+    if errors:
+        raise ActionError(errors)
+    return actions
+
+
+def _coerce(param, value):
+    """Valore convertito al tipo del parametro; ValueError se non è compatibile"""
+    if param.type in ('integer', 'number'):
+        if isinstance(value, bool):
+            raise ValueError("deve essere un numero")
+        try:
+            number = float(str(value).replace(',', '.'))
+        except ValueError:
+            raise ValueError("deve essere un numero") from None
+        if param.type == 'integer':
+            if number != int(number):
+                raise ValueError("deve essere un numero intero")
+            return int(number)
+        return number
+    if not isinstance(value, str):
+        raise ValueError("deve essere un testo")
+    value = value.strip()
+    if param.type == 'date':
+        try:
+            return date.fromisoformat(value[:10]).isoformat()
+        except ValueError:
+            raise ValueError("deve essere una data AAAA-MM-GG") from None
+    if param.type == 'time':
+        match = TIME_PATTERN.match(value)
+        if not match:
+            raise ValueError("deve essere un orario HH:MM")
+        return f"{int(match.group(1)):02d}:{match.group(2)}"
+    if param.enum and value.lower() not in param.enum:
+        raise ValueError(f"deve essere uno tra {', '.join(param.enum)}")
+    return value.lower() if param.enum else value
+
+
+def validate(actions):
+    """Controlla nome e argomenti di ogni azione e li normalizza.
+
+    Gli argomenti non previsti dallo schema vengono ignorati; strumenti sconosciuti,
+    parametri obbligatori mancanti o valori del tipo sbagliato producono un
+    ActionError con tutti i problemi, senza eseguire niente.
+    """
+    valid, errors = [], []
+    for i, action in enumerate(actions, 1):
+        tool = TOOLS.get(action.name)
+        if tool is None:
+            errors.append(f"azione {i}: '{action.name}' non esiste")
+            continue
+        if not isinstance(action.args, dict):
+            errors.append(f"azione {i} ({action.name}): argomenti non validi")
+            continue
+        args = {}
+        for key, param in tool.params.items():
+            value = action.args.get(key)
+            if value is None or value == '':
+                if param.required:
+                    errors.append(f"azione {i} ({action.name}): manca {key}")
+                continue
+            try:
+                args[key] = _coerce(param, value)
+            except ValueError as e:
+                errors.append(f"azione {i} ({action.name}): {key} {e}")
+        valid.append(Action(action.name, args))
+    if errors:
+        raise ActionError(errors)
+    return valid
+
+
+class _Plan:
+    """Stato della preparazione di un blocco di azioni: dati letti una volta sola,
+    id assegnati e nomi aggiunti nel blocco stesso"""
+
+    def __init__(self):
+        self.batch = WriteBatch()
+        self.errors = []
+        self.next_event_id = None
+        self._events = None
+        self._projects = None
+        self._pantry = None
+        self.new_tasks = set()
+        self.new_pantry = set()
+
+    def events(self):
+        if self._events is None:
+            self._events = load_events()
+        return self._events
+
+    def projects(self):
+        if self._projects is None:
+            self._projects = load_projects()
+        return self._projects
+
+    def pantry(self):
+        if self._pantry is None:
+            self._pantry = load_pantry()
+        return self._pantry
+
+    def event_id(self):
+        if self.next_event_id is None:
+            self.next_event_id = next_event_id()
+        self.next_event_id += 1
+        return self.next_event_id - 1
+
+    def conflicts(self, start, end, exclude_id):
+        """Titoli degli eventi che si sovrappongono a [start, end): quelli salvati, tolti gli
+        eliminati o modificati nel blocco, più quelli già aggiunti nel blocco stesso"""
+        removed = set(self.batch.deleted_events) | {exclude_id}
+        saved = find_conflicts(start, end)
+        titles = list(saved.loc[~saved['id'].isin(removed), 'title'].astype(str))
+        end = max(pd.Timestamp(end), pd.Timestamp(start) + MIN_DURATION)
+        for event in self.batch.events:
+            if event['id'] == exclude_id:
+                continue
+            other_start = pd.Timestamp(event['start_datetime'])
+            other_end = max(pd.Timestamp(event['end_datetime']), other_start + MIN_DURATION)
+            if other_start < end and other_end > start:
+                titles.append(str(event['title']))
+        return titles
+
+
+def _find_event(plan, args):
+    """Riga dell'evento con questo titolo (e giorno); None con un errore se manca o è ambiguo"""
+    events = plan.events()
+    titles = events['title'].astype(str).str.casefold()
+    title = args['title'].casefold()
+    matches = events[titles == title]
+    if matches.empty:
+        matches = events[titles.str.contains(title, regex=False)]
+    if 'date' in args:
+        matches = matches[matches['start_datetime'].dt.date == date.fromisoformat(args['date'])]
+    if matches.empty:
+        plan.errors.append(f"nessun evento «{args['title']}»")
+        return None
+    if matches['id'].nunique() > 1:
+        days = ', '.join(sorted({start.strftime('%d/%m') for start in matches['start_datetime']}))
+        plan.errors.append(f"più eventi «{args['title']}» ({days}): indica il giorno")
+        return None
+    return matches.iloc[0]
+
+
+def _find_name(frame, column, name, added):
+    """Nome com'è scritto nella tabella (senza distinguere maiuscole), None se non c'è"""
+    if name.casefold() in {n.casefold() for n in added}:
+        return next(n for n in added if n.casefold() == name.casefold())
+    if column not in frame.columns:
+        return None
+    names = frame[column].dropna().astype(str)
+    found = names[names.str.casefold() == name.casefold()]
+    return found.iloc[0] if not found.empty else None
+
+
+def _event_times(day, start_time, end_time):
+    start = datetime.strptime(f"{day} {start_time or '09:00'}", "%Y-%m-%d %H:%M")
+    end = datetime.strptime(f"{day} {end_time}", "%Y-%m-%d %H:%M") if end_time else start + timedelta(hours=1)
+    return start, max(end, start)
+
+
+def _add_event(plan, args):
+    start, end = _event_times(args['date'], args.get('time'), args.get('end_time'))
+    now = datetime.now()
+    event_id = plan.event_id()
+    conflicts = plan.conflicts(start, end, event_id)
+    plan.batch.add_event({
+        "id": event_id,
+        "title": args['title'],
+        "description": args.get('description', args['title']),
+        "start_datetime": start.strftime("%Y-%m-%d %H:%M"),
+        "end_datetime": end.strftime("%Y-%m-%d %H:%M"),
+        "event_type": args.get('event_type', "general"),
+        "is_all_day": False,
+        "location": args.get('location', ""),
+        "attendees": None,
+        "recurring": None,
+        "created_at": now,
+        "updated_at": now,
+    })
+    response = f"Ho aggiunto '{args['title']}' il {start.strftime('%d/%m alle %H:%M')}."
+    if conflicts:
+        response += f" Attenzione: si sovrappone a {', '.join(conflicts)}."
+    return response
+
+
+def _modify_event(plan, args):
+    event = _find_event(plan, args)
+    if event is None:
+        return None
+    event = {key: (None if value is pd.NA else value) for key, value in event.to_dict().items()}
+    start, end = pd.Timestamp(event['start_datetime']), pd.Timestamp(event['end_datetime'])
+    duration = end - start if pd.notna(end) else timedelta(hours=1)
+    if 'new_date' in args or 'new_time' in args:
+        day = args.get('new_date', start.strftime('%Y-%m-%d'))
+        start = datetime.strptime(f"{day} {args.get('new_time', start.strftime('%H:%M'))}", "%Y-%m-%d %H:%M")
+        end = start + duration
+    if 'new_end_time' in args:
+        end = max(start, datetime.strptime(f"{start.strftime('%Y-%m-%d')} {args['new_end_time']}", "%Y-%m-%d %H:%M"))
+    event.update({
+        "id": int(event['id']),
+        "title": args.get('new_title', event['title']),
+        "start_datetime": start.strftime("%Y-%m-%d %H:%M"),
+        "end_datetime": end.strftime("%Y-%m-%d %H:%M"),
+        "updated_at": datetime.now(),
+    })
+    for key in ('description', 'location'):
+        if key in args:
+            event[key] = args[key]
+    # Il giornale non riscrive le righe: la modifica è eliminazione più aggiunta con lo stesso id
+    plan.batch.delete_event(event['id'])
+    plan.batch.add_event(event)
+    return f"Ho modificato '{event['title']}' ({start.strftime('%d/%m alle %H:%M')})."
+
+
+def _delete_event(plan, args):
+    event = _find_event(plan, args)
+    if event is None:
+        return None
+    plan.batch.delete_event(int(event['id']))
+    return f"Ho eliminato '{event['title']}' del {event['start_datetime'].strftime('%d/%m')}."
+
+
+def _period(args):
+    start = datetime.strptime(args['date'], "%Y-%m-%d")
+    end = datetime.strptime(args.get('end_date', args['date']), "%Y-%m-%d") + timedelta(days=1)
+    return start, max(end, start + timedelta(days=1))
+
+
+def _list_events(plan, args):
+    start, end = _period(args)
+    events, more = agenda_page(start, end, limit=10)
+    if events.empty:
+        return "Nessun impegno nel periodo richiesto."
+    items = ", ".join(
+        f"{pd.Timestamp(s).strftime('%d/%m %H:%M')} {title}" for s, title in zip(events['start_datetime'], events['title'])
+    )
+    return f"Impegni: {items}{' e altri' if more is not None else ''}."
+
+
+def _find_free_slot(plan, args):
+    start, end = _period(args)
+    # Non proporre orari già passati
+    slots = find_free_slots(timedelta(minutes=args.get('duration_minutes', 60)), max(start, datetime.now()), end)
+    if not slots:
+        return "Non ho trovato buchi liberi abbastanza lunghi nell'orario di lavoro."
+    items = ", ".join(f"{s.strftime('%d/%m %H:%M')}-{e.strftime('%H:%M')}" for s, e in slots)
+    return f"Sei libero: {items}."
+
+
+def _task_values(args, keys):
+    return {TASK_FIELDS[key]: args[key] for key in keys if key in args}
+
+
+def _add_task(plan, args):
+    values = {'Nome': args['name'], 'Descrizione': args.get('description', ''), 'Stato': args.get('status', 'da iniziare'),
+              'Data Inizio': args.get('start_date', ''), 'Data Fine': args.get('end_date', '')}
+    plan.batch.append_rows('projects', [values])
+    plan.new_tasks.add(args['name'])
+    return f"Ho aggiunto la task '{args['name']}'."
+
+
+def _existing_task(plan, args):
+    name = _find_name(plan.projects(), 'Nome', args['name'], plan.new_tasks)
+    if name is None:
+        plan.errors.append(f"nessuna task «{args['name']}»")
+    return name
+
+
+def _modify_task(plan, args):
+    name = _existing_task(plan, args)
+    if name is None:
+        return None
+    values = _task_values(args, ['new_name', 'description', 'start_date', 'end_date'])
+    if values:
+        plan.batch.update_rows('projects', 'Nome', name, values)
+    return f"Ho modificato la task '{name}'."
+
+
+def _set_task_status(plan, args):
+    name = _existing_task(plan, args)
+    if name is None:
+        return None
+    plan.batch.update_rows('projects', 'Nome', name, {'Stato': args['status']})
+    return f"Stato della task '{name}' aggiornato a '{args['status']}'."
+
+
+def _delete_task(plan, args):
+    name = _existing_task(plan, args)
+    if name is None:
+        return None
+    plan.batch.delete_rows('projects', 'Nome', name)
+    return f"Ho eliminato la task '{name}'."
+
+
+def _list_tasks(plan, args):
+    tasks = plan.projects()
+    if 'Nome' not in tasks.columns:
+        return "Non ci sono task."
+    tasks = tasks[tasks['Nome'].notna()]
+    if 'status' in args and 'Stato' in tasks.columns:
+        tasks = tasks[tasks['Stato'].astype(str).str.lower() == args['status']]
+    if tasks.empty:
+        return "Non ci sono task."
+    states = tasks['Stato'] if 'Stato' in tasks.columns else [''] * len(tasks)
+    return "Task: " + ", ".join(f"{name} ({state})" for name, state in zip(tasks['Nome'], states)) + "."
+
+
+def _add_pantry_item(plan, args):
+    pantry = plan.pantry()
+    if 'id' in pantry.columns and pantry['id'].notna().any():
+        next_id = int(pantry['id'].max()) + 1 + len(plan.new_pantry)
+    else:
+        next_id = 1 + len(plan.new_pantry)
+    row = {'id': next_id, 'name': args['name']}
+    row.update({key: args[key] for key in PANTRY_FIELDS if key in args})
+    plan.batch.append_rows('pantry', [row])
+    plan.new_pantry.add(args['name'])
+    return f"Ho aggiunto {args['name']} alla dispensa."
+
+
+def _existing_pantry_item(plan, args):
+    name = _find_name(plan.pantry(), 'name', args['name'], plan.new_pantry)
+    if name is None:
+        plan.errors.append(f"nessun prodotto «{args['name']}» in dispensa")
+    return name
+
+
+def _modify_pantry_item(plan, args):
+    name = _existing_pantry_item(plan, args)
+    if name is None:
+        return None
+    values = {key: args[key] for key in PANTRY_FIELDS if key in args}
+    if values:
+        plan.batch.update_rows('pantry', 'name', name, values)
+    return f"Ho aggiornato {name} in dispensa."
+
+
+def _delete_pantry_item(plan, args):
+    name = _existing_pantry_item(plan, args)
+    if name is None:
+        return None
+    plan.batch.delete_rows('pantry', 'name', name)
+    return f"Ho tolto {name} dalla dispensa."
+
+
+def _list_pantry(plan, args):
+    pantry = plan.pantry()
+    if 'name' not in pantry.columns:
+        return "La dispensa è vuota."
+    pantry = pantry[pantry['name'].notna()]
+    if 'category' in args and 'category' in pantry.columns:
+        pantry = pantry[pantry['category'].astype(str).str.casefold() == args['category'].casefold()]
+    if pantry.empty:
+        return "La dispensa è vuota."
+    items = []
+    for row in pantry.itertuples(index=False):
+        quantity = getattr(row, 'quantity', None)
+        unit = getattr(row, 'unit', None)
+        amount = f" {quantity:g}{' ' + unit if isinstance(unit, str) else ''}" if pd.notna(quantity) else ""
+        items.append(f"{row.name}{amount}")
+    return "In dispensa: " + ", ".join(items) + "."
+
+
+HANDLERS = {
+    'add_event': _add_event,
+    'modify_event': _modify_event,
+    'delete_event': _delete_event,
+    'list_events': _list_events,
+    'find_free_slot': _find_free_slot,
+    'add_task': _add_task,
+    'modify_task': _modify_task,
+    'set_task_status': _set_task_status,
+    'delete_task': _delete_task,
+    'list_tasks': _list_tasks,
+    'add_pantry_item': _add_pantry_item,
+    'modify_pantry_item': _modify_pantry_item,
+    'delete_pantry_item': _delete_pantry_item,
+    'list_pantry': _list_pantry,
+}
+
+
+def execute_actions(actions, progress=None):
+    """Valida ed esegue un blocco di azioni; restituisce la risposta per l'utente.
+
+    Prima si preparano tutte le azioni (letture, ricerca di eventi e task, id nuovi),
+    poi le scritture vengono applicate insieme con una sola apply_batch. Se anche una
+    sola azione non è valida o non trova il suo oggetto, ActionError e niente scritto.
+    Le letture vedono i dati come erano prima del blocco.
+    """
+    actions = validate(actions)
+    if progress:
+        progress(f"Esecuzione di {len(actions)} azioni" if len(actions) > 1 else "Esecuzione dell'azione")
+    with id_lock:
+        plan = _Plan()
+        responses = [HANDLERS[action.name](plan, action.args) for action in actions]
+        if plan.errors:
+            raise ActionError(plan.errors)
+        apply_batch(plan.batch)
+    metrics.incr('actions.batch')
+    metrics.incr('actions.count', len(actions))
+    return " ".join(responses)
+
+
+def system_prompt(today=None):
+    """Istruzioni per il modello, con la data di oggi per risolvere "domani", "lunedì", ..."""
+    today = today or date.today()
+    weekdays = ["lunedì", "martedì", "mercoledì", "giovedì", "venerdì", "sabato", "domenica"]
+    return (
+        "Sei l'assistente di Calendar Mentor: gestisci eventi del calendario, task dei progetti e dispensa. "
+        f"Oggi è {weekdays[today.weekday()]} {today.isoformat()}. "
+        "Usa gli strumenti per ogni operazione richiesta: se il messaggio chiede più operazioni "
+        "(per esempio tre task in tre giorni diversi) chiama più strumenti nella stessa risposta. "
+        "Le date vanno nel formato AAAA-MM-GG e gli orari HH:MM. "
+        "Se il messaggio non chiede nessuna operazione, rispondi brevemente in italiano."
+    )
+
+
+def cache_actions(namespace, text, actions):
+    """Salva in cache l'interpretazione di un comando con una sola azione.
+
+    I blocchi di più azioni non vengono salvati: le loro date (lunedì, martedì, ...)
+    non si riconducono a un'unica data del testo.
+    """
+    if len(actions) == 1:
+        intent_cache.put(namespace, text, actions[0].name, actions[0].args, None)
+
+
+def cached_actions(namespace, text):
+    cached = intent_cache.get(namespace, text)
+    return None if cached is None else [Action(cached[0], cached[1])]
+
+
+def manage_tasks_with_chat(user_message):
+    """Gestisce task, eventi e dispensa via chat: una chiamata al modello, che può chiedere
+    più azioni insieme, e una sola scrittura per tutte; i comandi già visti vengono dalla cache"""
+    try:
+        actions = cached_actions('tasks.tools', user_message)
+        if actions is None:
+            gateway = get_gateway()
+            if gateway is None:
+                return "Mi dispiace, il servizio OpenAI non è configurato correttamente. Controlla le variabili d'ambiente."
+            response = gateway.chat(
+                [{"role": "system", "content": system_prompt()}, {"role": "user", "content": user_message}],
+                tools=tool_definitions(),
+            )
+            message = response.choices[0].message
+            if not message.tool_calls:
+                return message.content or "Azione non riconosciuta"
+            actions = parse_tool_calls(
+                [{'name': call.function.name, 'arguments': call.function.arguments} for call in message.tool_calls]
+            )
+            response = execute_actions(actions)
+            cache_actions('tasks.tools', user_message, actions)
+            return response
+        return execute_actions(actions)
+    except ActionError as e:
+        return f"Non ho eseguito nessuna operazione: {e}."
+    except Exception as e:
+        print(f"Errore nella gestione delle task: {str(e)}")
+        return "Mi dispiace, c'è stato un errore nella gestione delle task."
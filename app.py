@@ -1,13 +1,22 @@
 import streamlit as st
 import pandas as pd
-from backend import add_event, delete_task, chat_with_openai, load_events
+from backend import add_event, agenda_page, EventConflictError, delete_event, delete_task, search_events, chat_with_openai, next_event_id, data_version, id_lock
+from recurrence import build_rule
+import metrics
+from calendar_views import get_event_color, get_view_window, render_agenda
+from calendar_component import calendar_grid
+from prefetch import get_view, prefetch_adjacent
+from command_queue import CommandQueue
 from datetime import datetime, timedelta
-import calendar
 import time
+import html
 
 # Importa il nuovo assistente vocale
 from voice_assistant_v2 import VoiceAssistant
 
+# Tempo di esecuzione dell'intero script (i rerun dei soli frammenti non passano da qui)
+script_start = time.perf_counter()
+
 st.set_page_config(
     page_title="Calendar Mentor",
     page_icon="📅",
@@ -22,6 +31,11 @@ if 'is_recording' not in st.session_state:
 if 'voice_assistant' not in st.session_state:
     st.session_state.voice_assistant = VoiceAssistant()
 
+# Coda dei comandi della sessione: modello, salvataggio e voce girano nei worker
+if 'command_queue' not in st.session_state:
+    assistant = st.session_state.voice_assistant
+    st.session_state.command_queue = CommandQueue(assistant.run_command, speaker=assistant.speak)
+
 # Inizializza la lista dei messaggi nella sessione se non esiste
 if 'chat_messages' not in st.session_state:
     st.session_state.chat_messages = []
@@ -34,20 +48,6 @@ def add_chat_message(message, type="info"):
         "timestamp": datetime.now().strftime("%H:%M:%S")
     })
 
-# Funzione per ottenere il colore del tag in base al tipo di evento
-def get_event_color(event_type):
-    color_map = {
-        "general": "#039BE5",    # Blu chiaro
-        "meeting": "#7986CB",    # Indaco
-        "deadline": "#EF5350",   # Rosso
-        "reminder": "#33B679",   # Verde
-        "recipe": "#8E24AA",     # Viola
-        "task": "#F4511E",       # Arancione
-        "wellness": "#0B8043",   # Verde scuro
-        "shopping": "#E67C73"    # Rosa
-    }
-    return color_map.get(event_type, "#616161")  # Grigio come default
-
 # Stili CSS personalizzati
 st.markdown("""
 <style>
@@ -355,8 +355,75 @@ st.markdown("""
 # Layout principale
 st.markdown("<h1 style='text-align: center; color: #1a73e8; margin-bottom: 2rem;'>📅 Calendar Mentor</h1>", unsafe_allow_html=True)
 
-# Chat a comparsa sulla destra
-chat_html = """
+# Chat e comando vocale: un nuovo messaggio riesegue solo questo frammento. Finché ci
+# sono comandi in corso il frammento si riesegue da solo per mostrarne l'avanzamento
+COMMAND_POLL_INTERVAL = 0.5
+
+def describe_path(outcome):
+    """Da dove è arrivata la risposta e quanto tempo ha fatto risparmiare il parser locale"""
+    if outcome.path == 'local':
+        saved = f", ~{outcome.saved_ms / 1000:.1f} s risparmiati" if outcome.saved_ms else ""
+        return f"⚡ interpretato in locale ({outcome.elapsed_ms:.1f} ms{saved})"
+    if outcome.path == 'cache':
+        saved = f", ~{outcome.saved_ms / 1000:.1f} s risparmiati" if outcome.saved_ms else ""
+        return f"♻️ interpretazione dalla cache ({outcome.elapsed_ms:.1f} ms{saved})"
+    if outcome.path == 'llm':
+        ttft = f", primo testo dopo {outcome.ttft_ms / 1000:.1f} s" if outcome.ttft_ms else ""
+        return f"🤖 interpretato dal modello ({outcome.elapsed_ms / 1000:.1f} s{ttft})"
+    return ""
+command_queue = st.session_state.command_queue
+
+@st.fragment(run_every=COMMAND_POLL_INTERVAL if command_queue.pending() else None)
+@metrics.timer('script.chat')
+def voice_chat_panel():
+    polling = bool(command_queue.pending())
+
+    # Aggiungi il pulsante del microfono nella barra superiore
+    mic_col1, mic_col2, mic_col3 = st.columns([2, 2, 2])
+
+    with mic_col2:
+        # Informazioni sull'input vocale
+        st.markdown("""
+        <div style='margin-bottom: 10px; padding: 8px; border-radius: 4px; background-color: #e3f2fd; border-left: 4px solid #1a73e8;'>
+            ℹ️ Inserisci il tuo comando vocale:
+            <ul style='margin: 5px 0; padding-left: 20px;'>
+                <li>Esempio: "aggiungi task per domani di comprare il latte"</li>
+                <li>Esempio: "elimina task comprare il latte"</li>
+            </ul>
+        </div>
+    """, unsafe_allow_html=True)
+
+        # Campo di input testuale: il comando va in coda e il campo si svuota subito,
+        # così se ne può inviare un altro mentre il primo è ancora in corso
+        with st.form("voice_command_form", clear_on_submit=True, border=False):
+            voice_command = st.text_input("Comando vocale", key="voice_command", placeholder="Inserisci il tuo comando...")
+            submitted = st.form_submit_button("Invia")
+        if submitted and voice_command.strip():
+            command_queue.submit(voice_command.strip())
+            if not polling:
+                # Serve un rerun completo per far partire l'aggiornamento periodico
+                st.rerun()
+
+    # Risultati dei comandi conclusi
+    data_changed = False
+    for command in command_queue.collect():
+        if command.timed_out:
+            add_chat_message(f"⏱️ Tempo scaduto per \"{command.text}\"", "error")
+        elif command.error is not None:
+            add_chat_message(f"❌ Errore: {str(command.error)}", "error")
+        elif command.result.response:
+            add_chat_message(f"✅ {command.result.response}<br><small>{describe_path(command.result)}</small>", "success")
+        else:
+            add_chat_message("⚠️ Nessun comando riconosciuto", "warning")
+        data_changed = data_changed or data_version() != command.data_version
+    in_flight = command_queue.pending()
+    if polling and (data_changed or not in_flight):
+        # Un comando ha modificato i dati (serve anche la griglia) oppure non c'è più
+        # niente da aspettare: il rerun completo ferma l'aggiornamento periodico
+        st.rerun()
+
+    # Chat a comparsa sulla destra (posizione fissa: viene disegnata dopo il comando)
+    chat_html = """
 <div style='position: fixed; right: 20px; top: 80px; width: 300px; max-height: 80vh; 
     background-color: white; border-radius: 10px; box-shadow: 0 2px 10px rgba(0,0,0,0.1); 
     z-index: 1000; overflow: hidden; display: flex; flex-direction: column;'>
@@ -367,15 +434,15 @@ chat_html = """
     <div style='padding: 10px; overflow-y: auto; max-height: calc(80vh - 50px); background-color: #f8f9fa;'>
 """
 
-# Aggiungi i messaggi alla chat
-for msg in st.session_state.chat_messages[-10:]:  # Mostra solo gli ultimi 10 messaggi
-    msg_style = {
-        "info": "background-color: #e3f2fd; border-left: 4px solid #1a73e8;",
-        "success": "background-color: #e8f5e9; border-left: 4px solid #4caf50;",
-        "warning": "background-color: #fff3e0; border-left: 4px solid #ff9800;",
-        "error": "background-color: #ffebee; border-left: 4px solid #f44336;"
-    }
-    chat_html += f"""
+    # Aggiungi i messaggi alla chat
+    for msg in st.session_state.chat_messages[-10:]:  # Mostra solo gli ultimi 10 messaggi
+        msg_style = {
+            "info": "background-color: #e3f2fd; border-left: 4px solid #1a73e8;",
+            "success": "background-color: #e8f5e9; border-left: 4px solid #4caf50;",
+            "warning": "background-color: #fff3e0; border-left: 4px solid #ff9800;",
+            "error": "background-color: #ffebee; border-left: 4px solid #f44336;"
+        }
+        chat_html += f"""
         <div style='margin-bottom: 8px; padding: 8px; border-radius: 8px; 
             font-size: 0.9em; line-height: 1.4; {msg_style[msg["type"]]}'>
             {msg['message']}
@@ -383,42 +450,25 @@ for msg in st.session_state.chat_messages[-10:]:  # Mostra solo gli ultimi 10 me
         </div>
     """
 
-chat_html += """
+    # Comandi ancora in corso, con la fase corrente e la risposta del modello man mano che arriva
+    for command in in_flight:
+        partial = f"<br>{html.escape(command.partial)}▌" if command.partial else ""
+        chat_html += f"""
+        <div style='margin-bottom: 8px; padding: 8px; border-radius: 8px; 
+            font-size: 0.9em; line-height: 1.4; background-color: #f1f3f4; border-left: 4px solid #9aa0a6;'>
+            ⏳ {command.text}<br><i>{command.stage}…</i>{partial}
+            <span style='font-size: 0.8em; color: #666; float: right;'>{command.elapsed():.1f} s</span>
+        </div>
+    """
+
+    chat_html += """
     </div>
 </div>
 """
 
-st.markdown(chat_html, unsafe_allow_html=True)
-
-# Aggiungi il pulsante del microfono nella barra superiore
-mic_col1, mic_col2, mic_col3 = st.columns([2, 2, 2])
-
-with mic_col2:
-    # Informazioni sull'input vocale
-    st.markdown("""
-        <div style='margin-bottom: 10px; padding: 8px; border-radius: 4px; background-color: #e3f2fd; border-left: 4px solid #1a73e8;'>
-            ℹ️ Inserisci il tuo comando vocale:
-            <ul style='margin: 5px 0; padding-left: 20px;'>
-                <li>Esempio: "aggiungi task per domani di comprare il latte"</li>
-                <li>Esempio: "elimina task comprare il latte"</li>
-            </ul>
-        </div>
-    """, unsafe_allow_html=True)
+    st.markdown(chat_html, unsafe_allow_html=True)
 
-    # Campo di input testuale
-    voice_command = st.text_input("Comando vocale", key="voice_command", placeholder="Inserisci il tuo comando...")
-    
-    if voice_command:
-        try:
-            # Gestisci il comando vocale
-            response = st.session_state.voice_assistant.handle_voice_command()
-            if response:
-                add_chat_message("✅ Comando elaborato con successo!", "success")
-            else:
-                add_chat_message("⚠️ Nessun comando riconosciuto", "warning")
-        except Exception as e:
-            add_chat_message(f"❌ Errore: {str(e)}", "error")
-        st.rerun()
+voice_chat_panel()
 
 # Controlli del calendario
 col_controls = st.columns([2, 6, 2])
@@ -428,33 +478,34 @@ with col_controls[1]:
     selected_date = st.session_state.date_selector
     st.markdown(f"<h2 style='text-align: center; color: #5f6368;'>{selected_date.strftime('%B %Y').title()}</h2>", unsafe_allow_html=True)
 with col_controls[2]:
-    view_type = st.selectbox("Tipo di vista", ["Mese", "Settimana", "Giorno"], index=0, label_visibility="collapsed")
+    view_type = st.selectbox("Tipo di vista", ["Mese", "Settimana", "Giorno", "Agenda"], index=0, label_visibility="collapsed")
+    # La griglia nel browser riceve solo i dati degli eventi; l'HTML lato server resta come alternativa
+    client_render = st.toggle("Griglia nel browser", value=True, key="client_render")
 
 # Layout principale del calendario
 col_calendar, col_events = st.columns([4, 1])
 
-with col_calendar:
-    # Carica gli eventi
-    events = load_events()
-    if 'start_datetime' in events.columns:
-        events['start_datetime'] = pd.to_datetime(events['start_datetime'], errors='coerce')
-        
-        # Funzioni helper per le diverse viste
-        def get_week_dates(date):
-            # Converte la data in datetime se è un oggetto date
-            if isinstance(date, type(datetime.now().date())):
-                date = datetime.combine(date, datetime.min.time())
-            start = date - timedelta(days=date.weekday())
-            return [(start + timedelta(days=i)).date() for i in range(7)]
-        
-        def get_day_hours():
-            return [f"{i:02d}:00" for i in range(24)]
-        
-        if view_type == "Mese":
+# Opzioni di ripetizione del form: la regola viene salvata una sola volta nella colonna recurring
+REPEAT_OPTIONS = {
+    "Mai": None,
+    "Ogni giorno": "DAILY",
+    "Ogni settimana": "WEEKLY",
+    "Ogni mese": "MONTHLY",
+}
+
+# Griglia: dipende solo da vista, data e versione dei dati (le scritture rieseguono l'intera pagina)
+@st.fragment
+@metrics.timer('script.grid')
+def calendar_grid_panel(view_type, selected_date, client_render):
+    # Vista già preparata dal prefetch se si arriva dal periodo vicino, altrimenti calcolata ora
+    view = get_view(view_type, selected_date, client_render)
+    if view is not None:
+        if client_render:
+            with metrics.timer('render.component'):
+                calendar_grid(view, view_type, selected_date)
+
+        elif view_type == "Mese":
             # Vista mensile
-            month_calendar = calendar.monthcalendar(selected_date.year, selected_date.month)
-            days_of_week = ["Lun", "Mar", "Mer", "Gio", "Ven", "Sab", "Dom"]
-            
             # Stili CSS per il calendario
             st.markdown("""
                 <style>
@@ -526,54 +577,22 @@ with col_calendar:
                         opacity: 0.9;
                         box-shadow: 0 2px 4px rgba(0,0,0,0.2);
                     }
+                    /* Eventi di più giorni: continuazione e righe vuote per allinearli */
+                    .calendar .event.continued {
+                        opacity: 0.75;
+                    }
+                    .calendar .event-spacer {
+                        height: 18px;
+                        margin: 1px 0;
+                    }
                 </style>
             """, unsafe_allow_html=True)
             
-            # Genera il calendario in formato tabella
-            calendar_html = '<table class="calendar">'
-            
-            # Header con i giorni della settimana
-            calendar_html += '<tr>'
-            for day in days_of_week:
-                calendar_html += f'<th>{day}</th>'
-            calendar_html += '</tr>'
-            
-            # Griglia del calendario
-            for week in month_calendar:
-                calendar_html += '<tr>'
-                for day in week:
-                    if day == 0:
-                        calendar_html += '<td></td>'
-                    else:
-                        current_date = datetime(selected_date.year, selected_date.month, day).date()
-                        is_today = current_date == datetime.today().date()
-                        
-                        calendar_html += f'<td class="{"today" if is_today else ""}">'
-                        calendar_html += f'<div class="day-number">{day}</div>'
-                        calendar_html += '<div class="events">'
-                        
-                        # Trova gli eventi per questo giorno
-                        day_events = events[events['start_datetime'].dt.date == current_date]
-                        if not day_events.empty:
-                            day_events = day_events.sort_values('start_datetime')
-                            for _, event in day_events.iterrows():
-                                event_color = get_event_color(event['event_type'])
-                                event_time = event['start_datetime'].strftime('%H:%M')
-                                event_display = f"{event_time} {event['title']}" if event_time != "00:00" else event['title']
-                                
-                                calendar_html += f'<div class="event" style="--event-color: {event_color}">{event_display}</div>'
-                        
-                        calendar_html += '</div></td>'
-                calendar_html += '</tr>'
-            
-            calendar_html += '</table>'
-            st.markdown(calendar_html, unsafe_allow_html=True)
+            metrics.gauge('payload.calendar_bytes', len(view.encode()))
+            st.markdown(view, unsafe_allow_html=True)
 
         elif view_type == "Settimana":
             # Vista settimanale
-            week_dates = get_week_dates(selected_date)
-            days_of_week = ["Lun", "Mar", "Mer", "Gio", "Ven", "Sab", "Dom"]
-            
             st.markdown("""
                 <style>
                     .week-calendar {
@@ -595,6 +614,7 @@ with col_calendar:
                         vertical-align: top;
                         height: 40px;
                         width: 14.28%;
+                        position: relative;
                     }
                     .week-calendar .time-column {
                         width: 40px;
@@ -608,6 +628,14 @@ with col_calendar:
                         background-color: #e8f5e9;
                     }
                     .week-calendar .event {
+                        /* Blocchi posizionati dal motore di layout: inizio, durata e corsia */
+                        position: absolute;
+                        top: calc(var(--top) * 100%);
+                        height: calc(var(--span) * 100% - 2px);
+                        left: calc(var(--lane) * 100% / var(--lanes));
+                        width: calc(100% / var(--lanes) - 2px);
+                        box-sizing: border-box;
+                        z-index: 1;
                         background-color: var(--event-color);
                         color: #ffffff !important;  /* Forza il colore bianco */
                         padding: 1px 3px;
@@ -626,48 +654,14 @@ with col_calendar:
                         opacity: 0.9;
                         box-shadow: 0 2px 4px rgba(0,0,0,0.2);
                     }
+                    .week-calendar .event.continued {
+                        opacity: 0.75;
+                    }
                 </style>
             """, unsafe_allow_html=True)
             
-            # Genera il calendario settimanale
-            calendar_html = '<table class="week-calendar">'
-            
-            # Header con le date
-            calendar_html += '<tr><th></th>'
-            for i, date in enumerate(week_dates):
-                is_today = date == datetime.today().date()
-                day_name = days_of_week[i]
-                day_number = date.day
-                calendar_html += f'<th class="{"today" if is_today else ""}">{day_name}<br>{day_number}</th>'
-            calendar_html += '</tr>'
-            
-            # Griglia delle ore (solo dalle 8 alle 20)
-            hours = [f"{i:02d}:00" for i in range(8, 21)]
-            for hour in hours:
-                calendar_html += '<tr>'
-                calendar_html += f'<td class="time-column">{hour}</td>'
-                
-                for date in week_dates:
-                    is_today = date == datetime.today().date()
-                    calendar_html += f'<td class="{"today" if is_today else ""}">'
-                    
-                    # Trova gli eventi per questa ora e data
-                    hour_events = events[
-                        (events['start_datetime'].dt.date == date) & 
-                        (events['start_datetime'].dt.hour == int(hour.split(':')[0]))
-                    ]
-                    
-                    if not hour_events.empty:
-                        for _, event in hour_events.iterrows():
-                            event_color = get_event_color(event['event_type'])
-                            event_display = event['title']
-                            calendar_html += f'<div class="event" style="--event-color: {event_color}">{event_display}</div>'
-                    
-                    calendar_html += '</td>'
-                calendar_html += '</tr>'
-            
-            calendar_html += '</table>'
-            st.markdown(calendar_html, unsafe_allow_html=True)
+            metrics.gauge('payload.calendar_bytes', len(view.encode()))
+            st.markdown(view, unsafe_allow_html=True)
 
         elif view_type == "Giorno":
             # Vista giornaliera
@@ -690,6 +684,7 @@ with col_calendar:
                         border: 1px solid #e0e0e0;
                         vertical-align: top;
                         height: 60px;
+                        position: relative;
                     }
                     .day-calendar .time-column {
                         width: 60px;
@@ -699,6 +694,14 @@ with col_calendar:
                         color: #5f6368;
                     }
                     .day-calendar .event {
+                        /* Blocchi posizionati dal motore di layout: inizio, durata e corsia */
+                        position: absolute;
+                        top: calc(var(--top) * 100%);
+                        height: calc(var(--span) * 100% - 2px);
+                        left: calc(var(--lane) * 100% / var(--lanes));
+                        width: calc(100% / var(--lanes) - 2px);
+                        box-sizing: border-box;
+                        z-index: 1;
                         background-color: var(--event-color);
                         color: #ffffff !important;  /* Forza il colore bianco */
                         padding: 4px 8px;
@@ -715,91 +718,220 @@ with col_calendar:
                     .day-calendar .event:hover {
                         opacity: 0.9;
                     }
+                    .day-calendar .event.continued {
+                        opacity: 0.75;
+                    }
                 </style>
             """, unsafe_allow_html=True)
             
-            # Genera il calendario giornaliero
-            calendar_html = '<table class="day-calendar">'
-            
-            # Header con la data
-            calendar_html += f'<tr><th colspan="2">{selected_date.strftime("%A, %d %B %Y")}</th></tr>'
-            
-            # Griglia delle ore
-            hours = get_day_hours()
-            for hour in hours:
-                calendar_html += '<tr>'
-                calendar_html += f'<td class="time-column">{hour}</td>'
-                calendar_html += '<td>'
-                
-                # Trova gli eventi per questa ora
-                hour_events = events[
-                    (events['start_datetime'].dt.date == selected_date) & 
-                    (events['start_datetime'].dt.hour == int(hour.split(':')[0]))
-                ]
-                
-                if not hour_events.empty:
-                    for _, event in hour_events.iterrows():
-                        event_color = get_event_color(event['event_type'])
-                        event_time = event['start_datetime'].strftime('%H:%M')
-                        event_display = f"{event_time} - {event['title']}"
-                        calendar_html += f'<div class="event" style="--event-color: {event_color}">{event_display}</div>'
-                
-                calendar_html += '</td></tr>'
-            
-            calendar_html += '</table>'
-            st.markdown(calendar_html, unsafe_allow_html=True)
+            metrics.gauge('payload.calendar_bytes', len(view.encode()))
+            st.markdown(view, unsafe_allow_html=True)
+
+    # Mentre l'utente guarda questa vista si preparano la precedente e la successiva
+    prefetch_adjacent(view_type, selected_date, client_render)
+
+# Agenda: elenco degli eventi di un intervallo qualsiasi, una pagina alla volta.
+# Gli elementi della pagina sono sempre gli stessi (una tabella HTML e i comandi),
+# qualunque sia il numero di eventi nell'intervallo
+AGENDA_PAGE_SIZE = 25
+
+def _agenda_move(step, cursor=None):
+    cursors = st.session_state.agenda_cursors
+    if step > 0:
+        cursors.append(cursor)
+    elif len(cursors) > 1:
+        cursors.pop()
+
+@st.fragment
+@metrics.timer('script.agenda')
+def agenda_panel(selected_date):
+    col_from, col_to = st.columns(2)
+    start = col_from.date_input("Dal", value=selected_date, key="agenda_start")
+    end = col_to.date_input("Al", value=selected_date + timedelta(days=90), key="agenda_end")
+
+    # Pila dei cursori delle pagine già viste: si riparte dalla prima se cambia l'intervallo
+    if st.session_state.get('agenda_range') != (start, end):
+        st.session_state.agenda_range = (start, end)
+        st.session_state.agenda_cursors = [None]
+    cursors = st.session_state.agenda_cursors
 
-    with col_events:
-        st.markdown("<div class='sidebar'>", unsafe_allow_html=True)
-        st.markdown("<h3 style='color: #5f6368; margin-bottom: 1rem;'>Eventi del Giorno</h3>", unsafe_allow_html=True)
+    window_start = datetime.combine(start, datetime.min.time())
+    window_end = datetime.combine(end, datetime.min.time()) + timedelta(days=1)
+    events, next_cursor = agenda_page(window_start, window_end, after=cursors[-1], limit=AGENDA_PAGE_SIZE)
+
+    st.markdown("""
+        <style>
+            .agenda {
+                width: 100%;
+                border-collapse: collapse;
+                background: white;
+            }
+            .agenda .agenda-day th {
+                padding: 12px 8px 4px;
+                text-align: left;
+                font-weight: 500;
+                color: #5f6368;
+                border-bottom: 1px solid #e0e0e0;
+                text-transform: capitalize;
+            }
+            .agenda td {
+                padding: 6px 8px;
+                border: none;
+                color: #3c4043;
+                font-size: 14px;
+            }
+            .agenda .time-column {
+                width: 60px;
+                color: #5f6368;
+            }
+            .agenda .agenda-dot {
+                display: inline-block;
+                width: 10px;
+                height: 10px;
+                margin-right: 8px;
+                border-radius: 50%;
+                background-color: var(--event-color);
+            }
+            .agenda .agenda-location {
+                color: #5f6368;
+                text-align: right;
+            }
+        </style>
+    """, unsafe_allow_html=True)
+
+    if events.empty:
+        st.info("Nessun evento in questo intervallo")
+    else:
+        st.markdown(render_agenda(events), unsafe_allow_html=True)
+
+    col_prev, col_page, col_next = st.columns([1, 2, 1])
+    col_prev.button("◀ Precedenti", key="agenda_prev", disabled=len(cursors) == 1,
+                    on_click=_agenda_move, args=(-1,))
+    col_page.caption(f"Pagina {len(cursors)}")
+    col_next.button("Successivi ▶", key="agenda_next", disabled=next_cursor is None,
+                    on_click=_agenda_move, args=(1, next_cursor))
+
+# Barra laterale: eventi del giorno, nuovo evento e prestazioni
+# (al massimo DAY_EVENTS_LIMIT espansori: il resto si vede nella vista Agenda)
+DAY_EVENTS_LIMIT = 10
+
+@st.fragment
+@metrics.timer('script.sidebar')
+def events_sidebar(selected_date):
+    st.markdown("<div class='sidebar'>", unsafe_allow_html=True)
+    st.markdown("<h3 style='color: #5f6368; margin-bottom: 1rem;'>Eventi del Giorno</h3>", unsafe_allow_html=True)
+    
+    # Mostra gli eventi del giorno selezionato
+    day_start, day_end = get_view_window("Giorno", selected_date)
+    day_events, more = agenda_page(day_start, day_end, limit=DAY_EVENTS_LIMIT)
+    if 'start_datetime' in day_events.columns:
+        if not day_events.empty:
+            for _, event in day_events.iterrows():
+                with st.expander(f"{event['start_datetime'].strftime('%H:%M')} - {event['title']}", expanded=True):
+                    st.markdown(f"**Tipo:** {event['event_type'].capitalize()}")
+                    st.markdown(f"**Descrizione:** {event['description']}")
+                    if event['location']:
+                        st.markdown(f"**Luogo:** {event['location']}")
+                    if st.button("🗑️ Elimina", key=f"delete_{event['id']}_{event['start_datetime']}"):
+                        delete_event(event['id'])
+                        st.rerun()
+            if more is not None:
+                st.caption("Altri eventi in questa data: apri la vista Agenda")
+        else:
+            st.info("Nessun evento per questa data")
+
+    # Form per aggiungere un nuovo evento
+    st.markdown("<h3 style='color: #5f6368; margin: 1.5rem 0 1rem;'>Nuovo Evento</h3>", unsafe_allow_html=True)
+    with st.form("new_event_form", clear_on_submit=True):
+        event_name = st.text_input("Titolo", key="event_name")
+        event_type = st.selectbox("Tipo", 
+                                ["general", "meeting", "deadline", "reminder", "recipe", 
+                                 "task", "wellness", "shopping"])
+        event_description = st.text_area("Descrizione", key="event_description")
+        event_start = st.date_input("Data", value=selected_date)
+        event_start_time = st.time_input("Ora")
+        event_location = st.text_input("Luogo (opzionale)")
+        event_repeat = st.selectbox("Ripeti", list(REPEAT_OPTIONS))
+        event_repeat_until = st.date_input("Ripeti fino al (opzionale)", value=None)
+        allow_overlap = st.checkbox("Consenti sovrapposizioni", value=False)
         
-        # Mostra gli eventi del giorno selezionato
-        if 'start_datetime' in events.columns:
-            day_events = events[events['start_datetime'].dt.date == selected_date]
-            if not day_events.empty:
-                for _, event in day_events.iterrows():
-                    with st.expander(f"{event['start_datetime'].strftime('%H:%M')} - {event['title']}", expanded=True):
-                        st.markdown(f"**Tipo:** {event['event_type'].capitalize()}")
-                        st.markdown(f"**Descrizione:** {event['description']}")
-                        if event['location']:
-                            st.markdown(f"**Luogo:** {event['location']}")
-            else:
-                st.info("Nessun evento per questa data")
-
-        # Form per aggiungere un nuovo evento
-        st.markdown("<h3 style='color: #5f6368; margin: 1.5rem 0 1rem;'>Nuovo Evento</h3>", unsafe_allow_html=True)
-        with st.form("new_event_form", clear_on_submit=True):
-            event_name = st.text_input("Titolo", key="event_name")
-            event_type = st.selectbox("Tipo", 
-                                    ["general", "meeting", "deadline", "reminder", "recipe", 
-                                     "task", "wellness", "shopping"])
-            event_description = st.text_area("Descrizione", key="event_description")
-            event_start = st.date_input("Data", value=selected_date)
-            event_start_time = st.time_input("Ora")
-            event_location = st.text_input("Luogo (opzionale)")
-            
-            if st.form_submit_button("Aggiungi Evento"):
-                if event_name and event_description:
-                    new_event = {
-                        "id": len(events) + 1,
-                        "title": event_name,
-                        "start_datetime": f"{event_start} {event_start_time}",
-                        "end_datetime": f"{event_start} {event_start_time}",
-                        "description": event_description,
-                        "event_type": event_type,
-                        "color": get_event_color(event_type),
-                        "is_all_day": False,
-                        "recipe_id": None,
-                        "location": event_location,
-                        "attendees": None,
-                        "recurring": None,
-                        "created_at": pd.Timestamp.now(),
-                        "updated_at": pd.Timestamp.now(),
-                        "name": None
-                    }
-                    add_event(new_event)
+        if st.form_submit_button("Aggiungi Evento"):
+            if event_name and event_description:
+                new_event = {
+                    "id": None,
+                    "title": event_name,
+                    "start_datetime": f"{event_start} {event_start_time}",
+                    "end_datetime": f"{event_start} {event_start_time}",
+                    "description": event_description,
+                    "event_type": event_type,
+                    "color": get_event_color(event_type),
+                    "is_all_day": False,
+                    "recipe_id": None,
+                    "location": event_location,
+                    "attendees": None,
+                    "recurring": build_rule(REPEAT_OPTIONS[event_repeat], until=event_repeat_until) if REPEAT_OPTIONS[event_repeat] else None,
+                    "created_at": pd.Timestamp.now(),
+                    "updated_at": pd.Timestamp.now(),
+                    "name": None
+                }
+                try:
+                    # Stesso lock dei comandi vocali: lettura dell'id massimo e scrittura insieme
+                    with id_lock:
+                        new_event["id"] = next_event_id()
+                        add_event(new_event, on_conflict="warn" if allow_overlap else "reject")
+                except EventConflictError as e:
+                    st.warning(f"⚠️ {e}. Scegli un altro orario o consenti le sovrapposizioni.")
+                else:
                     st.success("✅ Evento aggiunto!")
                     st.rerun()
-                else:
-                    st.error("Compila i campi obbligatori")
-        st.markdown("</div>", unsafe_allow_html=True) 
\ No newline at end of file
+            else:
+                st.error("Compila i campi obbligatori")
+
+    # Strumentazione: tempi di rendering e hit rate delle cache
+    with st.expander("⏱️ Prestazioni", expanded=False):
+        for name, timing in sorted(metrics.snapshot()['timings'].items()):
+            st.caption(f"{name}: ultimo {timing['last_ms']:.1f} ms, media {timing['avg_ms']:.1f} ms ({timing['count']} campioni)")
+        st.caption(f"Cache celle: {metrics.hit_rate('fragment'):.0%} hit")
+        st.caption(f"Cache dati: {metrics.hit_rate('cache'):.0%} hit")
+        st.caption(f"Cache viste (prefetch): {metrics.hit_rate('prefetch'):.0%} hit")
+        st.caption(f"Comandi senza chiamata al modello: {metrics.hit_rate('intent'):.0%}")
+        st.caption(f"Cache interpretazioni: {metrics.hit_rate('intent_cache'):.0%} hit")
+        st.caption(f"Modello: {metrics.counter('llm.calls')} richieste, {metrics.counter('llm.upstream')} al server "
+                   f"({metrics.counter('llm.coalesced')} unite a una in corso, {metrics.counter('llm.cached')} dalla cache)")
+        for name, value in sorted(metrics.snapshot()['gauges'].items()):
+            st.caption(f"{name}: {value:,} byte")
+    st.markdown("</div>", unsafe_allow_html=True)
+
+
+# Ricerca testuale su titolo, descrizione e luogo: rieseguita da sola a ogni digitazione
+@st.fragment
+@metrics.timer('script.search')
+def search_panel():
+    query = st.text_input("🔍 Cerca eventi", key="search_query", placeholder="es. cena amici")
+    if len(query.strip()) < 2:
+        return
+    results = search_events(query, limit=20)
+    if results.empty:
+        st.caption("Nessun evento trovato")
+        return
+    for _, event in results.iterrows():
+        when = pd.to_datetime(event['start_datetime'], errors='coerce')
+        when = when.strftime('%d/%m/%Y %H:%M') if pd.notna(when) else ""
+        where = f" · {event['location']}" if pd.notna(event['location']) and event['location'] else ""
+        st.markdown(f"**{when}** {event['title']}{where}")
+    timing = metrics.snapshot()['timings'].get('search')
+    if timing:
+        st.caption(f"{len(results)} risultati in {timing['last_ms']:.1f} ms")
+
+
+with col_calendar:
+    if view_type == "Agenda":
+        agenda_panel(selected_date)
+    else:
+        calendar_grid_panel(view_type, selected_date, client_render)
+
+with col_events:
+    search_panel()
+    events_sidebar(selected_date)
+
+metrics.record_time('script.app', (time.perf_counter() - script_start) * 1000)
@@ -1,109 +1,389 @@
 import pandas as pd
-import os
 import json
+import threading
+import time
+from contextlib import contextmanager
 from dotenv import load_dotenv
-from openai import OpenAI
+from storage import EVENT_COLUMNS, get_storage
+from event_schema import normalize_events
+from interval_index import EventIntervalIndex
+from search_index import EventSearchIndex, SEARCH_COLUMNS
+from intent_cache import IntentCache
+from layout import MIN_DURATION
+import metrics
+from llm_gateway import get_gateway
 
 # Load environment variables from .env file
 load_dotenv()
-api_key = os.getenv("OPENAI_API_KEY")
-org_id = os.getenv("OPENAI_ORG_ID")
 
-# Initialize OpenAI client with organization ID
-client = None
-if api_key and org_id:
-    try:
-        client = OpenAI(
-            api_key=api_key,
-            organization=org_id
-        )
-    except Exception as e:
-        print(f"Error initializing OpenAI client: {str(e)}")
-        client = None
+# I DataFrame in cache sono condivisi tra le sessioni: con il copy-on-write
+# ogni modifica fatta da una pagina produce una copia privata
+pd.set_option('mode.copy_on_write', True)
 
-def load_events():
-    try:
-        return pd.read_csv('events.csv')
-    except FileNotFoundError:
-        return pd.DataFrame(columns=['id', 'title', 'start_datetime', 'end_datetime', 'description', 'event_type', 'color', 'is_all_day', 'recipe_id', 'location', 'attendees', 'recurring', 'created_at', 'updated_at', 'name'])
+# Backend di persistenza (CSV o SQLite), scelto con CALENDAR_STORAGE
+storage = get_storage()
+
+# Cache di processo dei dati caricati, valida finché non cambiano i file
+# (mtime, dimensione) o il contatore delle scritture fatte dal backend
+_cache = {}
+_cache_lock = threading.Lock()
+_key_locks = {}
+_data_generation = 0
+
+def _cached(key, version, loader):
+    """Restituisce il valore in cache per key se la versione coincide, altrimenti lo ricarica"""
+    version = (version, _data_generation)
+    with _cache_lock:
+        entry = _cache.get(key)
+        if entry is not None and entry[0] == version:
+            metrics.incr('cache.hit')
+            return entry[1]
+        key_lock = _key_locks.setdefault(key, threading.Lock())
+
+    # Una sola sessione ricarica, le altre aspettano e trovano il valore pronto
+    with key_lock:
+        with _cache_lock:
+            entry = _cache.get(key)
+            if entry is not None and entry[0] == version:
+                metrics.incr('cache.hit')
+                return entry[1]
+        metrics.incr('cache.miss')
+        value = loader()
+        with _cache_lock:
+            _cache[key] = (version, value)
+        return value
+
+def _data_changed():
+    """Invalida la cache dopo una scrittura fatta tramite il backend"""
+    global _data_generation
+    metrics.incr('store.write')
+    with _cache_lock:
+        _data_generation += 1
+
+def data_version():
+    """Versione corrente dei dati: cambia a ogni scrittura, del backend o esterna ai file"""
+    return (storage.data_version(), _data_generation)
+
+def cache_stats():
+    """Hit e miss della cache dei loader"""
+    return {
+        'hits': metrics.counter('cache.hit'),
+        'misses': metrics.counter('cache.miss'),
+        'hit_rate': metrics.hit_rate('cache'),
+    }
+
+def _load_table(table):
+    return _cached(table, storage.table_version(table), lambda: storage.load_table(table)).copy(deep=False)
+
+# Colonne che servono alle griglie del calendario: lette senza descrizioni e partecipanti
+GRID_COLUMNS = ['id', 'title', 'start_datetime', 'end_datetime', 'event_type', 'recurring']
+
+# Orario di lavoro (ore di inizio e fine) in cui cercare i buchi liberi
+WORKING_HOURS = (9, 18)
+
+# Interpretazioni dei comandi già chieste al modello, condivise tra sessioni e riavvii
+INTENT_CACHE_FILE = 'intent_cache.json'
+intent_cache = IntentCache(INTENT_CACHE_FILE)
+
+# Indice di ricerca in memoria (backend senza FTS5), aggiornato a ogni scrittura fatta
+# tramite il backend e ricostruito solo se i file cambiano dall'esterno
+SEARCH_RESULT_COLUMNS = ['id', 'start_datetime', 'end_datetime', 'event_type'] + SEARCH_COLUMNS
+_search_index = None
+_search_stamp = None
+_search_lock = threading.Lock()
+
+@contextmanager
+def _search_update():
+    """Restituisce l'indice di ricerca se è allineato ai dati e lo riallinea dopo la scrittura"""
+    global _search_stamp
+    with _search_lock:
+        current = _search_index is not None and _search_stamp == storage.data_version()
+        yield _search_index if current else None
+        if current:
+            _search_stamp = storage.data_version()
+
+def _load_events(columns):
+    # La lettura può compattare il giornale: i file cambiano ma il contenuto no
+    with _search_update():
+        return storage.load_events(columns)
+
+def load_events(columns=None):
+    key = ('events', None if columns is None else tuple(columns))
+    return _cached(key, storage.data_version(), lambda: _load_events(columns)).copy(deep=False)
+
+def search_events(query, limit=50):
+    """Eventi con tutte le parole cercate in titolo, descrizione o luogo, anche come prefisso.
+
+    Accenti e maiuscole sono ignorati; i risultati sono ordinati dal più recente.
+    """
+    global _search_index, _search_stamp
+    with metrics.timer('search'):
+        if getattr(storage, 'full_text', False):
+            return storage.search_events(query, limit)
+        with _search_lock:
+            if _search_index is None or _search_stamp != storage.data_version():
+                events = storage.load_events(SEARCH_RESULT_COLUMNS)
+                _search_stamp = storage.data_version()
+                _search_index = EventSearchIndex(events)
+            return _search_index.search(query, limit)
 
 def load_pantry():
-    try:
-        return pd.read_csv('pantry.csv')
-    except FileNotFoundError:
-        return pd.DataFrame()
+    return _load_table('pantry')
 
 def load_projects():
-    try:
-        return pd.read_csv('progetti.csv')
-    except FileNotFoundError:
-        return pd.DataFrame()
+    return _load_table('projects')
 
 def load_recipes():
-    try:
-        return pd.read_csv('recipes.csv')
-    except FileNotFoundError:
-        return pd.DataFrame()
+    return _load_table('recipes')
+
+def load_wellness():
+    return _load_table('wellness')
 
 def _save_recipes(df):
-    df.to_csv('recipes.csv', index=False)
+    storage.save_table('recipes', df)
+    _data_changed()
 
-def add_event(event):
-    events = load_events()
-    # Converti l'evento in un DataFrame
-    event_df = pd.DataFrame([event])
-    
-    # Usa pd.concat per unire i DataFrame
-    events = pd.concat([events, event_df], ignore_index=True)
-    
-    # Controlla il numero di colonne nel DataFrame
-    expected_columns = ['id', 'title', 'start_datetime', 'end_datetime', 'description', 'event_type', 'color', 'is_all_day', 'recipe_id', 'location', 'attendees', 'recurring', 'created_at', 'updated_at', 'name']
-    
-    # Se il numero di colonne non corrisponde, non impostare i nomi delle colonne
-    if len(events.columns) == len(expected_columns):
-        events.columns = expected_columns
-    
-    # Gestisci i formati misti per 'start_datetime' e 'end_datetime'
-    def parse_datetime(dt):
-        if pd.isna(dt):
-            return pd.NaT
-        try:
-            return pd.to_datetime(dt)
-        except ValueError:
-            # Se non riesce a convertire, prova ad aggiungere un'ora di default
-            return pd.to_datetime(dt + ' 00:00:00', errors='coerce')
+def add_pantry_item(item):
+    storage.append_rows('pantry', [item])
+    _data_changed()
 
-    events['start_datetime'] = events['start_datetime'].apply(parse_datetime)
-    events['end_datetime'] = events['end_datetime'].apply(parse_datetime)
+def add_wellness_entry(entry):
+    storage.append_rows('wellness', [entry])
+    _data_changed()
 
-    # Ordina gli eventi per data e ora di inizio
-    events = events.sort_values(by='start_datetime')
-    
-    events.to_csv('events.csv', index=False)
+class EventConflictError(ValueError):
+    """Evento rifiutato perché si sovrappone ad altri (in conflicts)"""
+
+    def __init__(self, conflicts):
+        self.conflicts = conflicts
+        titles = ', '.join(conflicts['title'].astype(str))
+        super().__init__(f"L'evento si sovrappone a: {titles}")
+
+def find_conflicts(start, end, exclude_id=None):
+    """Eventi che si sovrappongono a [start, end); gli eventi senza durata occupano MIN_DURATION"""
+    start, end = pd.Timestamp(start), pd.Timestamp(end)
+    events, _ = get_event_index(GRID_COLUMNS).overlapping(start, max(end, start + MIN_DURATION), MIN_DURATION)
+    if exclude_id is not None:
+        events = events[events['id'] != exclude_id]
+    return events
+
+def find_free_slots(duration, start, end, limit=3, working_hours=WORKING_HOURS):
+    """Primi `limit` buchi lunghi almeno duration tra start ed end, dentro l'orario di lavoro"""
+    day_start, day_end = (pd.Timedelta(hours=h) for h in working_hours)
+    return get_event_index(GRID_COLUMNS).free_slots(
+        pd.Timedelta(duration), start, end, day_start, day_end, limit=limit, min_duration=MIN_DURATION,
+    )
+
+def add_event(event, on_conflict='ignore'):
+    """Salva un evento. Con on_conflict='warn' o 'reject' controlla prima le sovrapposizioni:
+    'reject' solleva EventConflictError, 'warn' salva comunque. Restituisce gli eventi in conflitto.
+    """
+    conflicts = None
+    if on_conflict != 'ignore':
+        start = pd.Timestamp(event['start_datetime'])
+        end = pd.Timestamp(event.get('end_datetime') or start)
+        conflicts = find_conflicts(start, end, exclude_id=event.get('id'))
+        if on_conflict == 'reject' and not conflicts.empty:
+            raise EventConflictError(conflicts)
+    # Con il backend CSV l'evento finisce in coda al giornale: nessuna riscrittura di events.csv
+    with _search_update() as index:
+        storage.add_event(event)
+        if index is not None:
+            index.add(normalize_events(pd.DataFrame([event])))
+    _data_changed()
+    return conflicts
+
+def delete_event(event_id):
+    """Elimina l'evento con questo id (tutte le occorrenze, se è ricorrente)"""
+    with _search_update() as index:
+        deleted = storage.delete_event(event_id)
+        if index is not None:
+            index.remove(event_id)
+    _data_changed()
+    return deleted
+
+def add_events(events, chunk_size=5000, progress=None):
+    """Importa in blocco un iterabile di eventi (dict o DataFrame) a blocchi di chunk_size.
+
+    Ogni blocco viene normalizzato e validato in modo vettoriale e scritto con una
+    sola operazione, quindi la memoria usata non dipende dalla dimensione dell'input.
+    Le righe senza data di inizio valida vengono scartate. progress, se indicato,
+    viene chiamata con (righe scritte, righe scartate) dopo ogni blocco.
+    Restituisce (righe scritte, righe scartate).
+    """
+    next_id = next_event_id()
+    written = skipped = 0
+
+    def flush(chunk):
+        nonlocal next_id, written, skipped
+        frames = [c for c in chunk if isinstance(c, pd.DataFrame)]
+        records = [c for c in chunk if not isinstance(c, pd.DataFrame)]
+        if records:
+            frames.append(pd.DataFrame(records))
+        frame = normalize_events(pd.concat(frames, ignore_index=True))
+
+        valid = frame['start_datetime'].notna()
+        skipped += int((~valid).sum())
+        frame = frame[valid].copy()
+
+        # Fine mancante o precedente all'inizio: evento puntuale
+        bad_end = frame['end_datetime'].isna() | (frame['end_datetime'] < frame['start_datetime'])
+        frame.loc[bad_end, 'end_datetime'] = frame.loc[bad_end, 'start_datetime']
+        missing_id = frame['id'].isna()
+        frame.loc[missing_id, 'id'] = range(next_id, next_id + int(missing_id.sum()))
+        now = pd.Timestamp.now()
+        frame['created_at'] = frame['created_at'].fillna(now)
+        frame['updated_at'] = frame['updated_at'].fillna(now)
+        frame['is_all_day'] = frame['is_all_day'].fillna(False)
+
+        if not frame.empty:
+            with _search_update() as index:
+                storage.add_events(frame)
+                if index is not None:
+                    index.add(frame)
+            next_id = max(next_id, int(frame['id'].max()) + 1)
+            written += len(frame)
+        if progress:
+            progress(written, skipped)
+
+    chunk, rows = [], 0
+    for item in events:
+        chunk.append(item)
+        rows += len(item) if isinstance(item, pd.DataFrame) else 1
+        if rows >= chunk_size:
+            flush(chunk)
+            chunk, rows = [], 0
+    if chunk:
+        flush(chunk)
+
+    _data_changed()
+    return written, skipped
+
+def apply_batch(batch):
+    """Applica un WriteBatch (eventi, task, dispensa) con una sola scrittura per file.
+
+    L'indice di ricerca e la cache vengono aggiornati una volta per tutto il blocco.
+    Restituisce il numero di eventi eliminati.
+    """
+    if not len(batch):
+        return 0
+    with metrics.timer('store.batch'), _search_update() as index:
+        deleted = storage.apply_batch(batch)
+        if index is not None:
+            for event_id in batch.deleted_events:
+                index.remove(event_id)
+            if batch.events:
+                index.add(normalize_events(pd.DataFrame(batch.events)))
+    _data_changed()
+    return deleted
+
+def compact_events():
+    """Ripiega il giornale degli eventi nello snapshot ordinato"""
+    with _search_update():
+        storage.compact()
+    _data_changed()
+
+def get_event_index(columns=None):
+    """Indice a intervalli sugli eventi, ricostruito solo quando i dati cambiano"""
+    key = ('event_index', None if columns is None else tuple(columns))
+    return _cached(key, storage.data_version(), lambda: EventIntervalIndex(load_events(columns)))
+
+def query_events(start, end, columns=None):
+    """Restituisce gli eventi che si sovrappongono all'intervallo [start, end).
+
+    Con columns=GRID_COLUMNS l'indice è costruito leggendo solo le colonne delle griglie.
+    """
+    return get_event_index(columns).query(start, end)
+
+def agenda_page(start, end, after=None, limit=50):
+    """Una pagina dell'agenda tra start ed end, in ordine di inizio.
+
+    after è il cursore restituito dalla pagina precedente (None per la prima);
+    restituisce (eventi, cursore della pagina successiva o None se è l'ultima).
+    """
+    with metrics.timer('agenda'):
+        return get_event_index().page(start, end, after, limit)
+
+# Assegnazione dei nuovi id e salvataggio vanno fatti insieme quando più comandi
+# girano in parallelo
+id_lock = threading.Lock()
+
+def next_event_id():
+    """Id libero per un nuovo evento"""
+    return get_event_index(GRID_COLUMNS).max_id + 1
 
 def delete_task(task_id):
-    projects = load_projects()
-    projects = projects[projects['id'] != task_id]
-    projects.to_csv('progetti.csv', index=False)
+    # progetti.csv non ha una colonna id: in quel caso la task è identificata dal nome
+    column = 'id' if 'id' in load_projects().columns else 'Nome'
+    storage.delete_rows('projects', column, task_id)
+    _data_changed()
 
 def chat_with_openai(prompt):
     """Funzione per interagire con ChatGPT"""
-    if client is None:
+    gateway = get_gateway()
+    if gateway is None:
         return "Mi dispiace, il servizio OpenAI non è configurato correttamente. Controlla le variabili d'ambiente."
     
     try:
-        response = client.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=[{"role": "user", "content": prompt}]
-        )
+        response = gateway.chat([{"role": "user", "content": prompt}])
         return response.choices[0].message.content
     except Exception as e:
         print(f"Error in chat_with_openai: {str(e)}")
         return "Mi dispiace, c'è stato un errore nella comunicazione con ChatGPT."
 
+class StreamedReply:
+    """Risposta del modello che arriva a pezzi: si itera sui pezzi di testo.
+
+    text contiene sempre tutto quello che è arrivato: se il flusso si interrompe il
+    testo parziale resta, seguito da un avviso, e l'errore finisce in error.
+    ttft_ms è il tempo al primo pezzo, total_ms quello dell'intera risposta;
+    tool_calls le chiamate a strumenti ricevute, a flusso concluso.
+    """
+
+    INTERRUPTED_NOTICE = "\n\n⚠️ La risposta si è interrotta prima della fine."
+
+    def __init__(self, chunks):
+        self._chunks = chunks
+        self._start = time.perf_counter()
+        self.text = ""
+        self.ttft_ms = None
+        self.total_ms = None
+        self.error = None
+        self.tool_calls = []
+
+    def __iter__(self):
+        try:
+            chunks = iter(self._chunks)
+            while True:
+                try:
+                    chunk = next(chunks)
+                except StopIteration as stop:
+                    self.tool_calls = stop.value or []
+                    break
+                if self.ttft_ms is None:
+                    self.ttft_ms = (time.perf_counter() - self._start) * 1000
+                self.text += chunk
+                yield chunk
+        except Exception as e:
+            print(f"Error in chat_with_openai_stream: {str(e)}")
+            self.error = e
+            notice = self.INTERRUPTED_NOTICE if self.text else "Mi dispiace, c'è stato un errore nella comunicazione con ChatGPT."
+            self.text += notice
+            yield notice
+        finally:
+            self.total_ms = (time.perf_counter() - self._start) * 1000
+
+
+def chat_with_openai_stream(prompt):
+    """Come chat_with_openai, ma restituisce uno StreamedReply da mostrare man mano"""
+    gateway = get_gateway()
+    if gateway is None:
+        return StreamedReply(iter(["Mi dispiace, il servizio OpenAI non è configurato correttamente. Controlla le variabili d'ambiente."]))
+    return StreamedReply(gateway.chat_stream([{"role": "user", "content": prompt}]))
+
 def search_recipes(query):
     """Cerca ricette usando OpenAI per interpretare la query"""
-    if client is None:
+    if get_gateway() is None:
         return []
         
     try:
@@ -125,88 +405,3 @@ def search_recipes(query):
     except Exception as e:
         print(f"Errore nella ricerca ricette: {e}")
         return []
-
-def manage_tasks_with_chat(user_message):
-    """Gestisce le task tramite chat con GPT"""
-    if client is None:
-        return "Mi dispiace, il servizio OpenAI non è configurato correttamente. Controlla le variabili d'ambiente."
-        
-    system_prompt = """Sei un assistente che aiuta a gestire le task. Puoi eseguire le seguenti azioni:
-    - AGGIUNGI: Aggiunge una nuova task
-    - MODIFICA: Modifica una task esistente
-    - ELIMINA: Elimina una task
-    - LISTA: Mostra la lista delle task
-    - STATO: Cambia lo stato di una task
-    
-    Analizza il messaggio dell'utente e restituisci un JSON con:
-    {
-        "action": "AGGIUNGI|MODIFICA|ELIMINA|LISTA|STATO",
-        "data": {
-            "nome": "nome task",
-            "descrizione": "descrizione task",
-            "stato": "da iniziare|in corso|completato|conclusa",
-            "data_inizio": "YYYY-MM-DD",
-            "data_fine": "YYYY-MM-DD"
-        }
-    }
-    """
-    
-    try:
-        response = client.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_message}
-            ]
-        )
-        
-        result = response.choices[0].message.content
-        # Pulisci la risposta JSON
-        result = result.strip()
-        if result.startswith("```json"):
-            result = result[7:]
-        if result.endswith("```"):
-            result = result[:-3]
-        result = result.strip()
-        
-        action_data = json.loads(result)
-        
-        # Esegui l'azione richiesta
-        if action_data["action"] == "AGGIUNGI":
-            df = pd.read_csv('progetti.csv')
-            new_task = pd.DataFrame([action_data["data"]])
-            df = pd.concat([df, new_task], ignore_index=True)
-            df.to_csv('progetti.csv', index=False)
-            return "Task aggiunta con successo!"
-            
-        elif action_data["action"] == "MODIFICA":
-            df = pd.read_csv('progetti.csv')
-            task_name = action_data["data"]["nome"]
-            df.loc[df['Nome'] == task_name] = action_data["data"]
-            df.to_csv('progetti.csv', index=False)
-            return "Task modificata con successo!"
-            
-        elif action_data["action"] == "ELIMINA":
-            df = pd.read_csv('progetti.csv')
-            task_name = action_data["data"]["nome"]
-            df = df[df['Nome'] != task_name]
-            df.to_csv('progetti.csv', index=False)
-            return "Task eliminata con successo!"
-            
-        elif action_data["action"] == "LISTA":
-            df = pd.read_csv('progetti.csv')
-            return df.to_string()
-            
-        elif action_data["action"] == "STATO":
-            df = pd.read_csv('progetti.csv')
-            task_name = action_data["data"]["nome"]
-            new_status = action_data["data"]["stato"]
-            df.loc[df['Nome'] == task_name, 'Stato'] = new_status
-            df.to_csv('progetti.csv', index=False)
-            return f"Stato della task '{task_name}' aggiornato a '{new_status}'"
-            
-        return "Azione non riconosciuta"
-        
-    except Exception as e:
-        print(f"Errore nella gestione delle task: {str(e)}")
-        return "Mi dispiace, c'è stato un errore nella gestione delle task." 
\ No newline at end of file
@@ -0,0 +1,380 @@
+"""Benchmark delle operazioni del backend su dati sintetici.
+
+Uso: python benchmark.py <nome>   (es. python benchmark.py add_event)
+Ogni benchmark lavora in una directory temporanea e non tocca i CSV reali.
+"""
+import argparse
+import calendar
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+
+import backend
+import metrics
+from action_executor import execute_actions, parse_tool_calls, tool_definitions
+from backend import SEARCH_RESULT_COLUMNS
+import columnar
+from columnar import read_snapshot, write_snapshot
+from event_schema import normalize_events
+from calendar_views import get_event_color, month_cells, render_agenda, render_month
+from intent_parser import parse_intent, FAST_PATH_CONFIDENCE
+from interval_index import EventIntervalIndex
+from layout import layout_days, layout_hours
+from llm_gateway import LLMGateway
+from llm_stub_server import start_stub_server
+from search_index import EventSearchIndex
+
+
+@contextmanager
+def temp_workdir():
+    """Esegue il blocco in una directory temporanea"""
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        try:
+            yield tmp
+        finally:
+            os.chdir(cwd)
+
+
+def make_events(n, seed=0):
+    """Genera n eventi sintetici distribuiti su circa tre anni"""
+    rng = np.random.default_rng(seed)
+    base = pd.Timestamp('2023-01-01')
+    start = base + pd.to_timedelta(rng.integers(0, 3 * 365 * 24 * 4, n) * 15, unit='min')
+    end = start + pd.to_timedelta(rng.integers(1, 9, n) * 15, unit='min')
+    types = np.array(['general', 'meeting', 'deadline', 'reminder', 'recipe', 'task', 'wellness', 'shopping'])
+    return pd.DataFrame({
+        'id': np.arange(1, n + 1, dtype=float),
+        'title': [f'Evento {i}' for i in range(n)],
+        'start_datetime': start,
+        'end_datetime': end,
+        'description': 'Descrizione di prova',
+        'event_type': types[rng.integers(0, len(types), n)],
+        'color': '',
+        'is_all_day': False,
+        'recipe_id': None,
+        'location': '',
+        'attendees': None,
+        'recurring': None,
+        'created_at': base,
+        'updated_at': base,
+        'name': None,
+    })[backend.EVENT_COLUMNS]
+
+
+def new_event(i):
+    now = pd.Timestamp.now()
+    return {
+        'id': i, 'title': f'Nuovo {i}', 'start_datetime': '2025-03-16 09:00',
+        'end_datetime': '2025-03-16 10:00', 'description': '', 'event_type': 'task',
+        'is_all_day': False, 'created_at': now, 'updated_at': now,
+    }
+
+
+def legacy_add_event(event):
+    """Vecchio add_event: rilegge, riparsa, riordina e riscrive tutto events.csv"""
+    events = pd.read_csv('events.csv')
+    events = pd.concat([events, pd.DataFrame([event])], ignore_index=True)
+    events['start_datetime'] = pd.to_datetime(events['start_datetime'], format='mixed')
+    events['end_datetime'] = pd.to_datetime(events['end_datetime'], format='mixed')
+    events = events.sort_values(by='start_datetime')
+    events.to_csv('events.csv', index=False)
+
+
+def bench_add_event(sizes=(1_000, 10_000, 100_000), writes=200, legacy_writes=5):
+    """Costo di add_event al crescere del numero di eventi: giornale vs riscrittura"""
+    print(f"{'eventi':>10} {'giornale (ms/add)':>20} {'riscrittura (ms/add)':>22}")
+    for n in sizes:
+        with temp_workdir():
+            make_events(n).to_csv('events.csv', index=False)
+            backend.storage.events_journal.compact_threshold = writes + 1
+
+            t0 = time.perf_counter()
+            for i in range(writes):
+                backend.add_event(new_event(i))
+            journal_ms = (time.perf_counter() - t0) / writes * 1000
+
+            t0 = time.perf_counter()
+            for i in range(legacy_writes):
+                legacy_add_event(new_event(i))
+            legacy_ms = (time.perf_counter() - t0) / legacy_writes * 1000
+
+        print(f'{n:>10} {journal_ms:>20.3f} {legacy_ms:>22.1f}')
+
+
+def legacy_render_month(events, year, month):
+    """Vecchia vista mensile: una maschera sull'intera tabella per ogni cella e iterrows"""
+    html = '<table class="calendar">'
+    for week in calendar.monthcalendar(year, month):
+        html += '<tr>'
+        for day in week:
+            if day == 0:
+                html += '<td></td>'
+                continue
+            current_date = pd.Timestamp(year, month, day).date()
+            html += '<td><div class="events">'
+            day_events = events[events['start_datetime'].dt.date == current_date]
+            if not day_events.empty:
+                day_events = day_events.sort_values('start_datetime')
+                for _, event in day_events.iterrows():
+                    event_time = event['start_datetime'].strftime('%H:%M')
+                    event_display = f"{event_time} {event['title']}" if event_time != "00:00" else event['title']
+                    html += f'<div class="event" style="--event-color: {get_event_color(event["event_type"])}">{event_display}</div>'
+            html += '</div></td>'
+        html += '</tr>'
+    return html + '</table>'
+
+
+def bench_month(n=100_000, year=2024, month=3, repeat=5):
+    """Vista mensile a 100k eventi: 42 maschere sull'intera tabella vs finestra + layout"""
+    events = make_events(n)
+    index = EventIntervalIndex(events)
+    start = pd.Timestamp(year, month, 1)
+    end = start + pd.offsets.MonthBegin(1)
+
+    t0 = time.perf_counter()
+    for _ in range(repeat):
+        legacy_render_month(events, year, month)
+    legacy_ms = (time.perf_counter() - t0) / repeat * 1000
+
+    t0 = time.perf_counter()
+    for _ in range(repeat):
+        window = index.query(start, end)
+        render_month(year, month, month_cells(window, layout_days(window, start, end)))
+    bucket_ms = (time.perf_counter() - t0) / repeat * 1000
+
+    print(f'{n} eventi, {index.query(start, end).shape[0]} nel mese')
+    print(f'prima (maschere per cella): {legacy_ms:8.1f} ms')
+    print(f'dopo (finestra + layout):   {bucket_ms:8.1f} ms')
+
+
+def bench_columnar(n=1_000_000, repeat=3):
+    """Dimensione e latenza di lettura: CSV vs snapshot Arrow IPC mappato in memoria"""
+    if columnar.pa is None:
+        print("pyarrow non installato: niente snapshot colonnare da confrontare")
+        return
+    with temp_workdir():
+        events = normalize_events(make_events(n))
+        events.to_csv('events.csv', index=False)
+        write_snapshot('events.arrow', events, (0, 0))
+
+        def timed(fn):
+            t0 = time.perf_counter()
+            for _ in range(repeat):
+                fn()
+            return (time.perf_counter() - t0) / repeat * 1000
+
+        csv_ms = timed(lambda: normalize_events(pd.read_csv('events.csv')))
+        arrow_ms = timed(lambda: read_snapshot('events.arrow', (0, 0)))
+        grid_ms = timed(lambda: read_snapshot('events.arrow', (0, 0), ['start_datetime', 'title', 'event_type']))
+
+        print(f'{n} eventi')
+        print(f"CSV:   {os.path.getsize('events.csv') / 2**20:7.1f} MB  lettura + conversione {csv_ms:8.1f} ms")
+        print(f"Arrow: {os.path.getsize('events.arrow') / 2**20:7.1f} MB  lettura completa      {arrow_ms:8.1f} ms")
+        print(f"Arrow: {'':>10} solo colonne griglia  {grid_ms:8.1f} ms")
+
+
+def bench_layout(sizes=(1_000, 10_000, 100_000)):
+    """Motore di layout: corsie e pezzi per giorno di n eventi nella stessa settimana"""
+    print(f'{"eventi":>10} {"pezzi":>10} {"corsie max":>11} {"ms":>10}')
+    for n in sizes:
+        events = make_events(n)
+        # Comprime tutti gli eventi in una settimana per avere molte sovrapposizioni
+        start = pd.Timestamp('2024-03-04')
+        offset = (events['start_datetime'] - events['start_datetime'].min()) % pd.Timedelta(days=7)
+        duration = events['end_datetime'] - events['start_datetime']
+        events['start_datetime'] = start + offset
+        events['end_datetime'] = events['start_datetime'] + duration
+        t0 = time.perf_counter()
+        segments = layout_hours(events, start, start + pd.Timedelta(days=7))
+        ms = (time.perf_counter() - t0) * 1000
+        print(f'{n:>10} {len(segments):>10} {max(s.lanes for s in segments):>11} {ms:>10.1f}')
+
+
+def bench_search(n=1_000_000, repeat=20):
+    """Ricerca full-text a 1M eventi: str.contains su tutta la tabella vs indice invertito"""
+    words = np.array([
+        'cena', 'pranzo', 'riunione', 'caffè', 'palestra', 'dentista', 'compleanno', 'città',
+        'università', 'progetto', 'spesa', 'cinema', 'amici', 'famiglia', 'lavoro', 'viaggio',
+        'andrea', 'lucia', 'marco', 'giulia', 'ufficio', 'casa', 'centro', 'stazione',
+    ])
+    rng = np.random.default_rng(1)
+    events = make_events(n)
+    events['title'] = pd.Series(words[rng.integers(0, len(words), n)]) + ' ' + pd.Series(words[rng.integers(0, len(words), n)]) + ' ' + events['id'].astype(int).astype(str)
+    events['location'] = pd.Series(words[rng.integers(0, len(words), n)])
+
+    t0 = time.perf_counter()
+    index = EventSearchIndex(events[SEARCH_RESULT_COLUMNS])
+    print(f'{n} eventi, indice costruito in {time.perf_counter() - t0:.1f} s')
+
+    print(f'{"query":<22} {"risultati":>10} {"contains ms":>12} {"indice ms":>10}')
+    for query in ('caffe', 'univ', 'cena amici', 'cena am', '123456', 'lucia staz'):
+        t0 = time.perf_counter()
+        mask = np.ones(n, dtype=bool)
+        for term in query.split():
+            mask &= events['title'].str.contains(term, case=False).to_numpy()
+        contains_ms = (time.perf_counter() - t0) * 1000
+        t0 = time.perf_counter()
+        for _ in range(repeat):
+            found = index.search(query)
+        index_ms = (time.perf_counter() - t0) / repeat * 1000
+        print(f'{query:<22} {len(found):>10} {contains_ms:>12.1f} {index_ms:>10.2f}')
+
+
+def bench_agenda(n=1_000_000, page_size=25, pages=20):
+    """Agenda su un anno a 1M eventi: intera finestra + iterrows vs pagine con cursore"""
+    index = EventIntervalIndex(make_events(n))
+    start, end = pd.Timestamp('2024-01-01'), pd.Timestamp('2025-01-01')
+
+    t0 = time.perf_counter()
+    window = index.query(start, end)
+    rows = sum(1 for _ in window.iterrows())
+    full_ms = (time.perf_counter() - t0) * 1000
+
+    t0 = time.perf_counter()
+    cursor = None
+    for _ in range(pages):
+        page, cursor = index.page(start, end, cursor, page_size)
+        render_agenda(page)
+    page_ms = (time.perf_counter() - t0) / pages * 1000
+
+    print(f'{n} eventi, {rows} nell\'anno')
+    print(f'intera finestra + iterrows: {full_ms:8.1f} ms')
+    print(f'pagina da {page_size} eventi:     {page_ms:8.2f} ms')
+
+
+def bench_intent(repeat=2000):
+    """Parser locale dei comandi: microsecondi per comando e quota servita senza modello"""
+    commands = [
+        "aggiungi task per domani di comprare il latte",
+        "elimina task comprare il latte",
+        "ricordami di chiamare la mamma venerdì alle 18.30",
+        "crea una riunione con Marco dopodomani dalle 10 alle 11:30",
+        "trova un buco domani per 2 ore",
+        "cosa ho domani",
+        "qual è il prossimo impegno",
+        "aggiungi palestra ogni lunedì alle 19",
+        "sposta la cena di sabato a domenica",
+        "scrivimi una lista della spesa per una cena vegana",
+    ]
+    print(f"{'comando':<60} {'us':>8}  strada")
+    local = 0
+    for text in commands:
+        t0 = time.perf_counter()
+        for _ in range(repeat):
+            intent = parse_intent(text)
+        us = (time.perf_counter() - t0) / repeat * 1e6
+        fast = intent is not None and intent.confidence >= FAST_PATH_CONFIDENCE
+        local += fast
+        print(f"{text:<60} {us:>8.1f}  {'locale' if fast else 'modello'}")
+    print(f"{local}/{len(commands)} comandi serviti in locale")
+
+
+def bench_llm(requests=60, clients=16, latency=0.2, error_rate=0.1):
+    """Gateway del modello contro il server finto: frequenza, concorrenza e nuovi tentativi"""
+    server, state, base_url = start_stub_server(latency=latency, error_rate=error_rate)
+    gateway = LLMGateway('chiave-finta', base_url=base_url, rate=20, burst=5, max_in_flight=4, timeout=30)
+
+    def call(i):
+        # Richieste tutte diverse: quelle uguali verrebbero unite in una sola chiamata
+        messages = [{"role": "user", "content": f"aggiungi task per domani di comprare il latte ({i})"}]
+        t0 = time.perf_counter()
+        try:
+            gateway.chat(messages)
+            ok = True
+        except Exception:
+            ok = False
+        return ok, (time.perf_counter() - t0) * 1000
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as pool:
+        results = list(pool.map(call, range(requests)))
+    elapsed = time.perf_counter() - t0
+    server.shutdown()
+
+    latencies = np.array([ms for _, ms in results])
+    print(f'{requests} chiamate da {clients} thread, server: {latency * 1000:.0f} ms, {error_rate:.0%} errori 429/500')
+    print(f'riuscite: {sum(ok for ok, _ in results)}/{requests} in {elapsed:.1f} s ({requests / elapsed:.1f}/s)')
+    print(f'latenza p50 {np.percentile(latencies, 50):.0f} ms, p95 {np.percentile(latencies, 95):.0f} ms')
+    print(f'richieste al server: {state.requests} (errori iniettati {state.errors}), '
+          f'massimo contemporanee: {state.max_in_flight}, nuovi tentativi: {metrics.counter("llm.retry")}')
+
+
+def bench_coalesce(sessions=20, prompts=3, latency=0.5):
+    """Sessioni che chiedono insieme le stesse ricette: chiamate al server con e senza coalescenza"""
+    server, state, base_url = start_stub_server(latency=latency, token_delay=0.01)
+    asks = [[{"role": "user", "content": f"ricetta vegetariana veloce {i}"}] for i in range(prompts)] * (sessions // prompts + 1)
+    asks = asks[:sessions]
+    for label, salt in (('senza coalescenza', True), ('con coalescenza', False)):
+        gateway = LLMGateway('chiave-finta', base_url=base_url, rate=100, burst=sessions, max_in_flight=8)
+        requests = state.requests
+
+        def ask(item):
+            i, messages = item
+            # Senza coalescenza ogni sessione manda una richiesta diversa dalle altre
+            extra = {'user': f'sessione-{i}'} if salt else {}
+            t0 = time.perf_counter()
+            ''.join(gateway.chat_stream(messages, **extra))
+            return (time.perf_counter() - t0) * 1000
+
+        t0 = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=sessions) as pool:
+            latencies = np.array(list(pool.map(ask, enumerate(asks))))
+        elapsed = time.perf_counter() - t0
+        print(f"{label:<20} {sessions} sessioni, {prompts} prompt diversi: chiamate al server {state.requests - requests}, "
+              f"p50 {np.percentile(latencies, 50):.0f} ms, p95 {np.percentile(latencies, 95):.0f} ms, totale {elapsed:.1f} s")
+    print(f"llm.upstream {metrics.counter('llm.upstream')}, llm.coalesced {metrics.counter('llm.coalesced')}, "
+          f"llm.cached {metrics.counter('llm.cached')}")
+    server.shutdown()
+
+
+def bench_actions(latency=0.3):
+    """Tre task in un comando: una chiamata e una scrittura per azione contro un blocco unico"""
+    server, state, base_url = start_stub_server(latency=latency)
+    gateway = LLMGateway('chiave-finta', base_url=base_url)
+    calls = state.tool_calls
+    with temp_workdir():
+        pd.DataFrame(columns=['Nome', 'Descrizione', 'Stato', 'Data Inizio', 'Data Fine']).to_csv('progetti.csv', index=False)
+        for label, rounds in (('una azione per chiamata', [[call] for call in calls]), ('blocco unico', [calls])):
+            requests, writes = state.requests, metrics.counter('store.write')
+            t0 = time.perf_counter()
+            for i, round_calls in enumerate(rounds):
+                state.tool_calls = round_calls
+                # Prompt tutti diversi: le richieste uguali in corso insieme verrebbero unite
+                messages = [{"role": "user", "content": f"aggiungi tre task per lunedì, martedì e mercoledì ({label}, {i})"}]
+                message = gateway.chat(messages, tools=tool_definitions()).choices[0].message
+                execute_actions(parse_tool_calls(
+                    [{'name': c.function.name, 'arguments': c.function.arguments} for c in message.tool_calls]
+                ))
+            ms = (time.perf_counter() - t0) * 1000
+            print(f"{label:<25} chiamate al modello: {state.requests - requests}, "
+                  f"scritture: {metrics.counter('store.write') - writes}, {ms:.0f} ms")
+        print(f"task salvate: {len(backend.load_projects())}")
+    server.shutdown()
+
+
+BENCHMARKS = {
+    'add_event': bench_add_event,
+    'month': bench_month,
+    'columnar': bench_columnar,
+    'layout': bench_layout,
+    'search': bench_search,
+    'agenda': bench_agenda,
+    'intent': bench_intent,
+    'llm': bench_llm,
+    'actions': bench_actions,
+    'coalesce': bench_coalesce,
+}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('name', choices=sorted(BENCHMARKS))
+    args = parser.parse_args()
+    BENCHMARKS[args.name]()
@@ -0,0 +1,71 @@
+import json
+import os
+from datetime import date, datetime, timedelta
+
+import numpy as np
+import pandas as pd
+import streamlit.components.v1 as components
+
+import metrics
+from calendar_views import get_event_color
+
+_calendar_grid = components.declare_component(
+    "calendar_grid",
+    path=os.path.join(os.path.dirname(os.path.abspath(__file__)), "components", "calendar_grid"),
+)
+
+# Tipi di evento noti: l'array inviato al browser contiene solo il codice numerico
+EVENT_TYPES = ["general", "meeting", "deadline", "reminder", "recipe", "task", "wellness", "shopping"]
+OTHER_TYPE = len(EVENT_TYPES)
+
+VIEW_NAMES = {"Mese": "month", "Settimana": "week", "Giorno": "day"}
+
+EPOCH = date(1970, 1, 1)
+MINUTE = timedelta(minutes=1)
+
+
+def encode_layout(events, segments):
+    """Payload compatto per il browser a partire dalla disposizione calcolata da layout.
+
+    events: [id, titolo, codice tipo, minuto di inizio] per ogni evento citato;
+    segments: [indice evento, giorno (giorni dall'epoch), minuto inizio, minuto fine,
+    corsia, corsie, primo pezzo]. I minuti sono contati dalla mezzanotte del giorno.
+    """
+    ids = pd.to_numeric(events['id'], errors='coerce').fillna(0).astype('int64').tolist()
+    titles = events['title'].fillna('').astype(str).tolist()
+    codes = pd.Categorical(events['event_type'], categories=EVENT_TYPES).codes
+    codes = np.where(codes < 0, OTHER_TYPE, codes).tolist()
+    starts = pd.to_datetime(events['start_datetime'], errors='coerce')
+    minutes = (starts.dt.hour * 60 + starts.dt.minute).fillna(0).astype('int64').tolist()
+
+    index, payload_events, payload_segments = {}, [], []
+    for seg in segments:
+        if seg.row not in index:
+            index[seg.row] = len(payload_events)
+            payload_events.append([ids[seg.row], titles[seg.row], codes[seg.row], minutes[seg.row]])
+        midnight = datetime.combine(seg.day, datetime.min.time())
+        payload_segments.append([
+            index[seg.row], (seg.day - EPOCH).days,
+            int((seg.start - midnight) / MINUTE), int((seg.end - midnight) / MINUTE),
+            seg.lane, seg.lanes, int(seg.first),
+        ])
+    return {'events': payload_events, 'segments': payload_segments}
+
+
+def calendar_grid(payload, view_type, selected_date, key="calendar_grid"):
+    """Griglia mese/settimana/giorno disegnata nel browser.
+
+    Il server invia solo la disposizione compatta degli eventi visibili (vedi encode_layout);
+    con la stessa key un cambio di vista o di data aggiorna i dati del componente già caricato.
+    """
+    types = [[name, get_event_color(name)] for name in EVENT_TYPES] + [["other", get_event_color(None)]]
+    metrics.gauge('payload.calendar_bytes', len(json.dumps(payload, separators=(',', ':'))))
+    return _calendar_grid(
+        layout=payload,
+        types=types,
+        view=VIEW_NAMES[view_type],
+        date=selected_date.isoformat(),
+        today=datetime.today().date().isoformat(),
+        key=key,
+        default=None,
+    )
@@ -0,0 +1,253 @@
+import calendar
+import html
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+import pandas as pd
+
+import metrics
+
+DAYS_OF_WEEK = ["Lun", "Mar", "Mer", "Gio", "Ven", "Sab", "Dom"]
+
+# Template compilati una sola volta: il rendering è solo una chiamata a format
+EVENT_TEMPLATE = '<div class="event{cls}" style="--event-color: {color}">{text}</div>'.format
+# Blocchi delle viste orarie: posizione e dimensioni arrivano dal motore di layout
+BLOCK_TEMPLATE = (
+    '<div class="event{cls}" style="--event-color: {color}; --top: {top}; --span: {span}; '
+    '--lane: {lane}; --lanes: {lanes}">{text}</div>'
+).format
+SPACER = '<div class="event-spacer"></div>'
+MONTH_CELL_TEMPLATE = '<td class="{cls}"><div class="day-number">{day}</div><div class="events">{events}</div></td>'.format
+HOUR_CELL_TEMPLATE = '<td class="{cls}">{events}</td>'.format
+DAY_ROW_TEMPLATE = '<tr><td class="time-column">{hour:02d}:00</td><td>{events}</td></tr>'.format
+AGENDA_DAY_TEMPLATE = '<tr class="agenda-day"><th colspan="3">{day}</th></tr>'.format
+AGENDA_ROW_TEMPLATE = (
+    '<tr><td class="time-column">{time}</td>'
+    '<td><span class="agenda-dot" style="--event-color: {color}"></span>{title}</td>'
+    '<td class="agenda-location">{location}</td></tr>'
+).format
+
+# Cache dei frammenti HTML per cella, condivisa tra le sessioni. La chiave contiene
+# gli eventi della cella, quindi una cella cambia solo quando cambia il suo contenuto
+FRAGMENT_CACHE_SIZE = 5000
+_fragments = OrderedDict()
+_fragments_lock = threading.Lock()
+
+
+def _cached_fragment(key, render):
+    with _fragments_lock:
+        html = _fragments.get(key)
+        if html is not None:
+            _fragments.move_to_end(key)
+            metrics.incr('fragment.hit')
+            return html
+    metrics.incr('fragment.miss')
+    html = render()
+    with _fragments_lock:
+        _fragments[key] = html
+        if len(_fragments) > FRAGMENT_CACHE_SIZE:
+            _fragments.popitem(last=False)
+    return html
+
+
+# Funzioni helper per le diverse viste
+def get_week_dates(date):
+    # Converte la data in datetime se è un oggetto date
+    if isinstance(date, type(datetime.now().date())):
+        date = datetime.combine(date, datetime.min.time())
+    start = date - timedelta(days=date.weekday())
+    return [(start + timedelta(days=i)).date() for i in range(7)]
+
+
+def get_view_window(view_type, date):
+    """Intervallo [inizio, fine) visibile nella vista selezionata"""
+    if view_type == "Mese":
+        start = datetime(date.year, date.month, 1)
+        end = datetime(date.year + date.month // 12, date.month % 12 + 1, 1)
+    elif view_type == "Settimana":
+        start = datetime.combine(get_week_dates(date)[0], datetime.min.time())
+        end = start + timedelta(days=7)
+    else:
+        start = datetime.combine(date, datetime.min.time())
+        end = start + timedelta(days=1)
+    return start, end
+
+
+# Funzione per ottenere il colore del tag in base al tipo di evento
+def get_event_color(event_type):
+    color_map = {
+        "general": "#039BE5",    # Blu chiaro
+        "meeting": "#7986CB",    # Indaco
+        "deadline": "#EF5350",   # Rosso
+        "reminder": "#33B679",   # Verde
+        "recipe": "#8E24AA",     # Viola
+        "task": "#F4511E",       # Arancione
+        "wellness": "#0B8043",   # Verde scuro
+        "shopping": "#E67C73"    # Rosa
+    }
+    return color_map.get(event_type, "#616161")  # Grigio come default
+
+
+def _labels(events):
+    """Titoli, tipi e ore di inizio 'HH:MM' per posizione di riga"""
+    starts = pd.to_datetime(events['start_datetime'], errors='coerce')
+    return (
+        events['title'].tolist(),
+        events['event_type'].tolist(),
+        starts.dt.strftime('%H:%M').tolist(),
+    )
+
+
+def month_cells(events, segments):
+    """Indice giorno -> contenuto della cella mensile, dalla disposizione di layout_days.
+
+    Ogni posizione della tupla è una corsia: None lascia uno spazio vuoto, così un
+    evento di più giorni resta alla stessa altezza in tutte le celle che copre.
+    """
+    titles, types, times = _labels(events)
+    cells = {}
+    for seg in segments:
+        slots = cells.setdefault(seg.day, [])
+        slots.extend([None] * (seg.lane + 1 - len(slots)))
+        if seg.first:
+            text = f"{times[seg.row]} {titles[seg.row]}" if times[seg.row] != "00:00" else titles[seg.row]
+        else:
+            text = titles[seg.row]
+        slots[seg.lane] = (text, types[seg.row], not seg.first)
+    return {day: tuple(slots) for day, slots in cells.items()}
+
+
+def hour_cells(events, segments, first_hour=0, last_hour=23, with_time=False):
+    """Indice (giorno, ora) -> blocchi che iniziano in quella cella, da layout_hours.
+
+    Ogni blocco porta la posizione verticale nella cella (top, in frazioni d'ora),
+    l'altezza in ore (span) e la corsia orizzontale; i pezzi fuori dalle ore
+    visibili sono ritagliati.
+    """
+    titles, types, times = _labels(events)
+    hour = timedelta(hours=1)
+    cells = {}
+    for seg in segments:
+        day = datetime.combine(seg.day, datetime.min.time())
+        start = max(seg.start, day + first_hour * hour)
+        end = min(seg.end, day + (last_hour + 1) * hour)
+        if start >= end:
+            continue
+        title = titles[seg.row]
+        text = f"{times[seg.row]} - {title}" if with_time and seg.first else title
+        block = (
+            text, types[seg.row], round(start.minute / 60, 2), round((end - start) / hour, 2),
+            seg.lane, seg.lanes, not seg.first,
+        )
+        cells.setdefault((seg.day, start.hour), []).append(block)
+    return {key: tuple(blocks) for key, blocks in cells.items()}
+
+
+def _render_event(text, event_type, continued):
+    return EVENT_TEMPLATE(cls=" continued" if continued else "", color=get_event_color(event_type), text=text)
+
+
+def _render_block(text, event_type, top, span, lane, lanes, continued):
+    return BLOCK_TEMPLATE(
+        cls=" continued" if continued else "", color=get_event_color(event_type),
+        top=top, span=span, lane=lane, lanes=lanes, text=text,
+    )
+
+
+def _render_month_cell(day, slots, is_today):
+    events = ''.join(SPACER if slot is None else _render_event(*slot) for slot in slots)
+    return MONTH_CELL_TEMPLATE(cls="today" if is_today else "", day=day, events=events)
+
+
+def _render_week_cell(blocks, is_today):
+    events = ''.join(_render_block(*block) for block in blocks)
+    return HOUR_CELL_TEMPLATE(cls="today" if is_today else "", events=events)
+
+
+def _render_day_row(hour, blocks):
+    events = ''.join(_render_block(*block) for block in blocks)
+    return DAY_ROW_TEMPLATE(hour=hour, events=events)
+
+
+def render_month(year, month, cells, today=None):
+    """Genera la tabella HTML della vista mensile dalle celle di month_cells.
+
+    Ogni cella passa dalla cache dei frammenti con chiave (giorno, eventi, oggi).
+    """
+    today = today or datetime.today().date()
+    parts = ['<table class="calendar">', '<tr>']
+    parts.extend(f'<th>{day}</th>' for day in DAYS_OF_WEEK)
+    parts.append('</tr>')
+
+    for week in calendar.monthcalendar(year, month):
+        parts.append('<tr>')
+        for day in week:
+            if day == 0:
+                parts.append('<td></td>')
+                continue
+            current_date = datetime(year, month, day).date()
+            is_today = current_date == today
+            rows = cells.get(current_date, ())
+            parts.append(_cached_fragment(
+                ('month', current_date, rows, is_today),
+                lambda: _render_month_cell(day, rows, is_today),
+            ))
+        parts.append('</tr>')
+
+    parts.append('</table>')
+    return ''.join(parts)
+
+
+def render_week(week_dates, cells, today=None):
+    """Genera la tabella HTML della vista settimanale (ore 8-20) dalle celle di hour_cells"""
+    today = today or datetime.today().date()
+    parts = ['<table class="week-calendar">', '<tr><th></th>']
+    for i, date in enumerate(week_dates):
+        is_today = date == today
+        parts.append(f'<th class="{"today" if is_today else ""}">{DAYS_OF_WEEK[i]}<br>{date.day}</th>')
+    parts.append('</tr>')
+
+    # Griglia delle ore (solo dalle 8 alle 20)
+    for hour in range(8, 21):
+        parts.append('<tr>')
+        parts.append(f'<td class="time-column">{hour:02d}:00</td>')
+        for date in week_dates:
+            is_today = date == today
+            rows = cells.get((date, hour), ())
+            parts.append(_cached_fragment(('week', date, hour, rows, is_today), lambda: _render_week_cell(rows, is_today)))
+        parts.append('</tr>')
+
+    parts.append('</table>')
+    return ''.join(parts)
+
+
+def render_day(date, cells):
+    """Genera la tabella HTML della vista giornaliera (24 ore) dalle celle di hour_cells"""
+    parts = ['<table class="day-calendar">', f'<tr><th colspan="2">{date.strftime("%A, %d %B %Y")}</th></tr>']
+    for hour in range(24):
+        rows = cells.get((date, hour), ())
+        parts.append(_cached_fragment(('day', date, hour, rows), lambda: _render_day_row(hour, rows)))
+
+    parts.append('</table>')
+    return ''.join(parts)
+
+
+def render_agenda(events):
+    """Tabella HTML di una pagina dell'agenda: una riga per evento, raggruppate per giorno"""
+    starts = pd.to_datetime(events['start_datetime'], errors='coerce')
+    locations = events['location'].fillna('').astype(str) if 'location' in events else [''] * len(events)
+    parts = ['<table class="agenda">']
+    current_day = None
+    for start, title, event_type, location in zip(starts, events['title'], events['event_type'], locations):
+        if pd.isna(start):
+            continue
+        if start.date() != current_day:
+            current_day = start.date()
+            parts.append(AGENDA_DAY_TEMPLATE(day=start.strftime("%A %d %B %Y")))
+        parts.append(AGENDA_ROW_TEMPLATE(
+            time=start.strftime('%H:%M'), color=get_event_color(event_type),
+            title=html.escape(str(title)), location=html.escape(location),
+        ))
+    parts.append('</table>')
+    return ''.join(parts)
@@ -0,0 +1,62 @@
+import os
+
+# pyarrow è facoltativo: senza, le copie colonnari non vengono scritte e le letture
+# passano sempre dai CSV
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+
+def _stamp_bytes(stamp):
+    return repr(tuple(stamp)).encode()
+
+
+def _arrow_safe(df):
+    """Le colonne object con tipi misti diventano stringhe, i valori mancanti restano nulli"""
+    df = df.copy(deep=False)
+    for col in df.columns:
+        if df[col].dtype == object:
+            values = df[col]
+            df[col] = values.where(values.isna(), values.astype(str))
+    return df
+
+
+def write_snapshot(path, df, stamp):
+    """Salva df in formato Arrow IPC (Feather v2) non compresso, marcato con la versione del CSV sorgente.
+
+    Senza compressione il file si può mappare in memoria e leggere colonna per colonna
+    senza copie.
+    """
+    if pa is None:
+        return
+    table = pa.Table.from_pandas(_arrow_safe(df), preserve_index=False)
+    table = table.replace_schema_metadata({**(table.schema.metadata or {}), b'source_stamp': _stamp_bytes(stamp)})
+    tmp_path = path + '.tmp'
+    with pa.OSFile(tmp_path, 'wb') as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    os.replace(tmp_path, path)
+
+
+def read_snapshot(path, stamp, columns=None):
+    """Legge lo snapshot mappato in memoria; None se manca o non corrisponde più al CSV.
+
+    Con columns vengono convertite solo le colonne richieste: le pagine delle altre
+    colonne non vengono nemmeno lette dal disco.
+    """
+    if pa is None:
+        return None
+    try:
+        source = pa.memory_map(path, 'r')
+        reader = pa.ipc.open_file(source)
+    except (FileNotFoundError, OSError, pa.ArrowInvalid):
+        return None
+    # La mappa resta aperta finché i buffer restituiti la referenziano
+    metadata = reader.schema.metadata or {}
+    if metadata.get(b'source_stamp') != _stamp_bytes(stamp):
+        return None
+    table = reader.read_all()
+    if columns is not None:
+        table = table.select([col for col in columns if col in table.column_names])
+    return table.to_pandas()
@@ -0,0 +1,145 @@
+import itertools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+from backend import data_version
+
+# Worker condivisi tra le sessioni: la chiamata al modello e le scritture non girano
+# più nello script di Streamlit, che resta libero di disegnare la pagina
+COMMAND_WORKERS = 4
+COMMAND_TIMEOUT = 30.0
+_executor = ThreadPoolExecutor(max_workers=COMMAND_WORKERS, thread_name_prefix='command')
+# La voce è una sola: le risposte vengono lette una dopo l'altra, senza bloccare i comandi
+_speech = ThreadPoolExecutor(max_workers=1, thread_name_prefix='speech')
+_ids = itertools.count(1)
+
+
+class Command:
+    """Un comando in lavorazione: testo, fase corrente, risposta parziale e, alla fine,
+    l'esito del gestore"""
+
+    def __init__(self, text, timeout):
+        self.id = next(_ids)
+        self.text = text
+        self.stage = "In coda"
+        self.partial = ""
+        self.submitted = time.monotonic()
+        self.timeout = timeout
+        # La scadenza parte quando un worker prende il comando, non quando entra in coda
+        self.deadline = None
+        self.result = None
+        self.error = None
+        self.timed_out = False
+        self.writing = False
+        self._lock = threading.Lock()
+        self.data_version = data_version()
+        self.future = None
+
+    def elapsed(self):
+        return time.monotonic() - self.submitted
+
+    def start(self):
+        self.deadline = time.monotonic() + self.timeout
+
+    def remaining(self):
+        return max(0.0, self.deadline - time.monotonic())
+
+    def expire(self, now):
+        """Segna il comando come scaduto se ha superato la scadenza e non sta già scrivendo"""
+        with self._lock:
+            if self.deadline is not None and not self.writing and now > self.deadline:
+                self.timed_out = True
+            return self.timed_out
+
+    def begin_write(self):
+        """Chiamata dal gestore prima di scrivere: False se il comando è già scaduto.
+
+        Da qui in poi il comando non scade più, così non si può segnare come scaduto
+        un comando che ha già modificato i dati.
+        """
+        with self._lock:
+            if self.timed_out or time.monotonic() > self.deadline:
+                self.timed_out = True
+                return False
+            self.writing = True
+            return True
+
+    def done(self):
+        return self.timed_out or (self.future is not None and self.future.done())
+
+
+class CommandQueue:
+    """Coda dei comandi di una sessione, serviti dal pool di worker condiviso.
+
+    handler(testo, progress=..., timeout=..., begin_write=...) restituisce un esito con
+    l'attributo response (il testo della risposta); progress(fase, parziale) aggiorna la
+    fase e la risposta parziale mostrate mentre il comando è in corso, timeout è il tempo
+    rimasto e begin_write() va chiamata prima di scrivere: se restituisce False il comando
+    è scaduto e non deve modificare i dati. La scadenza parte quando un worker prende il
+    comando. submit() mette in coda e ritorna subito;
+    la pagina chiama collect() a ogni rerun per ritirare i comandi conclusi (o
+    scaduti) e mostrare l'avanzamento di quelli ancora in corso. Più comandi
+    possono essere in corso insieme.
+    """
+
+    def __init__(self, handler, speaker=None, timeout=COMMAND_TIMEOUT):
+        self._handler = handler
+        self._speaker = speaker
+        self._timeout = timeout
+        self._commands = []
+        self._lock = threading.Lock()
+
+    def submit(self, text):
+        command = Command(text, self._timeout)
+        with self._lock:
+            self._commands.append(command)
+        command.future = _executor.submit(self._run, command)
+        return command
+
+    def _run(self, command):
+        metrics.record_time('command.wait', command.elapsed() * 1000)
+        command.start()
+
+        def progress(stage, partial=None):
+            command.stage = stage
+            if partial is not None:
+                command.partial = partial
+
+        progress("In elaborazione")
+        start = time.perf_counter()
+        try:
+            command.result = self._handler(command.text, progress=progress, timeout=command.remaining(),
+                                           begin_write=command.begin_write)
+        except Exception as e:
+            command.error = e
+            raise
+        finally:
+            metrics.record_time('command.run', (time.perf_counter() - start) * 1000)
+        if self._speaker is not None and command.result.response and not command.timed_out:
+            _speech.submit(self._speaker, command.result.response)
+        return command.result
+
+    def pending(self):
+        """Comandi non ancora ritirati, nell'ordine di invio"""
+        with self._lock:
+            return list(self._commands)
+
+    def collect(self):
+        """Ritira i comandi conclusi; quelli oltre la scadenza vengono segnati come scaduti.
+
+        Un comando scaduto mentre era in corso non può essere interrotto, ma non scrive
+        più niente (begin_write) e il suo risultato, se arriva, viene ignorato. Un comando
+        che ha già cominciato a scrivere non scade: il suo esito viene sempre mostrato.
+        """
+        now = time.monotonic()
+        finished = []
+        with self._lock:
+            for command in self._commands:
+                if not command.done() and command.expire(now):
+                    command.future.cancel()
+                if command.done():
+                    finished.append(command)
+            self._commands = [c for c in self._commands if c not in finished]
+        return finished
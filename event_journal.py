@@ -0,0 +1,225 @@
+import csv
+import os
+import shutil
+import threading
+
+import pandas as pd
+
+from columnar import read_snapshot, write_snapshot
+from event_schema import EVENT_COLUMNS, empty_events, normalize_events
+
+
+def discard_staged(staged):
+    """Cancella i file temporanei di una scrittura preparata e non più applicata"""
+    for tmp_path, _ in staged:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+class EventJournal:
+    """Archivio eventi a giornale: snapshot ordinato + log di record aggiunti in coda.
+
+    Le scritture aggiungono una riga in fondo al giornale (O(1)) e, quando la coda supera
+    compact_threshold righe, la ripiegano nello snapshot ordinato; le letture
+    restituiscono snapshot + coda, già normalizzati allo schema degli eventi.
+    Accanto allo snapshot CSV viene salvata una copia colonnare tipizzata (Arrow IPC),
+    letta mappata in memoria e solo nelle colonne richieste.
+    """
+
+    def __init__(self, snapshot_path, journal_path, columns=EVENT_COLUMNS, compact_threshold=1000):
+        self.snapshot_path = snapshot_path
+        self.journal_path = journal_path
+        self.compacting_path = journal_path + '.compacting'
+        self.columnar_path = os.path.splitext(snapshot_path)[0] + '.arrow'
+        self.columns = list(columns)
+        self.compact_threshold = compact_threshold
+        # Righe nel giornale, contate alla prima scrittura e poi aggiornate a ogni aggiunta
+        self._tail_rows = None
+        self._lock = threading.Lock()
+
+    def _format_value(self, value):
+        if value is None:
+            return ''
+        try:
+            if pd.isna(value):
+                return ''
+        except (TypeError, ValueError):
+            pass
+        return str(value)
+
+    def append(self, event):
+        """Aggiunge un evento in coda al giornale senza rileggere lo snapshot"""
+        self.append_many([event])
+
+    def append_many(self, events):
+        """Aggiunge più eventi con una sola apertura del file"""
+        rows = [[self._format_value(event.get(col)) for col in self.columns] for event in events]
+        if not rows:
+            return
+        with self._lock:
+            with open(self.journal_path, 'a', newline='', encoding='utf-8') as f:
+                writer = csv.writer(f)
+                # Scrivi l'intestazione solo quando il giornale è nuovo
+                if f.tell() == 0:
+                    writer.writerow(self.columns)
+                writer.writerows(rows)
+                f.flush()
+        self._grow_tail(len(rows))
+
+    def append_frame(self, events):
+        """Aggiunge in coda un blocco di eventi già normalizzato, scritto in modo vettoriale"""
+        if events.empty:
+            return
+        with self._lock:
+            with open(self.journal_path, 'a', newline='', encoding='utf-8') as f:
+                events.reindex(columns=self.columns).to_csv(f, index=False, header=f.tell() == 0)
+                f.flush()
+        self._grow_tail(len(events))
+
+    def _grow_tail(self, added):
+        """Compatta dopo una scrittura se la coda è troppo lunga: le letture non compattano mai"""
+        with self._lock:
+            if self._tail_rows is None:
+                self._tail_rows = 0
+                for path in (self.compacting_path, self.journal_path):
+                    try:
+                        self._tail_rows += len(pd.read_csv(path, usecols=[0]))
+                    except (FileNotFoundError, pd.errors.EmptyDataError):
+                        pass
+            else:
+                self._tail_rows += added
+            compact = self._tail_rows >= self.compact_threshold
+        if compact:
+            self.compact()
+
+    def _read(self, path):
+        try:
+            return normalize_events(pd.read_csv(path))
+        except (FileNotFoundError, pd.errors.EmptyDataError):
+            return None
+
+    def _snapshot_stamp(self):
+        stat = os.stat(self.snapshot_path)
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def _read_snapshot(self, columns=None):
+        """Snapshot tipizzato: dalla copia colonnare se è aggiornata, altrimenti dal CSV"""
+        try:
+            stamp = self._snapshot_stamp()
+        except FileNotFoundError:
+            return None
+        events = read_snapshot(self.columnar_path, stamp, columns)
+        if events is not None:
+            return events
+
+        # Il CSV è stato modificato a mano o manca la copia: riconverti e salva
+        events = self._read(self.snapshot_path)
+        if events is not None:
+            write_snapshot(self.columnar_path, events, stamp)
+            if columns is not None:
+                events = events[columns]
+        return events
+
+    def load(self, columns=None):
+        """Restituisce snapshot + coda del giornale.
+
+        I tre file vengono letti con il lock preso: una compattazione a metà lettura
+        sposterebbe righe in un file già letto. Con columns vengono lette solo le
+        colonne indicate.
+        """
+        with self._lock:
+            snapshot = self._read_snapshot(columns)
+            tails = [self._read(self.compacting_path), self._read(self.journal_path)]
+        tails = [t if columns is None else t[columns] for t in tails if t is not None and not t.empty]
+
+        if snapshot is None and not tails:
+            events = empty_events()
+            return events if columns is None else events[columns]
+
+        frames = [f for f in [snapshot] + tails if f is not None]
+        return pd.concat(frames, ignore_index=True) if len(frames) > 1 else frames[0]
+
+    def compact(self):
+        """Ripiega il giornale nello snapshot ordinato per data di inizio"""
+        with self._lock:
+            # Rinomina il giornale: le nuove aggiunte finiscono in un file nuovo
+            if os.path.exists(self.journal_path) and not os.path.exists(self.compacting_path):
+                os.replace(self.journal_path, self.compacting_path)
+            if not os.path.exists(self.compacting_path):
+                self._tail_rows = 0
+                return
+
+            frames = [self._read_snapshot(), self._read(self.compacting_path)]
+            frames = [f for f in frames if f is not None]
+            events = pd.concat(frames, ignore_index=True) if frames else empty_events()
+
+            # Ordina gli eventi per data e ora di inizio
+            events = events.sort_values(by='start_datetime', kind='stable').reset_index(drop=True)
+            self._write_snapshot(events)
+            os.remove(self.compacting_path)
+            self._tail_rows = 0
+
+    def _write_snapshot(self, events):
+        """Scrittura atomica dello snapshot CSV e della copia colonnare"""
+        tmp_path = self.snapshot_path + '.tmp'
+        events.to_csv(tmp_path, index=False)
+        os.replace(tmp_path, self.snapshot_path)
+        write_snapshot(self.columnar_path, events, self._snapshot_stamp())
+
+    def delete(self, event_id):
+        """Elimina gli eventi con questo id: ripiega il giornale e riscrive lo snapshot senza di loro"""
+        return self.delete_many([event_id])
+
+    def delete_many(self, event_ids):
+        """Elimina gli eventi con uno qualsiasi di questi id con una sola riscrittura dello snapshot"""
+        return self.apply(event_ids, [])
+
+    def apply(self, deleted_ids, events, staged=()):
+        """Elimina e aggiunge eventi insieme ad altri file già preparati (coppie temporaneo, destinazione).
+
+        Snapshot senza gli eliminati e giornale con i nuovi eventi vengono scritti in file
+        temporanei; solo quando sono tutti pronti i file vengono rinominati uno dopo
+        l'altro. Se una scrittura fallisce i temporanei, anche quelli in staged, vengono
+        cancellati e i dati restano come prima. Restituisce il numero di eventi eliminati.
+        """
+        staged = list(staged)
+        try:
+            if deleted_ids:
+                self.compact()
+        except BaseException:
+            discard_staged(staged)
+            raise
+        with self._lock:
+            kept = None
+            deleted = 0
+            try:
+                if deleted_ids:
+                    current = self._read_snapshot()
+                    if current is not None:
+                        keep = (~current['id'].isin(list(deleted_ids))).fillna(True)
+                        deleted = int((~keep).sum())
+                        if deleted:
+                            kept = current[keep].reset_index(drop=True)
+                            staged.append((self.snapshot_path + '.tmp', self.snapshot_path))
+                            kept.to_csv(self.snapshot_path + '.tmp', index=False)
+                rows = [[self._format_value(event.get(col)) for col in self.columns] for event in events]
+                if rows:
+                    tmp_path = self.journal_path + '.tmp'
+                    staged.append((tmp_path, self.journal_path))
+                    if os.path.exists(self.journal_path):
+                        shutil.copyfile(self.journal_path, tmp_path)
+                    with open(tmp_path, 'a', newline='', encoding='utf-8') as f:
+                        writer = csv.writer(f)
+                        if f.tell() == 0:
+                            writer.writerow(self.columns)
+                        writer.writerows(rows)
+            except BaseException:
+                discard_staged(staged)
+                raise
+            for tmp_path, path in staged:
+                os.replace(tmp_path, path)
+            if kept is not None:
+                write_snapshot(self.columnar_path, kept, self._snapshot_stamp())
+        if rows:
+            self._grow_tail(len(rows))
+        return deleted
@@ -0,0 +1,75 @@
+import pandas as pd
+
+# Schema fisso degli eventi: ogni sorgente (CSV, giornale, SQLite) viene
+# normalizzata una sola volta a questi tipi
+EVENT_SCHEMA = {
+    'id': 'Int64',
+    'title': 'object',
+    'start_datetime': 'datetime64[ns]',
+    'end_datetime': 'datetime64[ns]',
+    'description': 'object',
+    'event_type': 'object',
+    'color': 'object',
+    'is_all_day': 'boolean',
+    'recipe_id': 'object',
+    'location': 'object',
+    'attendees': 'object',
+    'recurring': 'object',
+    'created_at': 'datetime64[ns]',
+    'updated_at': 'datetime64[ns]',
+    'name': 'object',
+}
+
+EVENT_COLUMNS = list(EVENT_SCHEMA)
+
+DATETIME_COLUMNS = [col for col, dtype in EVENT_SCHEMA.items() if dtype.startswith('datetime')]
+
+
+def parse_datetime(dt):
+    """Converte una data nei formati misti di events.csv (con o senza orario)"""
+    if pd.isna(dt):
+        return pd.NaT
+    try:
+        return pd.to_datetime(dt)
+    except ValueError:
+        # Se non riesce a convertire, prova ad aggiungere un'ora di default
+        return pd.to_datetime(str(dt) + ' 00:00:00', errors='coerce')
+
+
+def parse_datetimes(values):
+    """Conversione vettoriale ISO 8601; solo le righe che falliscono passano al parser misto"""
+    if pd.api.types.is_datetime64_any_dtype(values):
+        return values.astype('datetime64[ns]')
+    parsed = pd.to_datetime(values, format='ISO8601', errors='coerce')
+    failed = parsed.isna() & values.notna()
+    if failed.any():
+        parsed[failed] = values[failed].map(parse_datetime)
+    return parsed.astype('datetime64[ns]')
+
+
+def _to_bool(values):
+    if pd.api.types.is_bool_dtype(values):
+        return values.astype('boolean')
+    mapping = {'true': True, 'false': False, '1': True, '0': False}
+    return values.map(lambda v: mapping.get(str(v).strip().lower()) if pd.notna(v) else None).astype('boolean')
+
+
+def empty_events():
+    return normalize_events(pd.DataFrame(columns=EVENT_COLUMNS))
+
+
+def normalize_events(df):
+    """Riporta un DataFrame di eventi grezzo allo schema fisso EVENT_SCHEMA"""
+    df = df.reindex(columns=EVENT_COLUMNS)
+    out = {}
+    for col, dtype in EVENT_SCHEMA.items():
+        values = df[col]
+        if dtype.startswith('datetime'):
+            out[col] = parse_datetimes(values)
+        elif dtype == 'Int64':
+            out[col] = pd.to_numeric(values, errors='coerce').round().astype('Int64')
+        elif dtype == 'boolean':
+            out[col] = _to_bool(values)
+        else:
+            out[col] = values.astype('object')
+    return pd.DataFrame(out, index=df.index)
@@ -0,0 +1,120 @@
+"""Importazione in blocco di eventi da file ICS o CSV.
+
+Uso: python import_events.py calendario.ics [--chunk-size 5000]
+     python import_events.py eventi.csv
+
+Il file viene letto in streaming e scritto a blocchi tramite backend.add_events:
+la memoria usata non dipende dalla dimensione del file.
+"""
+import argparse
+import time
+
+import pandas as pd
+from dateutil import tz
+
+from backend import add_events, compact_events
+
+# Proprietà VEVENT -> colonne di events.csv
+ICS_FIELDS = {
+    'UID': 'name',
+    'SUMMARY': 'title',
+    'DTSTART': 'start_datetime',
+    'DTEND': 'end_datetime',
+    'DESCRIPTION': 'description',
+    'LOCATION': 'location',
+    'RRULE': 'recurring',
+}
+
+
+def _unescape(value):
+    return value.replace('\\n', '\n').replace('\\N', '\n').replace('\\,', ',').replace('\\;', ';').replace('\\\\', '\\')
+
+
+def _unfolded_lines(f):
+    """Righe logiche del file ICS: le righe che iniziano con uno spazio continuano la precedente"""
+    current = None
+    for raw in f:
+        line = raw.rstrip('\r\n')
+        if line[:1] in (' ', '\t') and current is not None:
+            current += line[1:]
+            continue
+        if current is not None:
+            yield current
+        current = line
+    if current is not None:
+        yield current
+
+
+def _parse_ics_datetimes(values):
+    """Converte le date ICS (20250316, 20250316T090000, 20250316T090000Z) in ora locale"""
+    values = pd.Series(values, dtype=object)
+    utc = values.str.endswith('Z', na=False)
+    parsed = pd.to_datetime(values.str.rstrip('Z'), format='%Y%m%dT%H%M%S', errors='coerce')
+    dates = parsed.isna() & values.notna()
+    parsed[dates] = pd.to_datetime(values[dates], format='%Y%m%d', errors='coerce')
+    if utc.any():
+        local = parsed[utc].dt.tz_localize('UTC').dt.tz_convert(tz.tzlocal()).dt.tz_localize(None)
+        parsed[utc] = local
+    return parsed, dates
+
+
+def read_ics(path, chunk_size):
+    """Legge un file ICS e produce blocchi di eventi come DataFrame"""
+    rows, event = [], None
+    with open(path, encoding='utf-8') as f:
+        for line in _unfolded_lines(f):
+            if line == 'BEGIN:VEVENT':
+                event = {}
+            elif line == 'END:VEVENT' and event is not None:
+                rows.append(event)
+                event = None
+                if len(rows) >= chunk_size:
+                    yield _ics_chunk(rows)
+                    rows = []
+            elif event is not None and ':' in line:
+                key, value = line.split(':', 1)
+                name = key.split(';', 1)[0].upper()
+                if name in ICS_FIELDS:
+                    event[ICS_FIELDS[name]] = value if name == 'RRULE' else _unescape(value)
+    if rows:
+        yield _ics_chunk(rows)
+
+
+def _ics_chunk(rows):
+    chunk = pd.DataFrame(rows)
+    for col in ('start_datetime', 'end_datetime'):
+        if col not in chunk:
+            chunk[col] = None
+    chunk['start_datetime'], all_day = _parse_ics_datetimes(chunk['start_datetime'])
+    chunk['end_datetime'], _ = _parse_ics_datetimes(chunk['end_datetime'])
+    chunk['is_all_day'] = all_day
+    chunk['event_type'] = 'general'
+    return chunk
+
+
+def read_csv(path, chunk_size):
+    """Legge un CSV con le colonne di events.csv a blocchi di chunk_size righe"""
+    yield from pd.read_csv(path, chunksize=chunk_size)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('path', help="file .ics o .csv da importare")
+    parser.add_argument('--chunk-size', type=int, default=5000)
+    args = parser.parse_args()
+
+    reader = read_ics if args.path.lower().endswith('.ics') else read_csv
+    t0 = time.perf_counter()
+
+    def progress(written, skipped):
+        elapsed = time.perf_counter() - t0
+        print(f"\r{written} eventi importati, {skipped} scartati ({written / elapsed:,.0f} righe/s)", end='', flush=True)
+
+    written, skipped = add_events(reader(args.path, args.chunk_size), chunk_size=args.chunk_size, progress=progress)
+    compact_events()
+    elapsed = time.perf_counter() - t0
+    print(f"\nImportazione completata: {written} eventi in {elapsed:.1f} s ({written / max(elapsed, 1e-9):,.0f} righe/s), {skipped} scartati")
+
+
+if __name__ == '__main__':
+    main()
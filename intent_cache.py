@@ -0,0 +1,137 @@
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import date, datetime, timedelta
+
+import metrics
+from intent_parser import parse_datetime
+from search_index import tokenize
+
+INTENT_CACHE_SIZE = 1000
+INTENT_CACHE_TTL = 7 * 24 * 3600
+
+# Segnaposto per le date salvate in cache: la data detta nel testo ("domani",
+# "venerdì", ...) si ricalcola a ogni lettura, le altre restano uno scostamento da oggi
+TEXT_DATE = '@testo'
+OFFSET_PREFIX = '@oggi+'
+
+
+def normalize_command(text):
+    """Forma canonica di un comando: minuscolo, senza accenti né punteggiatura"""
+    return ' '.join(tokenize(text))
+
+
+def _is_iso_date(value):
+    if not isinstance(value, str) or len(value) != 10:
+        return False
+    try:
+        date.fromisoformat(value)
+    except ValueError:
+        return False
+    return True
+
+
+def _abstract_dates(data, text_date, today):
+    """Sostituisce le date assolute dei dati con segnaposto relativi a oggi o al testo"""
+    result = {}
+    for key, value in data.items():
+        if _is_iso_date(value):
+            day = date.fromisoformat(value)
+            value = TEXT_DATE if day == text_date else f"{OFFSET_PREFIX}{(day - today).days}"
+        result[key] = value
+    return result
+
+
+def _resolve_dates(data, text, today):
+    text_date = None
+    result = {}
+    for key, value in data.items():
+        if value == TEXT_DATE:
+            if text_date is None:
+                text_date = parse_datetime(text, today)[0] or today
+            value = text_date.isoformat()
+        elif isinstance(value, str) and value.startswith(OFFSET_PREFIX):
+            value = (today + timedelta(days=int(value[len(OFFSET_PREFIX):]))).isoformat()
+        result[key] = value
+    return result
+
+
+class IntentCache:
+    """Cache delle interpretazioni del modello, con chiave la forma canonica del comando.
+
+    LRU con scadenza (ttl, in secondi) e salvata su file JSON a ogni scrittura, così
+    sopravvive ai riavvii. Le date nei dati sono salvate come segnaposto: "domani"
+    letto dalla cache un altro giorno è ancora il giorno dopo la lettura.
+    """
+
+    def __init__(self, path=None, max_size=INTENT_CACHE_SIZE, ttl=INTENT_CACHE_TTL):
+        self.path = path
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                entries = json.load(f)
+        except (OSError, ValueError):
+            return
+        now = time.time()
+        for key, entry in entries:
+            if now - entry['stored_at'] < self.ttl:
+                self._entries[tuple(key)] = entry
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def _save(self):
+        if not self.path:
+            return
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump([[list(key), entry] for key, entry in self._entries.items()], f, ensure_ascii=False)
+        os.replace(tmp, self.path)
+
+    def get(self, namespace, text, today=None):
+        """(azione, dati, risposta) già interpretati per questo comando, oppure None"""
+        key = (namespace, normalize_command(text))
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.time() - entry['stored_at'] >= self.ttl:
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                metrics.incr('intent_cache.miss')
+                return None
+            self._entries.move_to_end(key)
+        metrics.incr('intent_cache.hit')
+        today = today or datetime.now().date()
+        return entry['action'], _resolve_dates(entry['data'], text, today), entry['response']
+
+    def put(self, namespace, text, action, data, response, today=None):
+        today = today or datetime.now().date()
+        text_date = parse_datetime(text, today)[0]
+        entry = {
+            'action': action,
+            'data': _abstract_dates(data, text_date, today),
+            'response': response,
+            'stored_at': time.time(),
+        }
+        key = (namespace, normalize_command(text))
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+            try:
+                self._save()
+            except OSError:
+                pass
+
+    def __len__(self):
+        return len(self._entries)
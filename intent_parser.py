@@ -0,0 +1,299 @@
+import re
+from collections import namedtuple
+from datetime import datetime, time, timedelta
+
+# Comando riconosciuto localmente. data ha la stessa forma dei dati prodotti dal
+# modello (title, description, date, time, event_type, ...); confidence va da 0 a 1
+Intent = namedtuple('Intent', ['action', 'data', 'response', 'confidence'])
+
+# Sotto questa soglia il comando viene passato al modello
+FAST_PATH_CONFIDENCE = 0.8
+
+_FLAGS = re.IGNORECASE
+
+WEEKDAYS = ['lunedì', 'martedì', 'mercoledì', 'giovedì', 'venerdì', 'sabato', 'domenica']
+MONTHS = ['gennaio', 'febbraio', 'marzo', 'aprile', 'maggio', 'giugno', 'luglio', 'agosto',
+          'settembre', 'ottobre', 'novembre', 'dicembre']
+NUMBERS = {'un': 1, 'una': 1, 'uno': 1, 'due': 2, 'tre': 3, 'quattro': 4, 'cinque': 5, 'sei': 6,
+           'sette': 7, 'otto': 8, 'nove': 9, 'dieci': 10, 'undici': 11, 'dodici': 12}
+_NUMBER = r"(\d+|" + "|".join(NUMBERS) + r")"
+_WEEKDAY = r"(luned[iì]|marted[iì]|mercoled[iì]|gioved[iì]|venerd[iì]|sabato|domenica)"
+
+# Oggetto del comando -> tipo di evento
+NOUN_TYPES = {
+    'task': 'task', 'attività': 'task', 'attivita': 'task', 'compito': 'task',
+    'evento': 'general', 'impegno': 'general', 'appuntamento': 'general',
+    'riunione': 'meeting', 'meeting': 'meeting', 'call': 'meeting',
+    'promemoria': 'reminder', 'scadenza': 'deadline',
+}
+# Articolo per la risposta ("Ho aggiunto la riunione ...")
+ARTICLES = {'task': 'la', 'attività': "l'", 'attivita': "l'", 'compito': 'il', 'evento': "l'", 'impegno': "l'",
+            'appuntamento': "l'", 'riunione': 'la', 'meeting': 'il', 'call': 'la', 'promemoria': 'il',
+            'scadenza': 'la'}
+# Oggetti che fanno parte del titolo quando sono seguiti da un complemento ("riunione con Marco")
+TITLE_NOUNS = {'appuntamento', 'riunione', 'meeting', 'call', 'scadenza'}
+_COMPLEMENT = re.compile(r"^(?:con|da|dal|dalla|dallo|dai|dagli|al|alla|allo|ai|a|in|su|sul|sulla|di|del|della)\b", _FLAGS)
+_NOUN = re.compile(r"^\s*(?:(?:un|una|uno|il|la|lo|l')\s*)?(?:nuov[oa]\s+)?(" + "|".join(NOUN_TYPES) + r")\b", _FLAGS)
+
+# Cortesie iniziali che non cambiano il significato del comando
+_POLITE = re.compile(r"^(?:(?:ehi|ciao|per favore|per piacere|puoi|potresti|mi|me)\b[\s,]*)+", _FLAGS)
+
+_ADD = re.compile(r"^(aggiungi|aggiungere|crea|creare|inserisci|segna|segnami|metti|fissa|programma|pianifica|ricordami)\b", _FLAGS)
+_DELETE = re.compile(r"^(elimina|eliminare|cancella|cancellare|rimuovi|togli)\b", _FLAGS)
+_FREE = re.compile(
+    r"^(?:(?:trova|cerca|trovami|cercami)\s+(?:un\s+|uno\s+)?(?:buco|momento libero|spazio libero|slot libero|orario libero)"
+    r"|quando\s+(?:sono|sarei)\s+liber[oa]|ho\s+(?:un\s+)?(?:buco|tempo libero))\b", _FLAGS)
+_LIST = re.compile(
+    r"^(?:cosa|che cosa|che)\s+(?:ho|c'è|ce|c'e)\b(?:\s+(?:in programma|da fare|in agenda))?"
+    r"|^(?:che|quali)\s+(?:impegni|eventi|appuntamenti|riunioni)\s+(?:ho|ci sono)\b"
+    r"|^(?:mostra|mostrami|elenca|dimmi|quali sono)\s+(?:i\s+|gli\s+|le\s+)?(?:miei\s+|mie\s+)?"
+    r"(?:eventi|impegni|appuntamenti|task|attività)\b", _FLAGS)
+_COUNT = re.compile(r"^quant[ie]\s+(?:eventi|impegni|appuntamenti|task|riunioni)\s+(?:ho|ci sono)\b", _FLAGS)
+_NEXT = re.compile(
+    r"^(?:qual\s*(?:è|e'|e)\s+)?(?:il\s+)?(?:mio\s+)?prossim[oa]\s+(?:impegno|evento|appuntamento|riunione)\b", _FLAGS)
+_CALENDAR = re.compile(r"\b(?:in|nel|al|sul)\s+calendario\b", _FLAGS)
+# Segni che il comando ne contiene più di uno: meglio lasciarlo al modello
+_COMPOUND = re.compile(r"\b(?:e poi|e anche|dopo di che|inoltre)\b|\be\s+(?:aggiungi|elimina|cancella|sposta|crea)\b", _FLAGS)
+_UNSUPPORTED = re.compile(r"\b(?:sposta|rinomina|modifica|cambia|ogni|tutti i|tutte le|settimana prossima|prossima settimana|mese)\b", _FLAGS)
+
+
+def _number(token):
+    token = token.lower()
+    return int(token) if token.isdigit() else NUMBERS[token]
+
+
+def _weekday(name):
+    return [day[:3] for day in WEEKDAYS].index(name[:3].lower())
+
+
+# Espressioni di data: (pattern, funzione che dal match e da oggi ricava la data)
+_DATE_RULES = [
+    (r"\bdopodomani\b", lambda m, today: today + timedelta(days=2)),
+    (r"\b(?:domani|domattina)\b", lambda m, today: today + timedelta(days=1)),
+    (r"\b(?:oggi|stamattina|stasera|stanotte|stamani)\b", lambda m, today: today),
+    (rf"\b(?:tra|fra)\s+{_NUMBER}\s+(giorn[oi]|settiman[ae])\b",
+     lambda m, today: today + timedelta(days=_number(m.group(1)) * (7 if m.group(2).lower().startswith('settiman') else 1))),
+    (rf"\b(?:(?:il|di|questo|questa)\s+)?{_WEEKDAY}(\s+prossim[oa])?\b",
+     lambda m, today: today + timedelta(days=(_weekday(m.group(1)) - today.weekday()) % 7 or (7 if m.group(2) else 0))),
+    (r"\b(?:il\s+)?(\d{1,2})/(\d{1,2})(?:/(\d{2,4}))?\b", lambda m, today: _explicit_date(
+        int(m.group(1)), int(m.group(2)), m.group(3), today)),
+    (r"\b(?:il\s+)?(\d{1,2}|primo|1°)\s+(" + "|".join(MONTHS) + r")(?:\s+(\d{4}))?\b", lambda m, today: _explicit_date(
+        1 if not m.group(1).isdigit() else int(m.group(1)), MONTHS.index(m.group(2).lower()) + 1, m.group(3), today)),
+]
+_DATE_RULES = [(re.compile(r"(?:\b(?:per|entro|a partire da)\s+)?" + pattern, _FLAGS), rule) for pattern, rule in _DATE_RULES]
+
+
+def _explicit_date(day, month, year, today):
+    """Data esplicita; senza anno è la prossima occorrenza (oggi compreso)"""
+    if year:
+        year = int(year)
+        year = year + 2000 if year < 100 else year
+        return datetime(year, month, day).date()
+    candidate = datetime(today.year, month, day).date()
+    if candidate < today:
+        candidate = datetime(today.year + 1, month, day).date()
+    return candidate
+
+
+_TIME = (
+    r"(?:(\d{1,2})(?:[:.](\d{2}))?(?:\s+e\s+(mezza|mezzo|un quarto|tre quarti))?|(mezzogiorno|mezzanotte)|((?<=all')una|l'una))"
+    r"(?:\s+(?:di|del|della)\s+(mattina|pomeriggio|sera|notte))?"
+)
+_TIME_RANGE = re.compile(rf"\b(?:dalle|da)\s+{_TIME}\s+(?:alle|a)\s+{_TIME}", _FLAGS)
+# "a" da solo introduce un orario solo nella forma HH:MM o con mezzogiorno/mezzanotte
+# ("a 2 passi" non è un orario)
+_TIME_AT = re.compile(
+    rf"(?:\b(?:alle|all'|alle ore|per le|verso le)\s*|\b(?:ore)\s+|\ba\s+(?=\d{{1,2}}[:.]\d{{2}}\b|mezzogiorno|mezzanotte)){_TIME}",
+    _FLAGS)
+# Date che indicano anche la parte del giorno: "stasera alle 9" sono le 21
+_EVENING = re.compile(r"\b(?:stasera|stanotte)\b", _FLAGS)
+# Resti di un orario nel titolo: il comando non è stato capito del tutto
+_LEFTOVER_TIME = re.compile(r"\d|\balle\b|\ball'|\ba\s+mezz", _FLAGS)
+_DURATION = re.compile(rf"\bper\s+(?:{_NUMBER}\s+(or[ae]|minut[oi])|(mezz'?ora|un'?ora|un'?oretta))\b", _FLAGS)
+_MINUTES = {'mezza': 30, 'mezzo': 30, 'un quarto': 15, 'tre quarti': 45}
+
+
+def _clock(groups, evening=False):
+    """Orario da un match di _TIME (6 gruppi); le ore 1-7 senza indicazione sono del pomeriggio.
+
+    Con evening (la data era "stasera" o "stanotte") le ore fino alle 11 senza indicazione
+    sono di sera.
+    """
+    hour, minute, fraction, named, one, period = groups
+    if named:
+        return time(12) if named.lower() == 'mezzogiorno' else time(0)
+    hour = 1 if one else int(hour)
+    minute = int(minute) if minute else _MINUTES.get((fraction or '').lower(), 0)
+    if hour > 23 or minute > 59:
+        return None
+    period = (period or '').lower() or ('sera' if evening else '')
+    if period in ('pomeriggio', 'sera') and hour < 12:
+        hour += 12
+    elif not period and 1 <= hour <= 7:
+        hour += 12
+    return time(hour % 24, minute)
+
+
+def _take(pattern, text):
+    """Primo match del pattern e testo senza il match"""
+    match = pattern.search(text)
+    if match is None:
+        return None, text
+    return match, (text[:match.start()] + ' ' + text[match.end():])
+
+
+def parse_datetime(text, today=None):
+    """Data, ora di inizio, ora di fine e durata trovate nel testo, più il testo rimasto.
+
+    Ogni espressione riconosciuta viene tolta dal testo, così quello che resta è il titolo.
+    Un orario non valido ("alle 25") resta nel testo: il titolo con un numero abbassa la
+    confidenza e il comando passa al modello invece di finire alle 9.
+    """
+    today = today or datetime.now().date()
+    date = start = end = duration = None
+    evening = False
+    for pattern, rule in _DATE_RULES:
+        match, rest = _take(pattern, text)
+        if match is not None:
+            try:
+                date = rule(match, today)
+            except ValueError:
+                continue
+            evening = _EVENING.search(match.group(0)) is not None
+            text = rest
+            break
+
+    match, rest = _take(_TIME_RANGE, text)
+    if match is not None:
+        start, end = _clock(match.groups()[:6], evening), _clock(match.groups()[6:], evening)
+        if start is None or end is None:
+            start = end = None
+        else:
+            text = rest
+    else:
+        match, rest = _take(_TIME_AT, text)
+        if match is not None:
+            start = _clock(match.groups(), evening)
+            if start is not None:
+                text = rest
+
+    match, text = _take(_DURATION, text)
+    if match is not None:
+        amount, unit, short = match.groups()
+        if short:
+            duration = timedelta(minutes=30 if short.lower().startswith('mezz') else 60)
+        else:
+            value = _number(amount)
+            duration = timedelta(hours=value) if unit.lower().startswith('or') else timedelta(minutes=value)
+    return date, start, end, duration, text
+
+
+def _clean_title(text, capitalize=True):
+    text = _CALENDAR.sub(' ', text)
+    text = re.sub(r"\s+", ' ', text).strip(" ,.:;!?")
+    # Preposizioni rimaste tra oggetto e titolo ("per domani di comprare il latte")
+    text = re.sub(r"^(?:(?:di|per|che|da|a|:)\s+)+", '', text, flags=_FLAGS)
+    text = re.sub(r"\s+(?:di|per|a|il|la|alle)$", '', text, flags=_FLAGS)
+    return text[:1].upper() + text[1:] if capitalize else text
+
+
+def _day_label(date, today):
+    if date == today:
+        return "oggi"
+    if date == today + timedelta(days=1):
+        return "domani"
+    if date == today + timedelta(days=2):
+        return "dopodomani"
+    return f"{WEEKDAYS[date.weekday()]} {date.strftime('%d/%m')}"
+
+
+def parse_intent(text, now=None):
+    """Riconosce i comandi più comuni senza il modello. None se il comando non è riconosciuto.
+
+    Con confidence sotto FAST_PATH_CONFIDENCE il risultato va considerato solo un indizio:
+    comandi composti, ricorrenze o titoli troppo lunghi sono lasciati al modello.
+    """
+    now = now or datetime.now()
+    today = now.date()
+    text = _POLITE.sub('', text.strip()).strip()
+    if not text:
+        return None
+    # "domani aggiungi ...": la data in testa va dopo il verbo
+    for pattern, _ in _DATE_RULES:
+        match = pattern.match(text)
+        if match is not None:
+            text = f"{text[match.end():].strip()} {match.group(0)}"
+            break
+    confidence = 1.0
+    if _COMPOUND.search(text):
+        confidence -= 0.5
+    if _UNSUPPORTED.search(text):
+        confidence -= 0.4
+
+    verb, rest = _take(_ADD, text)
+    if verb is not None:
+        noun, rest = _take(_NOUN, rest)
+        event_type = NOUN_TYPES[noun.group(1).lower()] if noun else (
+            'reminder' if verb.group(1).lower() == 'ricordami' else 'general')
+        date, start, end, duration, rest = parse_datetime(rest, today)
+        title = _clean_title(rest)
+        if not title:
+            return None
+        if date is None:
+            date, confidence = today, confidence - 0.1
+        if start is None:
+            start = time(9)
+        if end is None:
+            end = (datetime.combine(date, start) + duration).time() if duration else start
+        if len(title.split()) > 8 or _LEFTOVER_TIME.search(title):
+            # Titoli lunghi o con resti di un orario: probabilmente c'è un'espressione non capita
+            confidence -= 0.3
+        kind = noun.group(1).lower() if noun else ('promemoria' if event_type == 'reminder' else 'evento')
+        if kind in TITLE_NOUNS and _COMPLEMENT.match(title):
+            title = f"{kind.capitalize()} {title[:1].lower()}{title[1:]}"
+        data = {
+            'title': title,
+            'description': title,
+            'date': date.isoformat(),
+            'time': start.strftime('%H:%M'),
+            'end_time': end.strftime('%H:%M'),
+            'event_type': event_type,
+        }
+        article = ARTICLES[kind] + ('' if ARTICLES[kind].endswith("'") else ' ')
+        response = f"Ho aggiunto {article}{kind} '{title}' per {_day_label(date, today)} alle {data['time']}."
+        return Intent('add_event', data, response, confidence)
+
+    verb, rest = _take(_DELETE, text)
+    if verb is not None:
+        noun, rest = _take(_NOUN, rest)
+        # Le task si eliminano per nome esatto: il titolo resta com'è stato detto
+        title = _clean_title(rest, capitalize=False)
+        if not title:
+            return None
+        kind = noun.group(1).lower() if noun else "task"
+        if noun and NOUN_TYPES[kind] != 'task':
+            # Solo le task si eliminano per titolo; gli eventi richiedono di capire quale
+            confidence -= 0.5
+        return Intent('delete_task', {'title': title}, f"Ho eliminato la task '{title}'.", confidence)
+
+    match = _FREE.search(text)
+    if match is not None:
+        date, _, _, duration, _ = parse_datetime(text[match.end():], today)
+        data = {
+            'date': (date or today).isoformat(),
+            'duration_minutes': int(duration.total_seconds() // 60) if duration else 60,
+        }
+        return Intent('find_free_slot', data, "", confidence)
+
+    for pattern, action in ((_LIST, 'list_events'), (_COUNT, 'count_events')):
+        match = pattern.search(text)
+        if match is not None:
+            date, _, _, _, rest = parse_datetime(text[match.end():], today)
+            if _clean_title(rest):
+                confidence -= 0.3
+            date = date or today
+            return Intent(action, {'date': date.isoformat(), 'label': _day_label(date, today)}, "", confidence)
+
+    if _NEXT.search(text):
+        return Intent('next_event', {}, "", confidence)
+    return None
@@ -0,0 +1,200 @@
+import numpy as np
+import pandas as pd
+
+from event_schema import parse_datetimes
+from recurrence import expand_occurrences, parse_rule
+
+# Gli eventi più lunghi di questa soglia stanno in un elenco a parte,
+# così la ricerca binaria sugli eventi brevi resta limitata alla finestra
+LONG_EVENT_SPAN = pd.Timedelta(days=1)
+
+
+def _to_ns(value):
+    return pd.Timestamp(value).value
+
+
+class EventIntervalIndex:
+    """Indice a intervalli su (start_datetime, end_datetime) per le query per finestra.
+
+    Gli eventi brevi sono ordinati per inizio: una finestra [start, end) si risolve
+    con due ricerche binarie (O(log N + k)). Gli eventi lunghi, pochi, vengono
+    filtrati a parte. Un evento con fine mancante o precedente all'inizio è
+    trattato come puntuale. Gli eventi con una regola valida in recurring non
+    entrano nell'indice: le loro occorrenze vengono espanse solo nella finestra
+    richiesta.
+    """
+
+    def __init__(self, events):
+        self.events = events.reset_index(drop=True)
+        n = len(self.events)
+        if n:
+            starts = parse_datetimes(self.events['start_datetime'])
+            ends = parse_datetimes(self.events['end_datetime'])
+        else:
+            starts = ends = pd.Series([], dtype='datetime64[ns]')
+        self.events['start_datetime'] = starts
+        self.events['end_datetime'] = ends
+
+        valid = starts.notna().to_numpy()
+        recurring = np.zeros(n, dtype=bool)
+        if 'recurring' in self.events:
+            rules = self.events['recurring']
+            candidates = np.flatnonzero(valid & (rules.astype(str).str.strip().str.len() > 0).to_numpy() & rules.notna().to_numpy())
+            for i in candidates:
+                recurring[i] = parse_rule(rules.iat[i], starts.iat[i]) is not None
+        self._masters = self.events.iloc[np.flatnonzero(recurring)]
+        valid = valid & ~recurring
+        rows = np.flatnonzero(valid)
+        start_ns = starts.to_numpy(dtype='datetime64[ns]').view('int64')[rows]
+        end_ns = ends.to_numpy(dtype='datetime64[ns]').view('int64')[rows]
+        # Fine effettiva: almeno 1ns dopo l'inizio (eventi puntuali o fine mancante)
+        end_ns = np.where(ends.notna().to_numpy()[rows], end_ns, start_ns)
+        end_ns = np.maximum(end_ns, start_ns + 1)
+
+        is_long = (end_ns - start_ns) > LONG_EVENT_SPAN.value
+        order = np.argsort(start_ns[~is_long], kind='stable')
+        self._short_rows = rows[~is_long][order]
+        self._short_starts = start_ns[~is_long][order]
+        self._short_ends = end_ns[~is_long][order]
+        self._long_rows = rows[is_long]
+        self._long_starts = start_ns[is_long]
+        self._long_ends = end_ns[is_long]
+
+        ids = pd.to_numeric(self.events['id'], errors='coerce') if 'id' in self.events else pd.Series([], dtype=float)
+        self.max_id = int(ids.max()) if ids.notna().any() else 0
+
+    def __len__(self):
+        return len(self.events)
+
+    def overlapping_rows(self, start, end):
+        """Posizioni degli eventi che si sovrappongono a [start, end), ordinate per inizio"""
+        start_ns, end_ns = _to_ns(start), _to_ns(end)
+
+        # Un evento breve che termina dopo start è iniziato al massimo LONG_EVENT_SPAN prima
+        lo = np.searchsorted(self._short_starts, start_ns - LONG_EVENT_SPAN.value, side='right')
+        hi = np.searchsorted(self._short_starts, end_ns, side='left')
+        short = lo + np.flatnonzero(self._short_ends[lo:hi] > start_ns)
+
+        long_mask = (self._long_starts < end_ns) & (self._long_ends > start_ns)
+        if not long_mask.any():
+            return self._short_rows[short]
+
+        rows = np.concatenate([self._short_rows[short], self._long_rows[long_mask]])
+        starts = np.concatenate([self._short_starts[short], self._long_starts[long_mask]])
+        return rows[np.argsort(starts, kind='stable')]
+
+    def query(self, start, end):
+        """Eventi che si sovrappongono a [start, end), con le date già convertite.
+
+        Le occorrenze degli eventi ricorrenti sono incluse come righe a sé.
+        """
+        events = self.events.iloc[self.overlapping_rows(start, end)]
+        if self._masters.empty:
+            return events
+        occurrences = expand_occurrences(self._masters, start, end)
+        if occurrences.empty:
+            return events
+        return pd.concat([events, occurrences]).sort_values('start_datetime', kind='stable')
+
+    def overlapping(self, start, end, min_duration=pd.Timedelta(0)):
+        """Eventi che si sovrappongono a [start, end) e le loro fini effettive.
+
+        Gli eventi senza durata (o con fine mancante) occupano almeno min_duration
+        dal loro inizio, così anche un promemoria puntuale conta come occupato.
+        """
+        start, end = pd.Timestamp(start), pd.Timestamp(end)
+        events = self.query(start - min_duration, end)
+        starts = events['start_datetime']
+        ends = events['end_datetime'].where(events['end_datetime'] > starts, starts)
+        ends = ends.where(ends - starts >= min_duration, starts + min_duration)
+        overlap = ((starts < end) & (ends > start)).to_numpy()
+        return events[overlap], ends[overlap]
+
+    def busy_intervals(self, start, end, min_duration=pd.Timedelta(0)):
+        """Intervalli occupati dentro [start, end), uniti e ordinati, come coppie di Timestamp"""
+        start, end = pd.Timestamp(start), pd.Timestamp(end)
+        events, ends = self.overlapping(start, end, min_duration)
+        merged = []
+        for s, e in sorted(zip(events['start_datetime'].clip(lower=start), ends.clip(upper=end))):
+            if s >= e:
+                continue
+            if merged and s <= merged[-1][1]:
+                merged[-1][1] = max(merged[-1][1], e)
+            else:
+                merged.append([s, e])
+        return [tuple(interval) for interval in merged]
+
+    def free_slots(self, duration, start, end, day_start, day_end, limit=3, min_duration=pd.Timedelta(0)):
+        """Primi `limit` intervalli liberi lunghi almeno duration tra start ed end.
+
+        Si cercano solo nelle ore di lavoro di ogni giorno [day_start, day_end), date
+        come scostamenti dalla mezzanotte. Ogni giorno costa una query sull'indice,
+        quindi la ricerca non dipende dal numero totale di eventi.
+        """
+        start, end = pd.Timestamp(start), pd.Timestamp(end)
+        slots = []
+        day = start.normalize()
+        while day < end and len(slots) < limit:
+            lo, hi = max(day + day_start, start), min(day + day_end, end)
+            if lo < hi:
+                cursor = lo
+                for busy_start, busy_end in self.busy_intervals(lo, hi, min_duration):
+                    if busy_start - cursor >= duration:
+                        slots.append((cursor, busy_start))
+                    cursor = max(cursor, busy_end)
+                if hi - cursor >= duration:
+                    slots.append((cursor, hi))
+            day += pd.Timedelta(days=1)
+        return slots[:limit]
+
+    def page(self, start, end, after=None, limit=50):
+        """Una pagina degli eventi che si sovrappongono a [start, end), in ordine di inizio.
+
+        after è il cursore restituito dalla pagina precedente: (inizio in ns dell'ultimo
+        evento mostrato, quanti eventi con quell'inizio sono già stati mostrati).
+        Restituisce (eventi, cursore della pagina successiva o None). Il costo dipende
+        dalla pagina e non dalla lunghezza dell'intervallo: si leggono al più limit
+        eventi brevi dopo il cursore e le ricorrenze sono espanse solo fin lì.
+        """
+        start_ns, end_ns = _to_ns(start), _to_ns(end)
+        floor, skip = after if after is not None else (None, 0)
+        need = skip + limit
+
+        lo = np.searchsorted(self._short_starts, start_ns - LONG_EVENT_SPAN.value, side='right')
+        hi = np.searchsorted(self._short_starts, end_ns, side='left')
+        if floor is not None:
+            lo = max(lo, np.searchsorted(self._short_starts, floor, side='left'))
+        # Prima di start ci sono anche eventi già finiti, scartati sotto: si contano
+        # i need eventi da leggere solo da start in poi
+        cap = min(hi, max(lo, np.searchsorted(self._short_starts, start_ns, side='left')) + need)
+        if lo < cap < hi:
+            # Gli eventi con lo stesso inizio dell'ultimo letto entrano tutti: l'ordine a
+            # parità di inizio deve essere lo stesso da una pagina all'altra
+            cap = min(hi, np.searchsorted(self._short_starts, self._short_starts[cap - 1], side='right'))
+        short = lo + np.flatnonzero(self._short_ends[lo:cap] > start_ns)
+        # Oltre l'ultimo evento breve letto (arrotondato al µs) nessun altro evento può entrare nella pagina
+        horizon = self._short_starts[cap - 1] + 1000 if lo < cap < hi else end_ns
+
+        long_mask = (self._long_starts < min(end_ns, horizon)) & (self._long_ends > start_ns)
+        if floor is not None:
+            long_mask &= self._long_starts >= floor
+        rows = np.concatenate([self._short_rows[short], self._long_rows[long_mask]])
+        starts = np.concatenate([self._short_starts[short], self._long_starts[long_mask]])
+        events = self.events.iloc[rows]
+
+        if not self._masters.empty:
+            window_start = start_ns if floor is None else max(start_ns, floor)
+            occurrences = expand_occurrences(self._masters, pd.Timestamp(window_start), pd.Timestamp(min(end_ns, horizon)))
+            if not occurrences.empty:
+                occurrence_starts = occurrences['start_datetime'].to_numpy(dtype='datetime64[ns]').view('int64')
+                keep = occurrence_starts >= floor if floor is not None else np.ones(len(occurrences), dtype=bool)
+                events = pd.concat([events, occurrences[keep]])
+                starts = np.concatenate([starts, occurrence_starts[keep]])
+
+        order = np.argsort(starts, kind='stable')[skip:need]
+        events, starts = events.iloc[order], starts[order]
+        if len(events) < limit:
+            return events, None
+        last = int(starts[-1])
+        shown = int((starts == last).sum()) + (skip if last == floor else 0)
+        return events, (last, shown)
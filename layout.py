@@ -0,0 +1,127 @@
+import heapq
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+# Durata minima con cui un evento occupa la griglia oraria: molti eventi hanno fine = inizio
+MIN_DURATION = pd.Timedelta(minutes=30)
+
+# Pezzo di un evento dentro un giorno della finestra. row è la posizione dell'evento
+# nel DataFrame, start/end sono già ritagliati sul giorno, first indica il primo pezzo
+Segment = namedtuple('Segment', ['row', 'day', 'start', 'end', 'lane', 'lanes', 'first'])
+
+
+def assign_lanes(starts, ends):
+    """Corsie per intervalli [start, end) con una sweep line sugli estremi, in O(n log n).
+
+    Restituisce (corsia, corsie del gruppo) per ogni intervallo: un gruppo è un insieme
+    di intervalli collegati da sovrapposizioni, e tutti i suoi membri condividono la
+    larghezza. Intervalli che si toccano soltanto (fine = inizio) non si sovrappongono.
+    """
+    n = len(starts)
+    lanes = np.zeros(n, dtype=np.int64)
+    widths = np.ones(n, dtype=np.int64)
+    order = np.lexsort((ends, starts))
+
+    active = []      # heap (fine, corsia) degli intervalli aperti
+    free = []        # heap delle corsie liberate nel gruppo corrente
+    group = []
+    next_lane = 0
+    for i in order.tolist():
+        start = starts[i]
+        while active and active[0][0] <= start:
+            heapq.heappush(free, heapq.heappop(active)[1])
+        if not active and group:
+            # Nessun intervallo aperto: il gruppo precedente è chiuso
+            widths[group] = next_lane
+            group, free, next_lane = [], [], 0
+        if free:
+            lane = heapq.heappop(free)
+        else:
+            lane = next_lane
+            next_lane += 1
+        lanes[i] = lane
+        heapq.heappush(active, (ends[i], lane))
+        group.append(i)
+    if group:
+        widths[group] = next_lane
+    return lanes, widths
+
+
+def _intervals(events):
+    """Inizi e fini valide degli eventi, con la fine mai precedente all'inizio"""
+    starts = pd.to_datetime(events['start_datetime'], errors='coerce')
+    ends = pd.to_datetime(events['end_datetime'], errors='coerce')
+    ends = ends.where(ends.notna() & (ends > starts), starts)
+    valid = starts.notna().to_numpy()
+    rows = np.flatnonzero(valid)
+    return rows, starts.to_numpy()[valid], ends.to_numpy()[valid]
+
+
+def _split_days(rows, starts, ends, window_start, window_end):
+    """Spezza gli intervalli a mezzanotte dentro la finestra, in modo vettoriale.
+
+    Restituisce riga, inizio e fine di ogni pezzo (datetime64[ns]) e se il pezzo è il primo.
+    """
+    lo = np.datetime64(pd.Timestamp(window_start), 'ns')
+    hi = np.datetime64(pd.Timestamp(window_end), 'ns')
+    clip_start = np.maximum(starts, lo)
+    clip_end = np.minimum(ends, hi)
+    keep = clip_start < clip_end
+    rows, starts, clip_start, clip_end = rows[keep], starts[keep], clip_start[keep], clip_end[keep]
+
+    first_day = clip_start.astype('datetime64[D]')
+    last_day = (clip_end - np.timedelta64(1, 'ns')).astype('datetime64[D]')
+    counts = (last_day - first_day).astype(np.int64) + 1
+    owner = np.repeat(np.arange(len(rows)), counts)
+    # Posizione del pezzo dentro il suo evento: 0, 1, ... counts-1
+    step = np.arange(len(owner)) - np.repeat(np.cumsum(counts) - counts, counts)
+    day = (first_day[owner] + step).astype('datetime64[ns]')
+    piece_start = np.maximum(clip_start[owner], day)
+    piece_end = np.minimum(clip_end[owner], day + np.timedelta64(1, 'D'))
+    return rows[owner], piece_start, piece_end, piece_start == starts[owner]
+
+
+def _segments(rows, starts, ends, first, lanes, widths):
+    days = starts.astype('datetime64[D]').tolist()
+    starts = starts.astype('datetime64[us]').tolist()
+    ends = ends.astype('datetime64[us]').tolist()
+    return [
+        Segment(*values)
+        for values in zip(rows.tolist(), days, starts, ends, lanes.tolist(), widths.tolist(), first.tolist())
+    ]
+
+
+def layout_days(events, window_start, window_end):
+    """Disposizione per la vista mensile: un pezzo per ogni giorno coperto da un evento.
+
+    Le corsie sono calcolate sui giorni interi, così un evento di più giorni resta
+    nella stessa riga della cella per tutta la sua durata.
+    """
+    rows, starts, ends = _intervals(events)
+    # Un evento occupa almeno il suo giorno di inizio; la fine è esclusiva
+    ends = np.maximum(ends, starts + np.timedelta64(1, 'ns'))
+    first_days = starts.astype('datetime64[D]').astype(np.int64)
+    last_days = (ends - np.timedelta64(1, 'ns')).astype('datetime64[D]').astype(np.int64)
+    lanes, widths = assign_lanes(first_days, last_days + 1)
+
+    owner, piece_start, piece_end, first = _split_days(np.arange(len(rows)), starts, ends, window_start, window_end)
+    segments = _segments(rows[owner], piece_start, piece_end, first, lanes[owner], widths[owner])
+    segments.sort(key=lambda s: (s.day, s.lane))
+    return segments
+
+
+def layout_hours(events, window_start, window_end):
+    """Disposizione per le viste settimanale e giornaliera.
+
+    Ogni evento è spezzato a mezzanotte nei giorni della finestra; i pezzi sovrapposti
+    dello stesso giorno ricevono corsie affiancate.
+    """
+    rows, starts, ends = _intervals(events)
+    ends = np.maximum(ends, starts + MIN_DURATION.to_timedelta64())
+    rows, piece_start, piece_end, first = _split_days(rows, starts, ends, window_start, window_end)
+    lanes, widths = assign_lanes(piece_start.astype(np.int64), piece_end.astype(np.int64))
+    segments = _segments(rows, piece_start, piece_end, first, lanes, widths)
+    segments.sort(key=lambda s: (s.start, s.lane))
+    return segments
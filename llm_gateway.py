@@ -0,0 +1,370 @@
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+import openai
+from dotenv import load_dotenv
+
+import metrics
+
+load_dotenv()
+
+DEFAULT_MODEL = "gpt-3.5-turbo"
+
+# Limiti del processo, configurabili dall'ambiente: richieste al secondo (con una
+# raffica massima), richieste contemporanee, tentativi e tempo massimo per chiamata
+LLM_RATE = float(os.getenv("LLM_RATE", "3"))
+LLM_BURST = int(os.getenv("LLM_BURST", "6"))
+LLM_MAX_IN_FLIGHT = int(os.getenv("LLM_MAX_IN_FLIGHT", "4"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "3"))
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "30"))
+# Richieste identiche (modello, messaggi e parametri) in corso insieme condividono una
+# sola chiamata al server; il risultato resta riusabile per LLM_CACHE_TTL secondi
+LLM_CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", "30"))
+LLM_CACHE_SIZE = int(os.getenv("LLM_CACHE_SIZE", "256"))
+# Attesa base e massima tra due tentativi (secondi), prima del jitter
+RETRY_BASE = 0.5
+RETRY_CAP = 8.0
+
+
+class LLMTimeoutError(TimeoutError):
+    """La chiamata non può concludersi entro la scadenza richiesta"""
+
+
+class LLMStreamInterrupted(RuntimeError):
+    """Il flusso della risposta si è chiuso prima della fine del messaggio"""
+
+
+class TokenBucket:
+    """Limite di frequenza: rate gettoni al secondo, al massimo capacity accumulati"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, deadline):
+        """Prende un gettone aspettando se serve; LLMTimeoutError se non arriva prima di deadline"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            if now + wait > deadline:
+                raise LLMTimeoutError("limite di frequenza: nessun gettone prima della scadenza")
+            metrics.incr('llm.throttled')
+            time.sleep(wait)
+
+
+def _retry_delay(attempt, error):
+    """Attesa prima del prossimo tentativo: Retry-After se il server lo indica,
+    altrimenti backoff esponenziale con jitter pieno"""
+    response = getattr(error, 'response', None)
+    retry_after = response.headers.get('retry-after') if response is not None else None
+    if retry_after:
+        try:
+            return min(float(retry_after), RETRY_CAP)
+        except ValueError:
+            pass
+    return random.uniform(0, min(RETRY_CAP, RETRY_BASE * 2 ** attempt))
+
+
+def _retryable(error):
+    if isinstance(error, (openai.RateLimitError, openai.InternalServerError, openai.APIConnectionError)):
+        return True
+    return isinstance(error, openai.APIStatusError) and error.status_code >= 500
+
+
+def _request_key(model, messages, params):
+    """Impronta di una richiesta: uguale solo per modello, messaggi e parametri identici"""
+    payload = json.dumps([model, messages, params], sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class _Flight:
+    """Una chiamata al server condivisa da tutte le richieste identiche.
+
+    Raccoglie i pezzi di una risposta in streaming (o la risposta intera) e li
+    distribuisce a chi aspetta; conclusa con successo, resta come risultato in cache
+    fino a expires.
+    """
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self.chunks = []
+        self.done = False
+        self.result = None
+        self.error = None
+        self.expires = None
+        self._cond = threading.Condition()
+
+    def append(self, chunk):
+        with self._cond:
+            self.chunks.append(chunk)
+            self._cond.notify_all()
+
+    def finish(self, result=None, error=None):
+        with self._cond:
+            self.result, self.error, self.done = result, error, True
+            self.expires = time.monotonic() + self.ttl
+            self._cond.notify_all()
+
+    def replay(self, deadline):
+        """Genera tutti i pezzi, anche quelli già arrivati, e restituisce il risultato"""
+        sent = 0
+        while True:
+            with self._cond:
+                while sent == len(self.chunks) and not self.done:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise LLMTimeoutError("scadenza raggiunta aspettando la risposta condivisa")
+                    self._cond.wait(remaining)
+                chunks, done = self.chunks[sent:], self.done
+            for chunk in chunks:
+                yield chunk
+            sent += len(chunks)
+            if done and sent == len(self.chunks):
+                if self.error is not None:
+                    raise self.error
+                return self.result
+
+
+class LLMGateway:
+    """Unico punto di accesso al modello per tutto il processo.
+
+    Un solo client HTTP con connessioni keep-alive, un token bucket per la frequenza,
+    un semaforo per le richieste contemporanee e nuovi tentativi con jitter su 429,
+    5xx ed errori di rete. Ogni chiamata ha una scadenza complessiva: attese, tentativi
+    e richieste devono stare tutti entro quella.
+
+    Le richieste identiche fatte insieme (anche da sessioni diverse) sono servite da
+    una sola chiamata al server e quelle ripetute entro cache_ttl secondi dal risultato
+    già pronto. Le richieste con tools non usano la cache dei risultati: le chiamate a
+    strumenti eseguono azioni e un comando ripetuto deve arrivare di nuovo al modello.
+    Metriche: llm.upstream, llm.coalesced e llm.cached.
+    """
+
+    def __init__(self, api_key, organization=None, base_url=None, rate=LLM_RATE, burst=LLM_BURST,
+                 max_in_flight=LLM_MAX_IN_FLIGHT, max_retries=LLM_MAX_RETRIES, timeout=LLM_TIMEOUT,
+                 cache_ttl=LLM_CACHE_TTL, cache_size=LLM_CACHE_SIZE):
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.cache_ttl = cache_ttl
+        self.cache_size = cache_size
+        self._http = httpx.Client(
+            limits=httpx.Limits(max_connections=max_in_flight, max_keepalive_connections=max_in_flight,
+                                keepalive_expiry=60),
+            timeout=timeout,
+        )
+        # I tentativi sono gestiti qui, non dal client: così rispettano limiti e scadenza
+        self.client = openai.OpenAI(api_key=api_key, organization=organization, base_url=base_url,
+                                    http_client=self._http, max_retries=0, timeout=timeout)
+        self._bucket = TokenBucket(rate, burst)
+        self._slots = threading.BoundedSemaphore(max_in_flight)
+        self._flights = OrderedDict()
+        self._flights_lock = threading.Lock()
+        # Gli stream condivisi vengono letti dal server in thread propri: se una sessione
+        # smette di leggere, le altre continuano a ricevere
+        self._pumps = ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix='llm-stream')
+
+    def _join(self, key, cacheable=True):
+        """(chiamata condivisa per key, True se tocca a chi chiede avviarla).
+
+        Con cacheable=False la chiamata è condivisa solo finché è in corso.
+        """
+        metrics.incr('llm.calls')
+        with self._flights_lock:
+            flight = self._flights.get(key)
+            if flight is not None and flight.done and (flight.error is not None or time.monotonic() > flight.expires):
+                del self._flights[key]
+                flight = None
+            if flight is not None:
+                metrics.incr('llm.cached' if flight.done else 'llm.coalesced')
+                return flight, False
+            flight = self._flights[key] = _Flight(self.cache_ttl if cacheable else 0)
+            # Fuori misura: via i risultati più vecchi (le chiamate in corso restano)
+            for old_key in [k for k, f in self._flights.items() if f.done][:max(0, len(self._flights) - self.cache_size)]:
+                del self._flights[old_key]
+        metrics.incr('llm.upstream')
+        return flight, True
+
+    def _forget(self, key, flight):
+        # Un errore non resta in cache: la prossima richiesta riprova
+        with self._flights_lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+
+    def chat(self, messages, model=DEFAULT_MODEL, timeout=None, **kwargs):
+        """chat.completions.create attraverso i limiti del gateway; timeout è la scadenza in secondi.
+
+        Richieste identiche in corso insieme condividono la stessa risposta.
+        """
+        deadline = time.monotonic() + (timeout or self.timeout)
+        key = _request_key(model, messages, kwargs)
+        flight, leader = self._join(key, cacheable='tools' not in kwargs)
+        if leader:
+            try:
+                flight.finish(result=self._chat_upstream(messages, model, deadline, kwargs))
+            except Exception as e:
+                self._forget(key, flight)
+                flight.finish(error=e)
+                raise
+        return _result(flight.replay(deadline))
+
+    def _chat_upstream(self, messages, model, deadline, kwargs):
+        """Una chiamata al server con limiti, nuovi tentativi e scadenza"""
+        attempt = 0
+        while True:
+            self._bucket.acquire(deadline)
+            if not self._slots.acquire(timeout=max(0.0, deadline - time.monotonic())):
+                raise LLMTimeoutError("troppe richieste in corso fino alla scadenza")
+            metrics.incr('llm.request')
+            try:
+                with metrics.timer('llm.request'):
+                    return self.client.chat.completions.create(
+                        model=model, messages=messages, timeout=max(0.1, deadline - time.monotonic()), **kwargs)
+            except Exception as e:
+                if not _retryable(e) or attempt >= self.max_retries:
+                    metrics.incr('llm.error')
+                    raise
+                delay = _retry_delay(attempt, e)
+                if time.monotonic() + delay >= deadline:
+                    metrics.incr('llm.error')
+                    raise LLMTimeoutError(f"scadenza raggiunta dopo {attempt + 1} tentativi") from e
+            finally:
+                self._slots.release()
+            metrics.incr('llm.retry')
+            attempt += 1
+            time.sleep(delay)
+
+    def chat_stream(self, messages, model=DEFAULT_MODEL, timeout=None, **kwargs):
+        """Come chat, ma genera i pezzi di testo della risposta man mano che arrivano.
+
+        I nuovi tentativi sono possibili solo prima del primo pezzo: dopo, un errore
+        interrompe il flusso e chi legge tiene quello che ha già ricevuto. Il tempo al
+        primo pezzo finisce nella metrica llm.ttft.
+
+        Con tools, i frammenti delle chiamate a strumenti vengono ricomposti e il
+        generatore li restituisce alla fine (valore di ritorno, una lista di dict con
+        id, name e arguments); mentre arrivano genera pezzi vuoti, utili come avanzamento.
+
+        Chi fa la stessa richiesta mentre la prima è in corso riceve da capo gli stessi
+        pezzi, senza una nuova chiamata al server.
+        """
+        deadline = time.monotonic() + (timeout or self.timeout)
+        key = _request_key(model, messages, dict(kwargs, stream=True))
+        flight, leader = self._join(key, cacheable='tools' not in kwargs)
+        if leader:
+            self._pumps.submit(self._pump, key, flight, messages, model, deadline, kwargs)
+        return (yield from flight.replay(deadline))
+
+    def _pump(self, key, flight, messages, model, deadline, kwargs):
+        """Legge dal server lo stream condiviso e lo passa a chi aspetta"""
+        stream = self._stream_upstream(messages, model, deadline, kwargs)
+        try:
+            while True:
+                flight.append(next(stream))
+        except StopIteration as stop:
+            flight.finish(result=stop.value)
+        except Exception as e:
+            self._forget(key, flight)
+            flight.finish(error=e)
+
+    def _stream_upstream(self, messages, model, deadline, kwargs):
+        """Uno stream dal server con limiti, nuovi tentativi (prima del primo pezzo) e scadenza"""
+        start = time.perf_counter()
+        attempt = 0
+        while True:
+            self._bucket.acquire(deadline)
+            if not self._slots.acquire(timeout=max(0.0, deadline - time.monotonic())):
+                raise LLMTimeoutError("troppe richieste in corso fino alla scadenza")
+            metrics.incr('llm.request')
+            stream = None
+            received = False
+            finished = False
+            tool_calls = {}
+            try:
+                stream = self.client.chat.completions.create(
+                    model=model, messages=messages, stream=True,
+                    timeout=max(0.1, deadline - time.monotonic()), **kwargs)
+                for chunk in stream:
+                    if not chunk.choices:
+                        continue
+                    finished = finished or chunk.choices[0].finish_reason is not None
+                    delta = chunk.choices[0].delta
+                    for call in delta.tool_calls or ():
+                        entry = tool_calls.setdefault(call.index, {'id': None, 'name': '', 'arguments': ''})
+                        entry['id'] = call.id or entry['id']
+                        if call.function is not None:
+                            entry['name'] += call.function.name or ''
+                            entry['arguments'] += call.function.arguments or ''
+                    text = delta.content or ('' if delta.tool_calls else None)
+                    if text is None:
+                        continue
+                    if not received:
+                        received = True
+                        metrics.record_time('llm.ttft', (time.perf_counter() - start) * 1000)
+                    yield text
+                    if time.monotonic() > deadline:
+                        raise LLMTimeoutError("scadenza raggiunta durante la risposta")
+                if not finished:
+                    raise LLMStreamInterrupted("connessione chiusa prima della fine della risposta")
+                metrics.record_time('llm.stream', (time.perf_counter() - start) * 1000)
+                return [tool_calls[i] for i in sorted(tool_calls)]
+            except Exception as e:
+                if received or not _retryable(e) or attempt >= self.max_retries:
+                    metrics.incr('llm.error')
+                    raise
+                delay = _retry_delay(attempt, e)
+                if time.monotonic() + delay >= deadline:
+                    metrics.incr('llm.error')
+                    raise LLMTimeoutError(f"scadenza raggiunta dopo {attempt + 1} tentativi") from e
+            finally:
+                if stream is not None:
+                    stream.close()
+                self._slots.release()
+            metrics.incr('llm.retry')
+            attempt += 1
+            time.sleep(delay)
+
+
+def _result(replay):
+    """Valore di ritorno di un replay senza pezzi (risposta non in streaming)"""
+    while True:
+        try:
+            next(replay)
+        except StopIteration as stop:
+            return stop.value
+
+
+_gateway = None
+_gateway_lock = threading.Lock()
+
+
+def get_gateway():
+    """Gateway condiviso del processo, creato alla prima richiesta; None senza credenziali.
+
+    Con OPENAI_BASE_URL le richieste vanno a un altro server compatibile, per esempio
+    quello finto di llm_stub_server.py usato nelle prove di carico.
+    """
+    global _gateway
+    with _gateway_lock:
+        if _gateway is None:
+            api_key = os.getenv("OPENAI_API_KEY")
+            if not api_key:
+                return None
+            _gateway = LLMGateway(api_key, organization=os.getenv("OPENAI_ORG_ID"),
+                                  base_url=os.getenv("OPENAI_BASE_URL"))
+        return _gateway
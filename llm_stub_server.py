@@ -0,0 +1,169 @@
+"""Server finto compatibile con le chat completions di OpenAI, per prove di carico in locale.
+
+Uso: python llm_stub_server.py --port 8765 --latency 0.3 --error-rate 0.1
+poi OPENAI_BASE_URL=http://127.0.0.1:8765/v1 (e una OPENAI_API_KEY qualsiasi).
+Risponde con un JSON di comando fisso (o, se la richiesta offre strumenti, con tre
+chiamate add_task) dopo la latenza indicata, anche in streaming;
+una parte delle richieste riceve 429 o 500, per provare i nuovi tentativi del
+gateway, e una parte dei flussi può interrompersi a metà (--cut-rate).
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_CONTENT = json.dumps({
+    "action": "add_task",
+    "data": {"title": "Prova", "description": "Risposta del server finto", "date": "", "time": "09:00",
+             "event_type": "task"},
+    "response": "Ho aggiunto il task 'Prova'.",
+}, ensure_ascii=False)
+
+# Chiamate a strumenti restituite quando la richiesta offre tools: tre task in tre giorni
+DEFAULT_TOOL_CALLS = [
+    {"name": "add_task", "arguments": json.dumps({"name": name, "start_date": day})}
+    for name, day in [("Spesa", "2030-01-07"), ("Palestra", "2030-01-08"), ("Dentista", "2030-01-09")]
+]
+
+
+class StubState:
+    """Configurazione e contatori del server, condivisi tra i thread delle richieste"""
+
+    def __init__(self, latency=0.2, error_rate=0.0, content=DEFAULT_CONTENT, token_delay=0.02, cut_rate=0.0,
+                 tool_calls=DEFAULT_TOOL_CALLS):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.content = content
+        self.tool_calls = tool_calls
+        self.token_delay = token_delay
+        self.cut_rate = cut_rate
+        self.requests = 0
+        self.errors = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.lock = threading.Lock()
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'   # connessioni keep-alive come l'API vera
+    state = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body, headers=()):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_POST(self):
+        state = self.state
+        request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        with state.lock:
+            state.requests += 1
+            state.in_flight += 1
+            state.max_in_flight = max(state.max_in_flight, state.in_flight)
+        try:
+            time.sleep(state.latency)
+            if random.random() < state.error_rate:
+                with state.lock:
+                    state.errors += 1
+                if random.random() < 0.5:
+                    self._send(429, {"error": {"message": "rate limited", "type": "requests"}}, [('Retry-After', '0.1')])
+                else:
+                    self._send(500, {"error": {"message": "server error", "type": "server_error"}})
+                return
+            if request.get("stream"):
+                self._stream(request)
+                return
+            if request.get("tools"):
+                message = {"role": "assistant", "content": None, "tool_calls": [
+                    {"id": f"call_{i}", "type": "function", "function": call}
+                    for i, call in enumerate(state.tool_calls)
+                ]}
+            else:
+                message = {"role": "assistant", "content": state.content}
+            self._send(200, {
+                "id": f"chatcmpl-stub-{state.requests}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": request.get("model", "stub"),
+                "choices": [{
+                    "index": 0,
+                    "message": message,
+                    "finish_reason": "tool_calls" if request.get("tools") else "stop",
+                }],
+                "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+            })
+        finally:
+            with state.lock:
+                state.in_flight -= 1
+
+    def _stream(self, request):
+        """Risposta in streaming (server-sent events) a pezzi di pochi caratteri; con
+        cut_rate una parte dei flussi si interrompe a metà senza chiudere il messaggio"""
+        state = self.state
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+        if request.get("tools"):
+            # Ogni chiamata arriva in due pezzi: nome e metà degli argomenti, poi il resto
+            pieces = []
+            for i, call in enumerate(state.tool_calls):
+                half = len(call["arguments"]) // 2
+                pieces.append({"tool_calls": [{"index": i, "id": f"call_{i}", "type": "function",
+                                               "function": {"name": call["name"], "arguments": call["arguments"][:half]}}]})
+                pieces.append({"tool_calls": [{"index": i, "function": {"arguments": call["arguments"][half:]}}]})
+        else:
+            pieces = [{"content": state.content[i:i + 8]} for i in range(0, len(state.content), 8)]
+        cut = len(pieces) // 2 if random.random() < state.cut_rate else None
+        base = {"id": "chatcmpl-stub-stream", "object": "chat.completion.chunk", "created": int(time.time()),
+                "model": request.get("model", "stub")}
+        for i, delta in enumerate(pieces):
+            if i == cut:
+                return
+            chunk = dict(base, choices=[{"index": 0, "delta": delta, "finish_reason": None}])
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+            self.wfile.flush()
+            time.sleep(state.token_delay)
+        finish = "tool_calls" if request.get("tools") else "stop"
+        chunk = dict(base, choices=[{"index": 0, "delta": {}, "finish_reason": finish}])
+        self.wfile.write(f"data: {json.dumps(chunk)}\n\ndata: [DONE]\n\n".encode())
+        self.wfile.flush()
+
+
+def start_stub_server(port=0, **options):
+    """Avvia il server in un thread; restituisce (server, stato, base_url)"""
+    state = StubState(**options)
+    handler = type('Handler', (StubHandler,), {'state': state})
+    server = ThreadingHTTPServer(('127.0.0.1', port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, state, f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=0.2, help="secondi per risposta")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="quota di risposte 429/500")
+    parser.add_argument('--token-delay', type=float, default=0.02, help="secondi tra due pezzi in streaming")
+    parser.add_argument('--cut-rate', type=float, default=0.0, help="quota di flussi interrotti a metà")
+    args = parser.parse_args()
+    server, state, url = start_stub_server(args.port, latency=args.latency, error_rate=args.error_rate,
+                                           token_delay=args.token_delay, cut_rate=args.cut_rate)
+    print(f"Server finto su {url}")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        server.shutdown()
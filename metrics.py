@@ -0,0 +1,58 @@
+import threading
+import time
+from contextlib import contextmanager
+
+# Contatori e tempi condivisi dal processo (tutte le sessioni Streamlit)
+_lock = threading.Lock()
+_counters = {}
+_timings = {}
+_gauges = {}
+
+
+def incr(name, n=1):
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + n
+
+
+def record_time(name, ms):
+    """Registra una durata in millisecondi: ultimo valore, media e numero di campioni"""
+    with _lock:
+        t = _timings.setdefault(name, {'count': 0, 'total_ms': 0.0, 'last_ms': 0.0})
+        t['count'] += 1
+        t['total_ms'] += ms
+        t['last_ms'] = ms
+
+
+@contextmanager
+def timer(name):
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_time(name, (time.perf_counter() - t0) * 1000)
+
+
+def gauge(name, value):
+    """Registra l'ultimo valore di una grandezza (es. dimensione in byte di un payload)"""
+    with _lock:
+        _gauges[name] = value
+
+
+def counter(name):
+    with _lock:
+        return _counters.get(name, 0)
+
+
+def hit_rate(prefix):
+    """Percentuale di hit per i contatori '<prefix>.hit' / '<prefix>.miss'"""
+    hits, misses = counter(prefix + '.hit'), counter(prefix + '.miss')
+    return hits / (hits + misses) if hits + misses else 0.0
+
+
+def snapshot():
+    with _lock:
+        timings = {
+            name: {'count': t['count'], 'avg_ms': t['total_ms'] / t['count'], 'last_ms': t['last_ms']}
+            for name, t in _timings.items()
+        }
+        return {'counters': dict(_counters), 'timings': timings, 'gauges': dict(_gauges)}
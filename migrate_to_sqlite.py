@@ -0,0 +1,15 @@
+"""Migrazione una tantum dai file CSV al database SQLite.
+
+Uso: python migrate_to_sqlite.py [percorso_db]
+Poi avvia l'app con CALENDAR_STORAGE=sqlite per usare il nuovo backend.
+"""
+import sys
+
+from storage import migrate_csv_to_sqlite
+
+if __name__ == '__main__':
+    db_path = sys.argv[1] if len(sys.argv) > 1 else 'calendar.db'
+    counts = migrate_csv_to_sqlite(db_path)
+    for table, count in counts.items():
+        print(f"{table}: {count} righe migrate")
+    print(f"Database pronto: {db_path}")
@@ -1,6 +1,7 @@
 import streamlit as st
 import pandas as pd
-from backend import delete_task, manage_tasks_with_chat
+from backend import delete_task, load_projects
+from action_executor import manage_tasks_with_chat
 
 st.set_page_config(
     page_title="Tasks - Calendar Mentor",
@@ -12,7 +13,7 @@ st.title("🎯 Task Manager")
 
 # Carica i progetti
 try:
-    projects = pd.read_csv('progetti.csv')
+    projects = load_projects()
     
     # Visualizza i progetti esistenti
     if not projects.empty:
@@ -30,6 +31,7 @@ try:
     - "Elimina la task 'Report Mensile'"
     - "Mostrami la lista delle task"
     - "Cambia lo stato della task 'Ringraziare Terlizzi' a conclusa"
+    - "Aggiungi tre task per lunedì, martedì e mercoledì: spesa, palestra e dentista"
     """)
     
     user_message = st.text_area("Scrivi il tuo messaggio:")
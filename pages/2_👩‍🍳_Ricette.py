@@ -1,6 +1,6 @@
 import streamlit as st
 import pandas as pd
-from backend import chat_with_openai
+from backend import chat_with_openai_stream, load_recipes
 
 st.set_page_config(
     page_title="Ricette - Calendar Mentor",
@@ -18,19 +18,32 @@ with st.form("recipe_form"):
     
     if st.form_submit_button("Chiedi Ricetta"):
         if recipe_prompt:
-            with st.spinner("Sto cercando la ricetta perfetta per te..."):
-                try:
-                    response = chat_with_openai(recipe_prompt)
-                    st.success("Ecco la tua ricetta!")
-                    st.write(response)
-                except Exception as e:
-                    st.error(f"Si è verificato un errore: {str(e)}")
+            st.success("Ecco la tua ricetta!")
+            reply = chat_with_openai_stream(recipe_prompt)
+
+            def keep_partial():
+                # Il testo arrivato finora resta nella sessione: se lo script viene
+                # interrotto a metà (un altro clic) la ricetta parziale non si perde
+                for chunk in reply:
+                    st.session_state.recipe_reply = (reply.text, False)
+                    yield chunk
+                st.session_state.recipe_reply = (reply.text, reply.error is None)
+
+            st.write_stream(keep_partial())
+            if reply.ttft_ms is not None:
+                st.caption(f"Primo testo dopo {reply.ttft_ms / 1000:.1f} s, risposta completa in {reply.total_ms / 1000:.1f} s")
         else:
             st.error("Per favore inserisci una richiesta per la ricetta")
+    elif "recipe_reply" in st.session_state:
+        # Ultima risposta (anche parziale) dopo un rerun
+        text, complete = st.session_state.recipe_reply
+        st.write(text)
+        if not complete:
+            st.caption("Risposta interrotta prima della fine")
 
 # Carica le ricette salvate
 try:
-    recipes = pd.read_csv('recipes.csv')
+    recipes = load_recipes()
     
     if not recipes.empty:
         st.header("Le Tue Ricette Salvate")
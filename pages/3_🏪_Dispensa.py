@@ -1,6 +1,6 @@
 import streamlit as st
 import pandas as pd
-from backend import load_pantry
+from backend import load_pantry, add_pantry_item
 from datetime import datetime
 
 st.set_page_config(
@@ -105,10 +105,8 @@ try:
                     "min_quantity": min_quantity
                 }
                 
-                # Aggiungi il nuovo elemento al DataFrame e salva
-                new_item_df = pd.DataFrame([new_item])
-                updated_pantry = pd.concat([pantry, new_item_df], ignore_index=True)
-                updated_pantry.to_csv('pantry.csv', index=False)
+                # Aggiungi il nuovo elemento alla dispensa
+                add_pantry_item(new_item)
                 
                 st.success("Elemento aggiunto con successo!")
                 st.rerun()
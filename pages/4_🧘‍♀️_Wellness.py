@@ -2,6 +2,7 @@ import streamlit as st
 import pandas as pd
 from datetime import datetime, timedelta
 import plotly.express as px
+from backend import load_wellness, add_wellness_entry
 
 st.set_page_config(
     page_title="Wellness - Calendar Mentor",
@@ -11,15 +12,13 @@ st.set_page_config(
 
 st.title("🧘‍♀️ Wellness")
 
-# Inizializza lo stato della sessione se non esiste
-if 'wellness_data' not in st.session_state:
-    try:
-        st.session_state.wellness_data = pd.read_csv('wellness.csv')
-    except FileNotFoundError:
-        st.session_state.wellness_data = pd.DataFrame(columns=[
-            'data', 'umore', 'energia', 'stress', 'sonno_ore', 'attivita_fisica_minuti',
-            'meditazione_minuti', 'note'
-        ])
+# Carica lo storico dalla cache condivisa del backend (riletto solo se il file cambia)
+st.session_state.wellness_data = load_wellness()
+if st.session_state.wellness_data.empty:
+    st.session_state.wellness_data = pd.DataFrame(columns=[
+        'data', 'umore', 'energia', 'stress', 'sonno_ore', 'attivita_fisica_minuti',
+        'meditazione_minuti', 'note'
+    ])
 
 # Form per aggiungere dati giornalieri
 st.header("Registro Giornaliero")
@@ -51,12 +50,8 @@ with st.form("wellness_form"):
             'note': note
         }
         
-        # Aggiungi i nuovi dati
-        new_data_df = pd.DataFrame([new_data])
-        st.session_state.wellness_data = pd.concat([st.session_state.wellness_data, new_data_df], ignore_index=True)
-        
-        # Salva i dati nel file
-        st.session_state.wellness_data.to_csv('wellness.csv', index=False)
+        # Salva i nuovi dati tramite il backend
+        add_wellness_entry(new_data)
         st.success("Dati salvati con successo!")
         st.rerun()
 
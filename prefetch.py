@@ -0,0 +1,138 @@
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import metrics
+from backend import query_events, data_version, GRID_COLUMNS
+from calendar_component import encode_layout
+from calendar_views import (
+    get_view_window, get_week_dates, hour_cells, month_cells, render_month, render_week, render_day,
+)
+from layout import layout_days, layout_hours
+
+# Viste già pronte (eventi raggruppati e HTML o payload del componente), condivise
+# tra le sessioni. La chiave contiene la versione dei dati: dopo una scrittura le
+# voci vecchie non vengono più trovate ed escono dalla LRU
+VIEW_CACHE_SIZE = 64
+_views = OrderedDict()
+_pending = {}
+# Voci preparate dal prefetch e non ancora servite: solo il primo uso conta come hit
+# del prefetch, i successivi sono normali riusi della cache
+_prefetched = set()
+_lock = threading.Lock()
+_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='prefetch')
+
+
+def build_view(view_type, date, client_render):
+    """Dati pronti per la griglia: payload compatto per il browser oppure HTML della vista"""
+    window_start, window_end = get_view_window(view_type, date)
+    events = query_events(window_start, window_end, columns=GRID_COLUMNS)
+    if 'start_datetime' not in events.columns:
+        return None
+
+    # Corsie e pezzi per giorno calcolati una volta sola sulla finestra visibile
+    with metrics.timer('layout'):
+        if view_type == "Mese":
+            segments = layout_days(events, window_start, window_end)
+        else:
+            segments = layout_hours(events, window_start, window_end)
+    if client_render:
+        return encode_layout(events, segments)
+
+    if view_type == "Mese":
+        with metrics.timer('render.month'):
+            return render_month(date.year, date.month, month_cells(events, segments))
+    if view_type == "Settimana":
+        with metrics.timer('render.week'):
+            return render_week(get_week_dates(date), hour_cells(events, segments, 8, 20))
+    with metrics.timer('render.day'):
+        return render_day(date, hour_cells(events, segments, with_time=True))
+
+
+def _key(view_type, date, client_render):
+    # Oggi fa parte della chiave: l'evidenziazione del giorno corrente cambia a mezzanotte
+    start, _ = get_view_window(view_type, date)
+    if view_type == "Giorno":
+        start = date
+    return (view_type, start, client_render, datetime.today().date(), data_version())
+
+
+def _store(key, view, prefetched=False):
+    with _lock:
+        _pending.pop(key, None)
+        _views[key] = view
+        _views.move_to_end(key)
+        if prefetched:
+            _prefetched.add(key)
+        else:
+            _prefetched.discard(key)
+        while len(_views) > VIEW_CACHE_SIZE:
+            old, _ = _views.popitem(last=False)
+            _prefetched.discard(old)
+
+
+def _count_hit(key):
+    # Chiamata con _lock preso
+    if key in _prefetched:
+        _prefetched.discard(key)
+        metrics.incr('prefetch.hit')
+    else:
+        metrics.incr('view.cached')
+
+
+def get_view(view_type, date, client_render):
+    """Vista dalla cache se già calcolata (anche in background), altrimenti calcolata ora"""
+    key = _key(view_type, date, client_render)
+    with _lock:
+        if key in _views:
+            _views.move_to_end(key)
+            _count_hit(key)
+            return _views[key]
+        future = _pending.get(key)
+    if future is not None:
+        # Il prefetch è già partito: si aspetta il risultato invece di rifarlo
+        try:
+            view = future.result()
+            with _lock:
+                _count_hit(key)
+            return view
+        except Exception:
+            pass
+
+    metrics.incr('prefetch.miss')
+    view = build_view(view_type, date, client_render)
+    _store(key, view)
+    return view
+
+
+def adjacent_dates(view_type, date):
+    """Date del periodo precedente e successivo nella stessa vista"""
+    if view_type == "Mese":
+        first = date.replace(day=1)
+        previous = (first - timedelta(days=1)).replace(day=1)
+        following = (first + timedelta(days=32)).replace(day=1)
+        return [previous, following]
+    step = timedelta(days=7 if view_type == "Settimana" else 1)
+    return [date - step, date + step]
+
+
+def _prefetch(key, view_type, date, client_render):
+    try:
+        view = build_view(view_type, date, client_render)
+    except Exception:
+        with _lock:
+            _pending.pop(key, None)
+        raise
+    _store(key, view, prefetched=True)
+    return view
+
+
+def prefetch_adjacent(view_type, date, client_render):
+    """Prepara in background le viste vicine a quella appena mostrata"""
+    for other in adjacent_dates(view_type, date):
+        key = _key(view_type, other, client_render)
+        with _lock:
+            if key in _views or key in _pending:
+                continue
+            _pending[key] = _executor.submit(_prefetch, key, view_type, other, client_render)
@@ -0,0 +1,92 @@
+import re
+from functools import lru_cache
+
+import pandas as pd
+from dateutil.rrule import rrulestr
+
+# Abbreviazioni accettate nella colonna recurring oltre alle regole RRULE complete
+FREQ_ALIASES = {
+    'daily': 'FREQ=DAILY',
+    'weekly': 'FREQ=WEEKLY',
+    'monthly': 'FREQ=MONTHLY',
+    'giornaliero': 'FREQ=DAILY',
+    'settimanale': 'FREQ=WEEKLY',
+    'mensile': 'FREQ=MONTHLY',
+}
+
+
+def build_rule(freq, interval=1, until=None, count=None, exdates=()):
+    """Costruisce il testo da salvare in recurring, es. 'RRULE:FREQ=WEEKLY;UNTIL=20250630T235959'"""
+    parts = [f'FREQ={freq.upper()}']
+    if interval and interval != 1:
+        parts.append(f'INTERVAL={int(interval)}')
+    if until is not None:
+        parts.append('UNTIL=' + pd.Timestamp(until).strftime('%Y%m%dT235959'))
+    if count:
+        parts.append(f'COUNT={int(count)}')
+    text = 'RRULE:' + ';'.join(parts)
+    if exdates:
+        text += '\nEXDATE:' + ','.join(pd.Timestamp(d).strftime('%Y%m%dT%H%M%S') for d in exdates)
+    return text
+
+
+def _normalize_rule_text(text):
+    text = str(text).strip()
+    alias = FREQ_ALIASES.get(text.lower())
+    if alias:
+        return 'RRULE:' + alias
+    # Le date in UTC (suffisso Z) sono trattate come orari locali, come il resto del calendario
+    text = re.sub(r'(UNTIL=\d{8}T\d{6})Z', r'\1', text)
+    # Ammessa anche la forma senza prefisso: 'FREQ=WEEKLY;COUNT=10'
+    lines = [line.strip() for line in text.replace(';EXDATE=', '\nEXDATE:').splitlines() if line.strip()]
+    return '\n'.join(line if ':' in line.split(';', 1)[0] else 'RRULE:' + line for line in lines)
+
+
+@lru_cache(maxsize=1024)
+def parse_rule(text, dtstart):
+    """Regola (rruleset) per il testo di recurring a partire da dtstart; None se non valida"""
+    if not isinstance(text, str) or not text.strip():
+        return None
+    try:
+        return rrulestr(_normalize_rule_text(text), dtstart=dtstart.to_pydatetime(), forceset=True)
+    except (ValueError, TypeError):
+        return None
+
+
+@lru_cache(maxsize=4096)
+def expand(text, dtstart, duration, window_start, window_end):
+    """Inizi delle occorrenze che si sovrappongono a [window_start, window_end).
+
+    L'espansione è pigra: vengono generate solo le occorrenze nella finestra e
+    ogni finestra già espansa viene memorizzata.
+    """
+    rule = parse_rule(text, dtstart)
+    if rule is None:
+        return ()
+    lower = (window_start - duration).to_pydatetime()
+    starts = rule.between(lower, window_end.to_pydatetime(), inc=True)
+    result = []
+    for start in starts:
+        start = pd.Timestamp(start)
+        end = start + duration
+        if start < window_end and (end > window_start or start >= window_start):
+            result.append(start)
+    return tuple(result)
+
+
+def expand_occurrences(masters, window_start, window_end):
+    """Righe delle occorrenze degli eventi ricorrenti nella finestra, con inizio e fine spostati"""
+    window_start, window_end = pd.Timestamp(window_start), pd.Timestamp(window_end)
+    rows = []
+    for _, master in masters.iterrows():
+        dtstart = master['start_datetime']
+        end = master['end_datetime']
+        duration = end - dtstart if pd.notna(end) and end > dtstart else pd.Timedelta(0)
+        for start in expand(master['recurring'], dtstart, duration, window_start, window_end):
+            occurrence = master.copy()
+            occurrence['start_datetime'] = start
+            occurrence['end_datetime'] = start + duration
+            rows.append(occurrence)
+    if not rows:
+        return masters.iloc[0:0]
+    return pd.DataFrame(rows).astype(masters.dtypes.to_dict())
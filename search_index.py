@@ -0,0 +1,148 @@
+import bisect
+import re
+import unicodedata
+
+import numpy as np
+import pandas as pd
+
+# Colonne degli eventi su cui si cerca
+SEARCH_COLUMNS = ['title', 'description', 'location']
+
+_TOKEN = re.compile(r'\w+')
+
+
+def fold(text):
+    """Minuscolo e senza accenti: 'Caffè' e 'caffe' diventano uguali"""
+    text = str(text)
+    if text.isascii():
+        return text.lower()
+    text = unicodedata.normalize('NFKD', text)
+    return ''.join(c for c in text if not unicodedata.combining(c)).casefold()
+
+
+# Parole troppo frequenti per essere utili: non vengono indicizzate
+STOPWORDS = frozenset(fold(word) for word in """
+a ad al alla alle allo agli ai all anche che chi con col da dal dalla dalle dallo dai dagli dall
+del della delle dello dei degli dell di e ed gli i il in l la le lo ma nel nella nelle nello nei
+negli nell non o per più si su sul sulla sulle sullo sui sugli sull tra fra un una uno
+""".split())
+
+
+def tokenize(text):
+    """Parole ripiegate del testo; l'apostrofo separa ('dell'amico' -> dell, amico)"""
+    return _TOKEN.findall(fold(text))
+
+
+def query_terms(query):
+    """Parole da cercare: le parole vuote sono ignorate tranne l'ultima, che durante
+    la digitazione può essere l'inizio di una parola più lunga"""
+    tokens = tokenize(query)
+    return [t for i, t in enumerate(tokens) if t not in STOPWORDS or i == len(tokens) - 1]
+
+
+class EventSearchIndex:
+    """Indice invertito in memoria su titolo, descrizione e luogo degli eventi.
+
+    Il vocabolario è ordinato e le liste di posizioni sono salvate una dopo l'altra
+    in un unico array (formato CSR): tutti i termini con un certo prefisso sono un
+    intervallo contiguo del vocabolario, quindi anche le loro posizioni sono una
+    sola fetta dell'array. Gli eventi aggiunti dopo la costruzione finiscono in un
+    piccolo indice a parte, quelli eliminati in un insieme di posizioni escluse.
+    """
+
+    def __init__(self, events):
+        # Righe dalla più recente: l'ordine delle posizioni coincide con quello dei risultati
+        if 'start_datetime' in events:
+            events = events.sort_values('start_datetime', ascending=False, kind='stable')
+        self._rows = events.reset_index(drop=True)
+        terms, codes, positions = self._postings(self._rows)
+
+        # Vocabolario ordinato; le coppie (termine, posizione) ordinate e senza doppioni
+        # si ottengono da un'unica chiave intera
+        order = np.argsort(terms)
+        rank = np.empty(len(terms), dtype=np.int64)
+        rank[order] = np.arange(len(terms))
+        stride = len(self._rows) + 1
+        keys = np.unique(rank[codes] * stride + positions)
+        self._terms = terms[order].tolist()
+        self._offsets = np.searchsorted(keys // stride, np.arange(len(terms) + 1))
+        self._positions = keys % stride
+
+        # Aggiunte successive: termine -> posizioni in self._extra
+        self._extra = self._rows.iloc[0:0]
+        self._extra_postings = {}
+        self._deleted = set()
+
+    def __len__(self):
+        return len(self._rows) + len(self._extra) - len(self._deleted)
+
+    @staticmethod
+    def _postings(events, offset=0):
+        """Termini distinti, codice del termine e posizione di ogni occorrenza indicizzabile.
+
+        Si tokenizza il testo solo in minuscolo e si ripiegano gli accenti sui termini
+        distinti, molto meno numerosi delle occorrenze.
+        """
+        text = events.reindex(columns=SEARCH_COLUMNS).fillna('').astype(str).agg(' '.join, axis=1)
+        tokens = text.str.lower().str.findall(_TOKEN).explode().dropna()
+        raw_codes, raw_terms = pd.factorize(tokens)
+        folded_codes, terms = pd.factorize(pd.Series(raw_terms).map(fold))
+        codes = folded_codes[raw_codes]
+        positions = tokens.index.to_numpy(dtype=np.int64) + offset
+
+        stop = np.isin(terms, list(STOPWORDS))
+        keep = ~stop[codes]
+        return np.asarray(terms, dtype=object), codes[keep], positions[keep]
+
+    def add(self, events):
+        """Indicizza eventi nuovi (già normalizzati) senza ricostruire l'indice"""
+        offset = len(self._rows) + len(self._extra)
+        self._extra = pd.concat([self._extra, events.reindex(columns=self._rows.columns)], ignore_index=True)
+        terms, codes, positions = self._postings(events.reset_index(drop=True), offset)
+        for code, pos in zip(codes.tolist(), positions.tolist()):
+            self._extra_postings.setdefault(terms[code], []).append(pos)
+
+    def remove(self, event_id):
+        """Esclude dai risultati gli eventi con questo id"""
+        for frame, offset in ((self._rows, 0), (self._extra, len(self._rows))):
+            if 'id' in frame:
+                self._deleted.update((offset + np.flatnonzero(frame['id'].to_numpy() == event_id)).tolist())
+
+    def _prefix_positions(self, prefix):
+        # I termini con questo prefisso sono contigui nel vocabolario ordinato
+        lo = bisect.bisect_left(self._terms, prefix)
+        hi = bisect.bisect_left(self._terms, prefix + '\uffff')
+        found = self._positions[self._offsets[lo]:self._offsets[hi]]
+        extra = [pos for term, positions in self._extra_postings.items() if term.startswith(prefix) for pos in positions]
+        if extra:
+            found = np.concatenate([found, np.array(extra, dtype=np.int64)])
+        return found
+
+    def search(self, query, limit=50):
+        """Eventi che contengono tutte le parole della query, ciascuna anche come prefisso"""
+        tokens = query_terms(query)
+        if not tokens:
+            return self._rows.iloc[0:0]
+
+        # Si parte dalla lista più corta; le altre si controllano con una bitmap
+        matches = sorted((self._prefix_positions(t) for t in tokens), key=len)
+        result = np.unique(matches[0])
+        total = len(self._rows) + len(self._extra)
+        for positions in matches[1:]:
+            if not len(result):
+                break
+            bitmap = np.zeros(total, dtype=bool)
+            bitmap[positions] = True
+            result = result[bitmap[result]]
+        if self._deleted:
+            result = result[~np.isin(result, np.fromiter(self._deleted, dtype=np.int64))]
+
+        # Le posizioni dello snapshot sono già in ordine di recenza: bastano le prime
+        base = result[result < len(self._rows)][:limit]
+        extra = result[result >= len(self._rows)] - len(self._rows)
+        found = self._rows.iloc[base]
+        if len(extra):
+            found = pd.concat([found, self._extra.iloc[extra]])
+            if 'start_datetime' in found:
+                found = found.sort_values('start_datetime', ascending=False, kind='stable')
+        return found.head(limit)
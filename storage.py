@@ -0,0 +1,456 @@
+import os
+import sqlite3
+import threading
+
+import pandas as pd
+
+from columnar import read_snapshot, write_snapshot
+from event_journal import EventJournal, discard_staged
+from event_schema import EVENT_COLUMNS, normalize_events, parse_datetime, parse_datetimes
+from search_index import SEARCH_COLUMNS, query_terms
+
+# Tabelle gestite dal backend e file CSV corrispondenti
+TABLE_FILES = {
+    'pantry': 'pantry.csv',
+    'projects': 'progetti.csv',
+    'recipes': 'recipes.csv',
+    'wellness': 'wellness.csv',
+}
+
+# Tabelle storiche lette spesso: il backend CSV ne tiene una copia colonnare
+# con le date già convertite
+COLUMNAR_TABLES = {
+    'wellness': ['data'],
+}
+
+# Colonne indicizzate nel backend SQLite
+INDEXES = {
+    'events': ['start_datetime', 'event_type'],
+    'pantry': ['expiration_date'],
+    'projects': ['Nome'],
+}
+
+
+def file_version(*paths):
+    """Versione dei dati su disco: (mtime, dimensione) di ogni file, None se manca"""
+    version = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+            version.append((stat.st_mtime_ns, stat.st_size))
+        except FileNotFoundError:
+            version.append(None)
+    return tuple(version)
+
+
+class WriteBatch:
+    """Scritture raccolte per essere applicate insieme con storage.apply_batch.
+
+    Gli eventi eliminati vengono tolti prima di aggiungere quelli nuovi, così
+    una modifica si esprime come eliminazione più aggiunta con lo stesso id; le
+    operazioni sulle altre tabelle restano nell'ordine in cui sono state raccolte.
+    """
+
+    def __init__(self):
+        self.events = []
+        self.deleted_events = []
+        self.table_ops = []
+
+    def add_event(self, event):
+        self.events.append(event)
+
+    def delete_event(self, event_id):
+        self.deleted_events.append(event_id)
+
+    def append_rows(self, table, rows):
+        self.table_ops.append((table, 'append', (list(rows),)))
+
+    def update_rows(self, table, column, value, values):
+        self.table_ops.append((table, 'update', (column, value, dict(values))))
+
+    def delete_rows(self, table, column, value):
+        self.table_ops.append((table, 'delete', (column, value)))
+
+    def tables(self):
+        return list(dict.fromkeys(table for table, _, _ in self.table_ops))
+
+    def __len__(self):
+        return len(self.events) + len(self.deleted_events) + len(self.table_ops)
+
+
+def _apply_table_op(df, op, args):
+    """Applica in memoria un'operazione di WriteBatch a una tabella"""
+    if op == 'append':
+        return pd.concat([df, pd.DataFrame(args[0])], ignore_index=True)
+    column, value = args[0], args[1]
+    if column not in df.columns:
+        return df
+    if op == 'delete':
+        return df[df[column] != value]
+    df = df.copy()
+    for key, new_value in args[2].items():
+        df.loc[df[column] == value, key] = new_value
+    return df
+
+
+class CsvStorage:
+    """Backend su file CSV: eventi a giornale, le altre tabelle riscritte per intero"""
+
+    name = 'csv'
+
+    def __init__(self):
+        # Gli eventi nuovi vengono aggiunti in coda al giornale e ripiegati
+        # periodicamente nello snapshot ordinato events.csv
+        self.events_journal = EventJournal('events.csv', 'events_journal.csv', EVENT_COLUMNS)
+
+    def load_events(self, columns=None):
+        return self.events_journal.load(columns)
+
+    def add_event(self, event):
+        self.events_journal.append(event)
+
+    def add_events(self, events):
+        """Scrive un blocco normalizzato di eventi con una sola aggiunta al giornale"""
+        self.events_journal.append_frame(events)
+
+    def delete_event(self, event_id):
+        return self.events_journal.delete(event_id)
+
+    def compact(self):
+        self.events_journal.compact()
+
+    def data_version(self):
+        journal = self.events_journal
+        return file_version(journal.snapshot_path, journal.compacting_path, journal.journal_path)
+
+    def table_version(self, table):
+        return file_version(TABLE_FILES[table])
+
+    def load_table(self, table):
+        path = TABLE_FILES[table]
+        if table not in COLUMNAR_TABLES:
+            try:
+                return pd.read_csv(path)
+            except FileNotFoundError:
+                return pd.DataFrame()
+
+        version = file_version(path)[0]
+        if version is None:
+            return pd.DataFrame()
+        columnar_path = os.path.splitext(path)[0] + '.arrow'
+        df = read_snapshot(columnar_path, version)
+        if df is None:
+            df = pd.read_csv(path)
+            for col in COLUMNAR_TABLES[table]:
+                if col in df.columns:
+                    df[col] = parse_datetimes(df[col])
+            write_snapshot(columnar_path, df, version)
+        return df
+
+    def save_table(self, table, df):
+        df.to_csv(TABLE_FILES[table], index=False)
+
+    def append_rows(self, table, rows):
+        df = pd.concat([self.load_table(table), pd.DataFrame(rows)], ignore_index=True)
+        self.save_table(table, df)
+
+    def delete_rows(self, table, column, value):
+        df = self.load_table(table)
+        if column in df.columns:
+            self.save_table(table, df[df[column] != value])
+
+    def update_rows(self, table, column, value, values):
+        df = self.load_table(table)
+        if column in df.columns:
+            for key, new_value in values.items():
+                df.loc[df[column] == value, key] = new_value
+            self.save_table(table, df)
+
+    def apply_batch(self, batch):
+        """Applica un WriteBatch: ogni file viene scritto al massimo una volta.
+
+        Tabelle, snapshot e giornale degli eventi vengono prima scritti tutti in file
+        temporanei e rinominati solo alla fine (EventJournal.apply): un errore durante
+        la preparazione non lascia a metà nessuna parte del blocco.
+        Restituisce il numero di eventi eliminati.
+        """
+        tables = {}
+        for table, op, args in batch.table_ops:
+            if table not in tables:
+                tables[table] = self.load_table(table)
+            tables[table] = _apply_table_op(tables[table], op, args)
+        staged = []
+        try:
+            for table, df in tables.items():
+                path = TABLE_FILES[table]
+                staged.append((path + '.tmp', path))
+                df.to_csv(path + '.tmp', index=False)
+        except BaseException:
+            discard_staged(staged)
+            raise
+        return self.events_journal.apply(batch.deleted_events, batch.events, staged)
+
+
+class SqliteStorage:
+    """Backend SQLite in modalità WAL con indici sulle colonne interrogate più spesso"""
+
+    name = 'sqlite'
+
+    def __init__(self, path='calendar.db'):
+        self.path = path
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS events ('
+            + ', '.join(f'"{col}" TEXT' if col.endswith('datetime') else f'"{col}"' for col in EVENT_COLUMNS)
+            + ')'
+        )
+        self._create_indexes(conn, 'events')
+        self.full_text = self._create_search_index(conn)
+        conn.commit()
+
+    def _conn(self):
+        # Una connessione per thread: i lettori non si bloccano grazie al WAL
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def _columns(self, conn, table):
+        return [row[1] for row in conn.execute(f'PRAGMA table_info("{table}")')]
+
+    def _create_indexes(self, conn, table):
+        columns = self._columns(conn, table)
+        for col in INDEXES.get(table, []):
+            if col in columns:
+                conn.execute(f'CREATE INDEX IF NOT EXISTS "idx_{table}_{col}" ON "{table}" ("{col}")')
+
+    def _create_search_index(self, conn):
+        """Indice FTS5 su titolo, descrizione e luogo, tenuto aggiornato da trigger.
+
+        unicode61 con remove_diacritics ripiega gli accenti, prefix='2 3' rende veloci
+        le ricerche per prefisso. Restituisce False se SQLite non ha FTS5.
+        """
+        columns = ', '.join(SEARCH_COLUMNS)
+        new_values = ', '.join(f'new.{c}' for c in SEARCH_COLUMNS)
+        old_values = ', '.join(f'old.{c}' for c in SEARCH_COLUMNS)
+        exists = conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'events_fts'").fetchone()
+        try:
+            conn.execute(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS events_fts USING fts5({columns}, content='events', "
+                "content_rowid='rowid', tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+            )
+        except sqlite3.OperationalError:
+            return False
+        insert = f'INSERT INTO events_fts(rowid, {columns}) VALUES (new.rowid, {new_values});'
+        delete = f"INSERT INTO events_fts(events_fts, rowid, {columns}) VALUES ('delete', old.rowid, {old_values});"
+        conn.execute(f'CREATE TRIGGER IF NOT EXISTS events_fts_insert AFTER INSERT ON events BEGIN {insert} END')
+        conn.execute(f'CREATE TRIGGER IF NOT EXISTS events_fts_delete AFTER DELETE ON events BEGIN {delete} END')
+        conn.execute(f'CREATE TRIGGER IF NOT EXISTS events_fts_update AFTER UPDATE ON events BEGIN {delete} {insert} END')
+        if not exists:
+            # Database esistente: indicizza gli eventi già presenti
+            conn.execute("INSERT INTO events_fts(events_fts) VALUES ('rebuild')")
+        return True
+
+    def _ensure_columns(self, conn, table, columns):
+        existing = self._columns(conn, table)
+        if not existing:
+            conn.execute(f'CREATE TABLE "{table}" (' + ', '.join(f'"{c}"' for c in columns) + ')')
+            self._create_indexes(conn, table)
+            return
+        for col in columns:
+            if col not in existing:
+                conn.execute(f'ALTER TABLE "{table}" ADD COLUMN "{col}"')
+
+    def _normalize_value(self, col, value):
+        if value is None:
+            return None
+        try:
+            if pd.isna(value):
+                return None
+        except (TypeError, ValueError):
+            pass
+        if col in ('start_datetime', 'end_datetime'):
+            # Formato ISO uniforme: le query per intervallo usano l'indice
+            value = parse_datetime(value)
+            return None if pd.isna(value) else value.strftime('%Y-%m-%d %H:%M:%S')
+        if hasattr(value, 'isoformat'):
+            return str(value)
+        if hasattr(value, 'item'):
+            return value.item()
+        return value
+
+    def _insert(self, conn, table, rows):
+        columns = list(dict.fromkeys(col for row in rows for col in row))
+        self._ensure_columns(conn, table, columns)
+        placeholders = ', '.join('?' for _ in columns)
+        conn.executemany(
+            f'INSERT INTO "{table}" (' + ', '.join(f'"{c}"' for c in columns) + f') VALUES ({placeholders})',
+            [[self._normalize_value(col, row.get(col)) for col in columns] for row in rows],
+        )
+
+    def load_events(self, columns=None):
+        # Le date sono salvate in ISO 8601 uniforme: la conversione segue il percorso veloce
+        events = normalize_events(pd.read_sql_query(
+            'SELECT ' + ('*' if columns is None else ', '.join(f'"{c}"' for c in columns))
+            + ' FROM events ORDER BY start_datetime',
+            self._conn(),
+        ))
+        return events if columns is None else events[columns]
+
+    def add_event(self, event):
+        conn = self._conn()
+        with conn:
+            self._insert(conn, 'events', [{col: event.get(col) for col in EVENT_COLUMNS}])
+
+    def add_events(self, events):
+        """Scrive un blocco normalizzato di eventi in un'unica transazione"""
+        events = events.reindex(columns=EVENT_COLUMNS)
+        present = events.notna()
+        for col in ('start_datetime', 'end_datetime'):
+            events[col] = events[col].dt.strftime('%Y-%m-%d %H:%M:%S')
+        for col in ('created_at', 'updated_at'):
+            events[col] = events[col].astype(str)
+        events = events.astype(object).where(present, None)
+        conn = self._conn()
+        with conn:
+            conn.executemany(
+                'INSERT INTO events (' + ', '.join(f'"{c}"' for c in EVENT_COLUMNS) + ') VALUES ('
+                + ', '.join('?' for _ in EVENT_COLUMNS) + ')',
+                events.itertuples(index=False, name=None),
+            )
+
+    def delete_event(self, event_id):
+        conn = self._conn()
+        with conn:
+            return conn.execute('DELETE FROM events WHERE id = ?', (event_id,)).rowcount
+
+    def search_events(self, query, limit=50):
+        """Ricerca full-text con FTS5: tutte le parole, ciascuna anche come prefisso"""
+        terms = query_terms(query)
+        if not terms:
+            return normalize_events(pd.DataFrame(columns=EVENT_COLUMNS))
+        match = ' AND '.join(f'"{term}"*' for term in terms)
+        return normalize_events(pd.read_sql_query(
+            'SELECT events.* FROM events_fts JOIN events ON events.rowid = events_fts.rowid '
+            'WHERE events_fts MATCH ? ORDER BY events.start_datetime DESC LIMIT ?',
+            self._conn(), params=(match, limit),
+        ))
+
+    def data_version(self):
+        # Ogni commit modifica il WAL (o il database dopo un checkpoint)
+        return file_version(self.path, self.path + '-wal')
+
+    def table_version(self, table):
+        return self.data_version()
+
+    def compact(self):
+        # Riporta il contenuto del WAL nel database principale
+        self._conn().execute('PRAGMA wal_checkpoint(TRUNCATE)')
+
+    def load_table(self, table):
+        conn = self._conn()
+        if not self._columns(conn, table):
+            return pd.DataFrame()
+        df = pd.read_sql_query(f'SELECT * FROM "{table}"', conn)
+        for col in COLUMNAR_TABLES.get(table, []):
+            if col in df.columns:
+                df[col] = parse_datetimes(df[col])
+        return df
+
+    def save_table(self, table, df):
+        conn = self._conn()
+        with conn:
+            conn.execute(f'DROP TABLE IF EXISTS "{table}"')
+            if len(df.columns) == 0:
+                return
+            rows = df.to_dict('records')
+            self._ensure_columns(conn, table, list(df.columns))
+            if rows:
+                self._insert(conn, table, rows)
+
+    def append_rows(self, table, rows):
+        conn = self._conn()
+        with conn:
+            self._insert(conn, table, rows)
+
+    def delete_rows(self, table, column, value):
+        conn = self._conn()
+        if column not in self._columns(conn, table):
+            return
+        with conn:
+            conn.execute(f'DELETE FROM "{table}" WHERE "{column}" = ?', (value,))
+
+    def update_rows(self, table, column, value, values):
+        conn = self._conn()
+        if column not in self._columns(conn, table):
+            return
+        with conn:
+            self._ensure_columns(conn, table, list(values))
+            assignments = ', '.join(f'"{key}" = ?' for key in values)
+            conn.execute(
+                f'UPDATE "{table}" SET {assignments} WHERE "{column}" = ?',
+                [self._normalize_value(key, v) for key, v in values.items()] + [value],
+            )
+
+    def apply_batch(self, batch):
+        """Applica un WriteBatch in un'unica transazione; restituisce gli eventi eliminati"""
+        conn = self._conn()
+        deleted = 0
+        with conn:
+            for table, op, args in batch.table_ops:
+                if op == 'append':
+                    self._insert(conn, table, args[0])
+                    continue
+                column, value = args[0], args[1]
+                if column not in self._columns(conn, table):
+                    continue
+                if op == 'delete':
+                    conn.execute(f'DELETE FROM "{table}" WHERE "{column}" = ?', (value,))
+                else:
+                    self._ensure_columns(conn, table, list(args[2]))
+                    assignments = ', '.join(f'"{key}" = ?' for key in args[2])
+                    conn.execute(
+                        f'UPDATE "{table}" SET {assignments} WHERE "{column}" = ?',
+                        [self._normalize_value(key, v) for key, v in args[2].items()] + [value],
+                    )
+            if batch.deleted_events:
+                deleted = conn.execute(
+                    'DELETE FROM events WHERE id IN (' + ', '.join('?' for _ in batch.deleted_events) + ')',
+                    batch.deleted_events,
+                ).rowcount
+            if batch.events:
+                self._insert(conn, 'events', [{col: event.get(col) for col in EVENT_COLUMNS} for event in batch.events])
+        return deleted
+
+
+def get_storage(kind=None):
+    """Crea il backend scelto con la variabile d'ambiente CALENDAR_STORAGE (csv o sqlite)"""
+    kind = (kind or os.getenv('CALENDAR_STORAGE', 'csv')).lower()
+    if kind == 'sqlite':
+        return SqliteStorage(os.getenv('CALENDAR_DB', 'calendar.db'))
+    return CsvStorage()
+
+
+def migrate_csv_to_sqlite(db_path='calendar.db'):
+    """Copia tutti i dati dai CSV al database SQLite, sostituendo le tabelle esistenti"""
+    source = CsvStorage()
+    target = SqliteStorage(db_path)
+
+    events = source.load_events()
+    conn = target._conn()
+    with conn:
+        conn.execute('DELETE FROM events')
+        rows = events.reindex(columns=EVENT_COLUMNS).to_dict('records')
+        if rows:
+            target._insert(conn, 'events', rows)
+    counts = {'events': len(events)}
+
+    for table in TABLE_FILES:
+        df = source.load_table(table)
+        target.save_table(table, df)
+        counts[table] = len(df)
+    return counts
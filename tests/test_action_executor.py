@@ -0,0 +1,81 @@
+import glob
+
+import pytest
+
+import backend
+import event_journal
+from action_executor import Action, ActionError, execute_actions
+from storage import CsvStorage
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    """Archivio CSV vuoto in una directory temporanea"""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(backend, 'storage', CsvStorage())
+    backend._data_changed()
+    return tmp_path
+
+
+def add(title, day, start, end=None):
+    args = {'title': title, 'date': day, 'time': start}
+    if end:
+        args['end_time'] = end
+    return Action('add_event', args)
+
+
+def files(workdir):
+    return {path: open(path, 'rb').read() for path in sorted(glob.glob(str(workdir / '*.csv')))}
+
+
+def test_conflict_with_event_in_same_batch(workdir):
+    response = execute_actions([
+        add('Dentista', '2031-03-04', '10:00', '11:00'),
+        add('Palestra', '2031-03-04', '10:30', '11:30'),
+        add('Cena', '2031-03-04', '20:00'),
+    ])
+    assert "'Palestra' il 04/03 alle 10:30. Attenzione: si sovrappone a Dentista." in response
+    assert response.count('Attenzione') == 1
+
+
+def test_moved_event_does_not_conflict(workdir):
+    execute_actions([add('Dentista', '2031-03-04', '10:00', '11:00')])
+    response = execute_actions([
+        Action('modify_event', {'title': 'Dentista', 'date': '2031-03-04', 'new_time': '15:00'}),
+        add('Caffè', '2031-03-04', '10:00', '10:30'),
+    ])
+    assert 'Attenzione' not in response
+
+
+def test_invalid_action_writes_nothing(workdir):
+    execute_actions([add('Dentista', '2031-03-04', '10:00', '11:00')])
+    before = files(workdir)
+    with pytest.raises(ActionError):
+        execute_actions([
+            add('Palestra', '2031-03-05', '18:00'),
+            Action('add_task', {'name': 'Preparare slide'}),
+            Action('delete_event', {'title': 'Evento che non esiste'}),
+        ])
+    assert files(workdir) == before
+
+
+def test_failed_write_rolls_back_batch(workdir, monkeypatch):
+    execute_actions([add('Dentista', '2031-03-04', '10:00', '11:00')])
+    # Compattato prima: così la compattazione fatta dall'eliminazione non cambia i file
+    backend.compact_events()
+    before = files(workdir)
+
+    def fail(*args, **kwargs):
+        raise OSError('disco pieno')
+
+    # L'errore arriva sull'ultimo file preparato, dopo snapshot e tabella dei progetti
+    monkeypatch.setattr(event_journal.csv, 'writer', fail)
+    with pytest.raises(OSError):
+        execute_actions([
+            add('Palestra', '2031-03-05', '18:00'),
+            Action('delete_event', {'title': 'Dentista'}),
+            Action('add_task', {'name': 'Preparare slide'}),
+        ])
+    assert files(workdir) == before
+    assert not glob.glob(str(workdir / '*.tmp'))
+    assert list(backend.load_events()['title']) == ['Dentista']
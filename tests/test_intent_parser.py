@@ -0,0 +1,39 @@
+from datetime import datetime
+
+import pytest
+
+from intent_parser import FAST_PATH_CONFIDENCE, parse_intent
+
+NOW = datetime(2026, 10, 15, 8, 0)
+
+
+@pytest.mark.parametrize('text, title, time', [
+    ("aggiungi pranzo oggi a mezzogiorno", "Pranzo", "12:00"),
+    ("aggiungi consegna del progetto oggi a mezzanotte", "Consegna del progetto", "00:00"),
+    ("aggiungi film stasera alle 9", "Film", "21:00"),
+    ("aggiungi film stasera alle 9 e mezza", "Film", "21:30"),
+    ("aggiungi cena stasera alle 20", "Cena", "20:00"),
+    ("aggiungi call con Luca domani a 14:30", "Call con Luca", "14:30"),
+    ("aggiungi riunione con Marco domani alle 10", "Riunione con Marco", "10:00"),
+])
+def test_fast_path_time(text, title, time):
+    intent = parse_intent(text, NOW)
+    assert intent.confidence >= FAST_PATH_CONFIDENCE
+    assert intent.data['title'] == title
+    assert intent.data['time'] == time
+
+
+@pytest.mark.parametrize('text', [
+    "aggiungi sveglia alle 25",
+    "aggiungi palestra domani alle 18:75",
+    "aggiungi pranzo a 2 passi da casa",
+    "aggiungi cena alle Terme domani",
+    "aggiungi evento domani dalle 10 alle 25",
+])
+def test_unsure_time_goes_to_model(text):
+    intent = parse_intent(text, NOW)
+    assert intent is None or intent.confidence < FAST_PATH_CONFIDENCE
+
+
+def test_stasera_keeps_today():
+    assert parse_intent("aggiungi film stasera alle 9", NOW).data['date'] == '2026-10-15'
@@ -2,7 +2,7 @@ import os
 from dotenv import load_dotenv
 from ibm_watson import SpeechToTextV1, TextToSpeechV1
 from ibm_cloud_sdk_core.authenticators import IAMAuthenticator
-from openai import OpenAI
+from llm_gateway import get_gateway
 import json
 import pygame
 import tempfile
@@ -47,10 +47,9 @@ class VoiceAssistant:
             logger.info(f"Voci TTS disponibili: {[v['name'] for v in voices['voices']]}")
 
             # Inizializza OpenAI
-            openai_api_key = os.getenv('OPENAI_API_KEY')
-            if not openai_api_key:
+            self.gateway = get_gateway()
+            if self.gateway is None:
                 raise ValueError("Chiave API OpenAI mancante nel file .env")
-            self.openai_client = OpenAI(api_key=openai_api_key)
             
             # Inizializza pygame per la riproduzione audio
             pygame.mixer.init()
@@ -118,13 +117,10 @@ class VoiceAssistant:
         - parameters: i parametri necessari per il comando
         - response: una risposta naturale da dare all'utente"""
 
-        response = self.openai_client.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": text}
-            ]
-        )
+        response = self.gateway.chat([
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": text}
+        ])
 
         return json.loads(response.choices[0].message.content)
 
@@ -1,14 +1,40 @@
 import speech_recognition as sr
 from gtts import gTTS
 import os
-import openai
 import tempfile
+import re
+import time
+from collections import namedtuple
 from datetime import datetime, timedelta
 import logging
+import pandas as pd
 import streamlit as st
-from backend import add_event, delete_task, chat_with_openai, load_events
+import metrics
+from backend import add_event, agenda_page, delete_task, next_event_id, find_free_slots, id_lock, StreamedReply
+from action_executor import (ActionError, cache_actions, cached_actions, execute_actions, parse_tool_calls,
+                             system_prompt, tool_definitions)
+from intent_parser import parse_intent, FAST_PATH_CONFIDENCE
+from llm_gateway import get_gateway
+
+# Esito di un comando: risposta, strada usata ('local', 'cache', 'llm' o 'none'), millisecondi
+# per interpretarlo ed eseguirlo, stima dei millisecondi risparmiati rispetto al modello e,
+# per il modello, millisecondi al primo pezzo della risposta
+CommandOutcome = namedtuple('CommandOutcome', ['response', 'path', 'elapsed_ms', 'saved_ms', 'ttft_ms'],
+                            defaults=(None,))
+
+class InterruptedReply(Exception):
+    """Il modello ha smesso di rispondere a metà; partial è la risposta arrivata finora"""
+
+    def __init__(self, partial, cause):
+        super().__init__(str(cause))
+        self.partial = partial
+
 
 class VoiceAssistant:
+    # I comandi possono girare in parallelo: id nuovo e salvataggio vanno fatti insieme
+    # (lo stesso lock dell'esecutore delle azioni)
+    _write_lock = id_lock
+
     def __init__(self):
         # Configurazione logging
         logging.basicConfig(level=logging.INFO)
@@ -20,21 +46,10 @@ class VoiceAssistant:
         # Configurazione sintesi vocale
         self.language = "it"
         
-        # Configurazione OpenAI
-        self.openai_client = None
-        try:
-            api_key = os.getenv("OPENAI_API_KEY")
-            org_id = os.getenv("OPENAI_ORG_ID")
-            if api_key and org_id:
-                self.openai_client = openai.OpenAI(
-                    api_key=api_key,
-                    organization=org_id
-                )
-            else:
-                self.logger.warning("OpenAI credentials not found in environment variables")
-        except Exception as e:
-            self.logger.warning(f"OpenAI client initialization failed: {e}")
-            self.openai_client = None
+        # Modello condiviso da tutte le sessioni (connessioni, limiti e nuovi tentativi)
+        self.gateway = get_gateway()
+        if self.gateway is None:
+            self.logger.warning("OpenAI credentials not found in environment variables")
         
         self.logger.info("Inizializzazione VoiceAssistant completata")
 
@@ -67,91 +82,202 @@ class VoiceAssistant:
         except Exception as e:
             self.logger.error(f"Errore durante la sintesi vocale: {e}")
 
-    def process_command(self, text):
-        """Processa il comando vocale usando OpenAI e esegue le azioni necessarie."""
-        if self.openai_client is None:
-            return "Mi dispiace, il servizio OpenAI non è configurato correttamente. Controlla le variabili d'ambiente."
-            
+    def process_command(self, text, progress=None, timeout=None):
+        """Processa il comando vocale e restituisce la risposta da mostrare e pronunciare."""
+        return self.run_command(text, progress, timeout).response
+
+    def run_command(self, text, progress=None, timeout=None, begin_write=None):
+        """Processa il comando: prima con il parser locale, poi, se serve, con OpenAI.
+
+        progress, se dato, riceve la fase corrente e, mentre il modello risponde, il testo
+        della risposta arrivato finora; timeout limita la chiamata al modello.
+        begin_write, se data, viene chiamata prima di eseguire le azioni: se restituisce
+        False il comando è scaduto e non viene scritto niente.
+        Restituisce un CommandOutcome con la risposta, la strada usata e i tempi.
+        """
+        progress = progress or (lambda stage, partial=None: None)
+        start = time.perf_counter()
+        intent = parse_intent(text)
+        parse_ms = (time.perf_counter() - start) * 1000
+        metrics.record_time('intent.local', parse_ms)
+
+        if intent is not None and intent.confidence >= FAST_PATH_CONFIDENCE:
+            # Comando comune: niente rete, risposta in pochi microsecondi
+            metrics.incr('intent.hit')
+            path = 'local'
+            action, data, response = intent.action, intent.data, intent.response
+        elif (actions := cached_actions('voice.tools', text)) is not None:
+            # Comando già interpretato dal modello in passato
+            metrics.incr('intent.hit')
+            path = 'cache'
+        elif self.gateway is None:
+            response = "Mi dispiace, il servizio OpenAI non è configurato correttamente. Controlla le variabili d'ambiente."
+            return CommandOutcome(response, 'none', parse_ms, None)
+        else:
+            metrics.incr('intent.miss')
+            path = 'llm'
+            try:
+                with metrics.timer('intent.llm'):
+                    actions, response, ttft_ms = self.ask_model(text, progress, timeout)
+            except InterruptedReply as e:
+                # Il comando non si può eseguire, ma la parte di risposta arrivata resta visibile
+                self.logger.error(f"Risposta del modello interrotta: {e}")
+                response = "Mi dispiace, la risposta si è interrotta prima della fine."
+                if e.partial:
+                    response += f" Risposta parziale: «{e.partial}…»"
+                return CommandOutcome(response, path, (time.perf_counter() - start) * 1000, None)
+            except Exception as e:
+                self.logger.error(f"Errore durante l'elaborazione del comando: {e}")
+                response = "Mi dispiace, si è verificato un errore durante l'elaborazione del comando."
+                return CommandOutcome(response, path, (time.perf_counter() - start) * 1000, None)
+
+        interpret_ms = (time.perf_counter() - start) * 1000
+        if begin_write is not None and not begin_write():
+            response = "Tempo scaduto: non ho eseguito nessuna operazione."
+            return CommandOutcome(response, path, interpret_ms, None)
         try:
-            # Crea il prompt per l'assistente
-            system_prompt = """Sei un assistente del calendario che aiuta a gestire eventi e attività. 
-            Analizza il comando dell'utente e restituisci una risposta JSON strutturata con le azioni da eseguire.
-            Se l'utente menziona "domani", usa la data di domani. Se menziona "oggi", usa la data odierna.
-            
-            Esempio di comando: "aggiungi task per domani di comprare il latte"
-            Esempio di risposta:
-            {
-                "action": "add_task",
-                "data": {
-                    "title": "Comprare il latte",
-                    "description": "Lista della spesa: latte",
-                    "date": "2025-03-16",
-                    "time": "09:00",
-                    "event_type": "task"
-                },
-                "response": "Ho aggiunto il task 'Comprare il latte' per domani alle 09:00."
+            if path == 'local':
+                response = self.execute(action, data, response, text, progress)
+            elif actions:
+                # Tutte le azioni chieste dal modello, con una sola scrittura
+                response = execute_actions(actions, progress)
+                if path == 'llm':
+                    cache_actions('voice.tools', text, actions)
+        except ActionError as e:
+            response = f"Non ho eseguito nessuna operazione: {e}."
+        except Exception as e:
+            self.logger.error(f"Errore durante l'esecuzione del comando: {e}")
+            response = "Mi dispiace, si è verificato un errore durante l'elaborazione del comando."
+        # Tempo risparmiato: media delle chiamate al modello misurate finora
+        llm = metrics.snapshot()['timings'].get('intent.llm')
+        saved_ms = llm['avg_ms'] - interpret_ms if path in ('local', 'cache') and llm else None
+        return CommandOutcome(response, path, interpret_ms, saved_ms, ttft_ms if path == 'llm' else None)
+
+    def ask_model(self, text, progress, timeout=None):
+        """Interpreta il comando con OpenAI: restituisce (azioni, testo, ms al primo pezzo).
+
+        Il modello può chiedere più azioni con una sola risposta (chiamate a strumenti).
+        La risposta arriva in streaming: progress riceve il testo per l'utente man mano
+        che il modello lo scrive. InterruptedReply se il flusso si interrompe.
+        """
+        messages = [
+            {"role": "system", "content": system_prompt() + (
+                " I task con una data detti a voce (es. \"aggiungi task per domani di comprare il latte\")"
+                " sono eventi del calendario: usa add_event con event_type \"task\".")},
+            {"role": "user", "content": text}
+        ]
+
+        # Ottieni la risposta da OpenAI
+        progress("Interpretazione del comando")
+        reply = StreamedReply(self.gateway.chat_stream(
+            messages,
+            max_tokens=500,
+            temperature=0.2,
+            tools=tool_definitions(),
+            timeout=timeout
+        ))
+        shown = ""
+        for _ in reply:
+            if reply.error is None and reply.text != shown:
+                shown = reply.text
+                progress("Interpretazione del comando", shown)
+        if reply.error is not None:
+            raise InterruptedReply(shown, reply.error)
+
+        actions = parse_tool_calls(reply.tool_calls)
+        self.logger.info(f"Azioni chieste dal modello: {actions}")
+        return actions, reply.text, reply.ttft_ms
+
+    def execute(self, action, data, response, text, progress):
+        """Esegue l'azione interpretata e restituisce la risposta finale"""
+        if action == "add_task" or action == "add_event":
+            progress("Salvataggio dell'evento")
+
+            # Prepara i dati dell'evento
+            event_data = {
+                "title": data["title"],
+                "description": data.get("description", data["title"]),
+                "start_datetime": f"{data['date']} {data.get('time', '09:00')}",
+                "end_datetime": f"{data['date']} {data.get('end_time', data.get('time', '10:00'))}",
+                "event_type": data.get("event_type", "general"),
+                "is_all_day": False,
+                "location": "",
+                "attendees": None,
+                "recurring": None,
+                "created_at": datetime.now(),
+                "updated_at": datetime.now()
             }
-            """
-            
-            messages = [
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": text}
-            ]
-            
-            # Ottieni la risposta da OpenAI
-            response = self.openai_client.chat.completions.create(
-                model="gpt-3.5-turbo",
-                messages=messages,
-                max_tokens=250,
-                temperature=0.7,
-                response_format={ "type": "json_object" }
+
+            # Aggiungi l'evento, segnalando eventuali sovrapposizioni
+            with self._write_lock:
+                event_data["id"] = next_event_id()
+                conflicts = add_event(event_data, on_conflict="warn")
+            self.logger.info(f"Evento aggiunto: {event_data}")
+            if conflicts is not None and not conflicts.empty:
+                titles = ", ".join(conflicts["title"].astype(str))
+                return f"{response} Attenzione: si sovrappone a {titles}."
+
+        elif action == "find_free_slot":
+            progress("Ricerca dei buchi liberi")
+            return self.find_free_slot(text, data)
+
+        elif action == "delete_task":
+            progress("Eliminazione della task")
+            delete_task(data["title"])
+            self.logger.info(f"Task eliminata: {data['title']}")
+
+        elif action in ("list_events", "count_events"):
+            day = datetime.strptime(data["date"], "%Y-%m-%d")
+            events, more = agenda_page(day, day + timedelta(days=1), limit=10)
+            if events.empty:
+                return f"Nessun impegno {data['label']}."
+            if action == "count_events":
+                count = f"almeno {len(events)}" if more is not None else len(events)
+                return f"Hai {count} impegni {data['label']}."
+            items = ", ".join(
+                f"{start.strftime('%H:%M')} {title}"
+                for start, title in zip(pd.to_datetime(events["start_datetime"]), events["title"])
             )
-            
-            # Estrai la risposta JSON
-            import json
-            result = json.loads(response.choices[0].message.content.strip())
-            self.logger.info(f"Risposta OpenAI strutturata: {result}")
-            
-            # Esegui l'azione appropriata
-            if result["action"] == "add_task" or result["action"] == "add_event":
-                # Gestisci le date relative
-                from datetime import datetime, timedelta
-                if "domani" in text.lower():
-                    target_date = (datetime.now() + timedelta(days=1)).strftime("%Y-%m-%d")
-                elif "oggi" in text.lower():
-                    target_date = datetime.now().strftime("%Y-%m-%d")
-                else:
-                    target_date = result["data"]["date"]
-                
-                # Prepara i dati dell'evento
-                event_data = {
-                    "id": len(load_events()) + 1,
-                    "title": result["data"]["title"],
-                    "description": result["data"]["description"],
-                    "start_datetime": f"{target_date} {result['data'].get('time', '09:00')}",
-                    "end_datetime": f"{target_date} {result['data'].get('time', '10:00')}",
-                    "event_type": result["data"]["event_type"],
-                    "is_all_day": False,
-                    "location": "",
-                    "attendees": None,
-                    "recurring": None,
-                    "created_at": datetime.now(),
-                    "updated_at": datetime.now()
-                }
-                
-                # Aggiungi l'evento
-                add_event(event_data)
-                self.logger.info(f"Evento aggiunto: {event_data}")
-            
-            elif result["action"] == "delete_task":
-                delete_task(result["data"]["title"])
-                self.logger.info(f"Task eliminata: {result['data']['title']}")
-            
-            return result["response"]
-            
-        except Exception as e:
-            self.logger.error(f"Errore durante l'elaborazione del comando: {e}")
-            return "Mi dispiace, si è verificato un errore durante l'elaborazione del comando."
+            return f"{data['label'].capitalize()}: {items}{' e altri' if more is not None else ''}."
+
+        elif action == "next_event":
+            now = datetime.now()
+            events, _ = agenda_page(now, now + timedelta(days=365), limit=10)
+            events = events[pd.to_datetime(events["start_datetime"]) >= now] if not events.empty else events
+            if events.empty:
+                return "Non hai impegni in programma."
+            event = events.iloc[0]
+            return f"Il prossimo impegno è {event['title']} il {pd.Timestamp(event['start_datetime']).strftime('%d/%m alle %H:%M')}."
+
+        return response
+
+    def target_date(self, text, data):
+        """Data del comando: le date relative nel testo hanno la precedenza su quella del modello"""
+        if re.search(r"\bdomani\b", text, re.IGNORECASE):
+            return (datetime.now() + timedelta(days=1)).strftime("%Y-%m-%d")
+        elif re.search(r"\boggi\b", text, re.IGNORECASE):
+            return datetime.now().strftime("%Y-%m-%d")
+        return data.get("date") or datetime.now().strftime("%Y-%m-%d")
+
+    def find_free_slot(self, text, data):
+        """Cerca i primi buchi liberi nel giorno richiesto (o nel resto della settimana)"""
+        duration = timedelta(minutes=int(data.get("duration_minutes") or 60))
+        start = datetime.strptime(self.target_date(text, data), "%Y-%m-%d")
+        if "settimana" in text.lower():
+            end = start + timedelta(days=7 - start.weekday())
+        else:
+            end = start + timedelta(days=1)
+        # Non proporre orari già passati
+        start = max(start, datetime.now())
+
+        slots = find_free_slots(duration, start, end)
+        if not slots:
+            return "Non ho trovato buchi liberi abbastanza lunghi nell'orario di lavoro."
+        text_slots = ", ".join(
+            f"{slot_start.strftime('%d/%m')} {slot_start.strftime('%H:%M')}-{slot_end.strftime('%H:%M')}"
+            for slot_start, slot_end in slots
+        )
+        return f"Sei libero: {text_slots}."
 
     def handle_voice_command(self):
         """Gestisce l'intero processo di comando vocale."""